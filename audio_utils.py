@@ -0,0 +1,48 @@
+import subprocess
+
+import numpy as np
+
+from ffmpeg_utils import FFMPEG_BINARY
+
+
+def rms_envelope(audio, sample_rate, frame_duration=0.05):
+    """
+    Returns the RMS energy of consecutive frame_duration long frames of a mono float audio array.
+    """
+    frame_length = max(1, int(sample_rate * frame_duration))
+    num_frames = len(audio) // frame_length
+    frames = np.asarray(audio[:num_frames * frame_length], dtype=np.float32).reshape(num_frames, frame_length)
+    return np.sqrt(np.mean(np.square(frames), axis=1))
+
+
+def find_silence_splits(audio, sample_rate, num_chunks, search_window=10.0, frame_duration=0.05):
+    """
+    Splits audio into num_chunks parts of roughly equal length, moving every boundary to the quietest
+    frame within search_window seconds around it. Returns a list of num_chunks + 1 sample offsets.
+    """
+    frame_length = max(1, int(sample_rate * frame_duration))
+    envelope = rms_envelope(audio, sample_rate, frame_duration)
+    if num_chunks <= 1 or len(envelope) < num_chunks:
+        return [0, len(audio)]
+    half_window = max(1, int(search_window / frame_duration / 2))
+    split_frames = [0]
+    for k in range(1, num_chunks):
+        target = k * len(envelope) // num_chunks
+        low = max(target - half_window, split_frames[-1] + 1)
+        high = min(target + half_window, len(envelope))
+        if low >= high:
+            continue
+        split_frames.append(low + int(np.argmin(envelope[low:high])))
+    return [frame * frame_length for frame in split_frames] + [len(audio)]
+
+
+def load_audio(audio_file, sample_rate=16000):
+    """
+    Decodes the audio of any file ffmpeg reads into a mono float32 array at sample_rate.
+    """
+    cmd = [FFMPEG_BINARY, "-nostdin", "-loglevel", "error", "-i", str(audio_file), "-map", "0:a:0", "-vn",
+           "-f", "s16le", "-ac", "1", "-ar", str(sample_rate), "-"]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.decode(errors='replace')}")
+    return np.frombuffer(result.stdout, dtype=np.int16).astype(np.float32) / 32768.0
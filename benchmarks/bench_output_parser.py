@@ -0,0 +1,93 @@
+"""
+Throughput of output_parser on multi-MB synthetic GPT completions, whole text and streamed in small chunks,
+next to the previous regex parser (several re.sub passes and a lazy DOTALL re.findall).
+
+    python benchmarks/bench_output_parser.py [size_mb]
+"""
+import random
+import re
+import sys
+import time
+
+import synthetic  # noqa: E402  (puts the repository root on sys.path)
+from output_parser import MomentParser, adjust_moments_timestamps, parse_moments  # noqa: E402
+
+
+def regex_parse(file_content):
+    """
+    The regex parser output_parser used before the state machine, without timestamp adjustment.
+    """
+    text = re.sub(r'\n+', '\n', file_content)
+    text = re.sub(r'\d+\.\s*', '', text)
+    text = text.replace("\t", "")
+    text = '\n'.join(line.strip() for line in text.split('\n'))
+    text = text.replace(" Timestamp:", "\nTimestamp:").replace(" -> ", "->")
+    pattern = (r'(?:Title(?: of moment)?: )?(.*?)\nHashtags: (.*?)\nDescription: (.*?)'
+               r'\nTimestamp: ([0-9:]+)(->|-)([0-9:]+)')
+    return re.findall(pattern, text, re.DOTALL)
+
+
+def synthetic_output(size_mb, malformed=0.05, seed=0):
+    """
+    Well formed moments with multi-line descriptions, a malformed fraction without timestamps in between.
+    """
+    rng = random.Random(seed)
+    blocks = []
+    size = 0
+    start = 0
+    while size < size_mb * 1024 * 1024:
+        description = "\n".join(" ".join(rng.choice(synthetic.WORDS) for _ in range(20)) for _ in range(3))
+        block = synthetic.make_completion([(start, start + 60)]).replace(
+            "Description: What happens at moment 1 of the video.", "Description: " + description)
+        if rng.random() < malformed:
+            block = block[:block.index("Timestamp:")]
+        blocks.append(block)
+        size += len(block) + 2
+        start += 60
+    return "\n\n".join(blocks)
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def streamed(text, chunk_size=64):
+    parser = MomentParser()
+    for i in range(0, len(text), chunk_size):
+        parser.feed(text[i:i + chunk_size])
+    parser.close()
+    return parser
+
+
+def main():
+    size_mb = float(sys.argv[1]) if len(sys.argv) > 1 else 4.0
+    text = synthetic_output(size_mb)
+    megabytes = len(text.encode("utf-8")) / 1024 / 1024
+
+    parser, parse_time = timed(lambda: parse_moments(text))
+    stream_parser, stream_time = timed(lambda: streamed(text))
+    assert stream_parser.moments == parser.moments
+    _, adjust_time = timed(lambda: adjust_moments_timestamps(parser.moments))
+    matches, regex_time = timed(lambda: regex_parse(text))
+
+    print(f"{megabytes:.1f} MB of completions")
+    print(f"state machine:       {megabytes / parse_time:8.1f} MB/s  {len(parser.moments)} moments, "
+          f"rejected {parser.rejected}")
+    print(f"streamed (64 B):     {megabytes / stream_time:8.1f} MB/s")
+    print(f"adjust timestamps:   {adjust_time * 1000:8.1f} ms")
+    print(f"regex parser:        {megabytes / regex_time:8.1f} MB/s  {len(matches)} moments")
+
+    # Moments without timestamps, where the lazy groups of the regex rescan the rest of the text from every
+    # start position; the regex time grows about tenfold with every doubling of the text
+    block = synthetic_output(1e-9, malformed=1.0)
+    truncated = "\n\n".join([block] * 10)
+    _, parse_time = timed(lambda: parse_moments(truncated))
+    _, regex_time = timed(lambda: regex_parse(truncated))
+    print(f"{len(truncated) / 1024:.0f} KB without timestamps: state machine {parse_time * 1000:.1f} ms, "
+          f"regex parser {regex_time * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Compares SegmentIndex overlap queries with the linear scan of VideoProcessor.filter_json_by_time
+on a synthetic 10k-segment transcript.
+
+    python benchmarks/bench_segment_index.py
+"""
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from segment_index import SegmentIndex  # noqa: E402
+from video_creator import VideoProcessor  # noqa: E402
+
+
+def synthetic_segments(count=10000, seed=0):
+    rng = random.Random(seed)
+    segments = []
+    t = 0.0
+    for i in range(count):
+        start = t + rng.uniform(0.0, 0.5)
+        end = start + rng.uniform(1.0, 8.0)
+        segments.append({"id": i, "start": start, "end": end, "text": f" segment {i}"})
+        t = end
+    return segments
+
+
+def synthetic_windows(segments, count=50, length=70.0, seed=1):
+    rng = random.Random(seed)
+    duration = segments[-1]["end"]
+    starts = sorted(rng.uniform(0.0, duration - length) for _ in range(count))
+    return [(start, start + length) for start in starts]
+
+
+def best_of(function, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    segments = synthetic_segments()
+    windows = synthetic_windows(segments)
+
+    build_time = best_of(lambda: SegmentIndex(segments))
+    index = SegmentIndex(segments)
+    for window_start, window_end in windows:
+        assert index.overlapping(window_start, window_end) == \
+            VideoProcessor.filter_json_by_time(segments, window_start, window_end)
+
+    scan_time = best_of(lambda: [VideoProcessor.filter_json_by_time(segments, *window) for window in windows])
+    index_time = best_of(lambda: [index.overlapping(*window) for window in windows])
+    print(f"{len(segments)} segments, {len(windows)} moments")
+    print(f"linear scan:  {scan_time * 1000:8.2f} ms")
+    print(f"index build:  {build_time * 1000:8.2f} ms")
+    print(f"index query:  {index_time * 1000:8.2f} ms ({scan_time / index_time:.0f}x faster than the scan)")
+
+
+if __name__ == "__main__":
+    main()
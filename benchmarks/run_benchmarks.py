@@ -0,0 +1,215 @@
+"""
+Offline benchmark suite: times output parsing, subtitle building, GPT chunking against a fake client and
+full moment renders on synthetic inputs, without YouTube, OpenAI or a GPU.
+
+    python benchmarks/run_benchmarks.py                    # compare with benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --update_baseline  # record the current timings as the baseline
+
+Exits with status 1 when a benchmark is slower than its baseline by more than --threshold.
+Baselines are machine specific, record one per machine before starting performance work.
+"""
+import argparse
+import json
+import platform
+import re
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import synthetic  # noqa: E402  (puts the repository root on sys.path)
+from gpt_engine import FakeChatClient  # noqa: E402
+from moments_creating_gpt import GptProcessor  # noqa: E402
+from output_parser import parse_file  # noqa: E402
+from video_creator import RENDER_BACKENDS, VideoProcessor, release_video_clips  # noqa: E402
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baseline.json"
+# Timing differences below this many seconds are noise, whatever the relative change
+MIN_REGRESSION_SECONDS = 0.005
+
+
+class WordEncoding:
+    """
+    Stand-in for the tiktoken encoding: words and punctuation marks count as tokens, which is close enough
+    to English BPE token counts to produce realistic chunking.
+    """
+
+    pattern = re.compile(r"\w+|[^\w\s]")
+
+    def encode(self, text):
+        return self.pattern.findall(text)
+
+
+def best_of(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def bench_parse_file(work_dir, repeat):
+    text = synthetic.make_completion(synthetic.spaced_moments(4 * 3600))
+    moments = parse_file(text)
+    seconds = best_of(lambda: parse_file(text), repeat)
+    return {"parse_file": {"seconds": seconds, "bytes": len(text), "moments": len(moments)}}
+
+
+def bench_create_subs(work_dir, repeat):
+    duration = 4 * 3600
+    folder = work_dir / "transcript_only"
+    folder.mkdir(parents=True, exist_ok=True)
+    transcribe_file = folder / "transcribe.json"
+    if not transcribe_file.is_file():
+        with open(transcribe_file, "w") as f:
+            json.dump(synthetic.make_transcript(duration), f)
+    processor = VideoProcessor(folder, render_workers=1)
+    processor.load_transcribe_data(transcribe_file)
+    processor.movie_duration = duration
+    moments = parse_file(synthetic.make_completion(synthetic.spaced_moments(duration)))
+    seconds = best_of(lambda: [processor.create_subs_for_moment(moment) for moment in moments], repeat)
+    return {"create_subs_for_moment": {"seconds": seconds, "segments": len(processor.transcribe_data),
+                                       "moments": len(moments)}}
+
+
+def bench_gpt_chunking(work_dir, repeat):
+    duration = 2 * 3600
+    segments = synthetic.make_transcript(duration)["segments"]
+    completion = synthetic.make_completion([(0, 60)])
+    results = {}
+    for model in ("gpt-3.5-turbo", "gpt-3.5-turbo-16k"):
+        client = FakeChatClient(completion)
+        processor = GptProcessor(model, client=client, cache_dir=None, encoding=WordEncoding(),
+                                 prompt_path=str(REPO_ROOT / "prompts" / "sample_prompt.txt"))
+        seconds = best_of(lambda: processor.find_moments("Synthetic video", segments), repeat)
+        results[f"gpt_chunking[{model}]"] = {"seconds": seconds, "segments": len(segments),
+                                             "requests": len(client.calls) // repeat}
+    return results
+
+
+def bench_render(work_dir, repeat, durations, backends, encode_settings=None):
+    results = {}
+    size = (1280, 720)
+    for duration in durations:
+        name = f"video_{duration}s"
+        folder = synthetic.make_video_folder(work_dir / "videos", name, duration, size=size)
+        video_file = str(folder / (name + ".mp4"))
+        for backend in backends:
+            processor = VideoProcessor(folder, render_workers=1, backend=backend, encode_settings=encode_settings)
+            processor.load_transcribe_data(folder / "transcribe.json")
+            processor.movie_duration = duration
+            # A 35 second moment at the end of the video, so seeking into long sources is part of the timing
+            start = duration - 35
+            moment = {"start_timestamp": f"{start // 60}:{start % 60:02}",
+                      "end_timestamp": f"{(duration - 10) // 60}:{(duration - 10) % 60:02}"}
+            subs = processor.create_subs_for_moment(moment)
+            out_dir = work_dir / "renders" / f"{backend}_{name}"
+            out_dir.mkdir(parents=True, exist_ok=True)
+
+            def render():
+                try:
+                    RENDER_BACKENDS[backend](video_file, size, subs, str(out_dir / "part_1"),
+                                             processor.subtitle_style, processor.encode_settings)
+                finally:
+                    release_video_clips()
+
+            key = f"render[{backend},{duration}s]"
+            try:
+                seconds = best_of(render, repeat)
+            except Exception as ex:
+                print(f"{key}: skipped, {ex}")
+                continue
+            output_seconds = sum(to_t - from_t for (from_t, to_t), _ in subs)
+            results[key] = {"seconds": seconds, "output_seconds": output_seconds,
+                            "realtime_speed": output_seconds / seconds}
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns the names of the benchmarks slower than their baseline by more than threshold (a fraction).
+    """
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get("results", {}).get(name)
+        if reference is None:
+            print(f"{name:<40} {result['seconds']:10.4f}s  (no baseline)")
+            continue
+        change = result["seconds"] / reference["seconds"] - 1 if reference["seconds"] else 0.0
+        regressed = change > threshold and result["seconds"] - reference["seconds"] > MIN_REGRESSION_SECONDS
+        print(f"{name:<40} {result['seconds']:10.4f}s  baseline {reference['seconds']:10.4f}s  "
+              f"{change:+7.1%}{'  REGRESSION' if regressed else ''}")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline ClipMaker benchmarks")
+    parser.add_argument("--work_dir", type=str, default=str(Path(tempfile.gettempdir()) / "clipmaker_benchmarks"),
+                        help="Directory of generated inputs (reused across runs) and rendered outputs")
+    parser.add_argument("--baseline", type=str, default=str(DEFAULT_BASELINE), help="Baseline JSON file")
+    parser.add_argument("--output", type=str, default=None, help="Also write the results to this JSON file")
+    parser.add_argument("--update_baseline", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Allowed slowdown against the baseline, as a fraction")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per benchmark, the fastest is kept")
+    parser.add_argument("--render_repeat", type=int, default=1, help="Runs per render benchmark")
+    parser.add_argument("--durations", type=int, nargs="+", default=[60, 600],
+                        help="Lengths in seconds of the synthetic source videos")
+    parser.add_argument("--render_backends", type=str, nargs="+", default=["ffmpeg", "moviepy"],
+                        choices=sorted(RENDER_BACKENDS), help="Render backends to time")
+    parser.add_argument("--preset", type=str, default="medium", help="libx264 preset of the render benchmarks")
+    parser.add_argument("--only", type=str, default=None, help="Run only benchmarks whose name contains this")
+    args = parser.parse_args()
+
+    work_dir = Path(args.work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    suites = {
+        "parse_file": lambda: bench_parse_file(work_dir, args.repeat),
+        "create_subs_for_moment": lambda: bench_create_subs(work_dir, args.repeat),
+        "gpt_chunking": lambda: bench_gpt_chunking(work_dir, args.repeat),
+        "render": lambda: bench_render(work_dir, args.render_repeat, args.durations, args.render_backends,
+                                       {"preset": args.preset}),
+    }
+    results = {}
+    for name, suite in suites.items():
+        if args.only and args.only not in name:
+            continue
+        results.update(suite())
+
+    report = {"machine": {"platform": platform.platform(), "python": platform.python_version(),
+                          "processor": platform.processor()},
+              "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    baseline_path = Path(args.baseline)
+    if args.update_baseline or not baseline_path.is_file():
+        baseline = {}
+        if baseline_path.is_file():
+            with open(baseline_path) as f:
+                baseline = json.load(f)
+        # Benchmarks left out with --only keep their previous baseline
+        report["results"] = dict(baseline.get("results", {}), **results)
+        with open(baseline_path, "w") as f:
+            json.dump(report, f, indent=2)
+        for name, result in results.items():
+            print(f"{name:<40} {result['seconds']:10.4f}s")
+        print(f"Baseline written to {baseline_path}")
+        return 0
+
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""
+Synthetic inputs for the offline benchmarks: test pattern videos with a sine tone, Whisper-like transcripts,
+video metadata and canned GPT completions in the format output_parser.parse_file reads.
+"""
+import json
+import random
+import subprocess
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from ffmpeg_utils import FFMPEG_BINARY  # noqa: E402
+from moments_creating_gpt import format_seconds_to_minutes_seconds  # noqa: E402
+from transcript_store import write_transcript_store  # noqa: E402
+
+WORDS = ("the", "universe", "is", "not", "only", "stranger", "than", "we", "imagine", "but", "it", "may", "be",
+         "than", "we", "can", "imagine", "light", "travels", "through", "space", "at", "a", "constant", "speed",
+         "and", "nothing", "moves", "faster", "so", "what", "happens", "when", "you", "look", "at", "a", "star")
+
+
+def make_video(path, duration, size=(1280, 720), fps=25, gop=50):
+    """
+    Writes an H.264 test pattern video with a 440 Hz AAC tone. Existing files are kept, so inputs are
+    generated once per work directory.
+    """
+    path = Path(path)
+    if path.is_file():
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    (w, h) = size
+    cmd = [FFMPEG_BINARY, "-nostdin", "-loglevel", "error", "-y",
+           "-f", "lavfi", "-i", f"testsrc2=size={w}x{h}:rate={fps}:duration={duration}",
+           "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=44100:duration={duration}",
+           "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", "-g", str(gop),
+           "-c:a", "aac", "-shortest", str(path) + ".tmp.mp4"]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.decode(errors='replace')}")
+    Path(str(path) + ".tmp.mp4").replace(path)
+    return path
+
+
+def make_transcript(duration, seed=0):
+    """
+    Returns a Whisper-like result with back to back segments of 2-6 seconds and word timings.
+    """
+    rng = random.Random(seed)
+    segments = []
+    t = 0.0
+    while t < duration:
+        start = t + rng.uniform(0.0, 0.4)
+        end = min(start + rng.uniform(2.0, 6.0), duration)
+        if end <= start:
+            break
+        count = rng.randint(4, 14)
+        step = (end - start) / count
+        words = [{"word": " " + rng.choice(WORDS), "start": start + k * step, "end": start + (k + 1) * step,
+                  "probability": 0.9} for k in range(count)]
+        segments.append({"id": len(segments), "seek": 0, "start": start, "end": end,
+                         "text": "".join(word["word"] for word in words), "words": words})
+        t = end
+    return {"text": "".join(segment["text"] for segment in segments), "segments": segments, "language": "en"}
+
+
+def make_completion(moments, title="Synthetic video"):
+    """
+    Returns a GPT-like completion: a numbered list of moments with (start, end) seconds as timestamps.
+    """
+    blocks = []
+    for i, (start, end) in enumerate(moments, 1):
+        blocks.append(f"{i}. Title of moment: {title} moment {i}\n"
+                      f"Hashtags: #science #space #moment{i}\n"
+                      f"Description: What happens at moment {i} of the video.\n"
+                      f"Timestamp: {format_seconds_to_minutes_seconds(start)}->"
+                      f"{format_seconds_to_minutes_seconds(end)}")
+    return "\n\n".join(blocks)
+
+
+def spaced_moments(duration, length=60.0, every=90.0):
+    return [(start, start + length) for start in range(0, int(duration - length), int(every))]
+
+
+def make_video_folder(root, name, duration, size=(1280, 720), fps=25, moments=None):
+    """
+    Writes a complete video folder as the download, Whisper and GPT stages leave it:
+    <name>.mp4, transcribe.json (plus the columnar store), metadata.json and output.txt.
+    """
+    folder = Path(root, name)
+    folder.mkdir(parents=True, exist_ok=True)
+    make_video(folder / (name + ".mp4"), duration, size, fps)
+    transcribe_file = folder / "transcribe.json"
+    if not transcribe_file.is_file():
+        result = make_transcript(duration)
+        with open(transcribe_file, "w") as f:
+            json.dump(result, f)
+        write_transcript_store(result, transcribe_file)
+    with open(folder / "metadata.json", "w") as f:
+        json.dump({"title": f"Synthetic video {name}", "author": "benchmarks", "length": duration}, f)
+    with open(folder / "output.txt", "w", encoding="utf-8") as f:
+        f.write(make_completion(moments if moments is not None else spaced_moments(duration)))
+    return folder
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+MANIFEST_NAME = "manifest.json"
+
+
+def file_digest(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class BuildManifest:
+    """
+    Per-video record of the input digests, parameters and outputs of every pipeline stage.
+    A stage has to run again only when one of its inputs or parameters changed or an output is missing.
+    Digests are remembered by file size and mtime, so large sources are hashed once.
+    """
+
+    def __init__(self, folder):
+        self.folder = Path(folder)
+        self.path = self.folder / MANIFEST_NAME
+        self.data = {"digests": {}, "stages": {}}
+        if self.path.is_file():
+            with open(self.path, encoding="utf-8") as f:
+                self.data = json.load(f)
+
+    def _relative(self, path):
+        path = Path(path)
+        try:
+            return str(path.relative_to(self.folder))
+        except ValueError:
+            return str(path)
+
+    def digest(self, path):
+        stat = os.stat(path)
+        key = self._relative(path)
+        cached = self.data["digests"].get(key)
+        if cached and cached["size"] == stat.st_size and cached["mtime_ns"] == stat.st_mtime_ns:
+            return cached["sha256"]
+        sha256 = file_digest(path)
+        self.data["digests"][key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256}
+        return sha256
+
+    def _inputs(self, inputs):
+        return {self._relative(path): self.digest(path) for path in inputs}
+
+    @staticmethod
+    def _params(params):
+        # Round trip through JSON so tuples and lists compare equal to what was stored
+        return json.loads(json.dumps(params or {}, sort_keys=True))
+
+    def is_fresh(self, stage, inputs=(), params=None):
+        """
+        True when stage ran before with the same input contents and parameters and all its outputs still exist.
+        """
+        record = self.data["stages"].get(stage)
+        if record is None:
+            return False
+        if not all((self.folder / output).exists() for output in record["outputs"]):
+            return False
+        if any(not Path(path).exists() for path in inputs):
+            return False
+        return record["inputs"] == self._inputs(inputs) and record["params"] == self._params(params)
+
+    def record(self, stage, inputs=(), params=None, outputs=()):
+        self.data["stages"][stage] = {
+            "inputs": self._inputs(inputs),
+            "params": self._params(params),
+            "outputs": [self._relative(output) for output in outputs],
+        }
+        self.save()
+
+    def invalidate(self, stage):
+        if self.data["stages"].pop(stage, None) is not None:
+            self.save()
+
+    def save(self):
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,90 @@
+import math
+import shutil
+import subprocess
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+
+def load_font(font, fontsize):
+    """
+    Loads a font by file name or by fontconfig name (what ImageMagick accepts for TextClip),
+    falling back to the Pillow default font.
+    """
+    try:
+        return ImageFont.truetype(font, fontsize)
+    except OSError:
+        pass
+    if shutil.which("fc-match"):
+        result = subprocess.run(["fc-match", "-f", "%{file}", font], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if result.returncode == 0 and result.stdout:
+            try:
+                return ImageFont.truetype(result.stdout.decode(), fontsize)
+            except OSError:
+                pass
+    print(f"Font {font} not found, using the default font")
+    return ImageFont.load_default(size=fontsize)
+
+
+class CaptionRenderer:
+    """
+    Renders caption bitmaps in-process with Pillow and keeps the most recently used ones in an LRU cache
+    keyed by text and style, so repeated captions are rasterized once.
+    With max_bytes set, the cache is also bounded by the total size of the cached bitmaps.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._cache = OrderedDict()
+        self._bytes = 0
+        self._fonts = {}
+
+    def _font(self, font, fontsize):
+        key = (font, fontsize)
+        if key not in self._fonts:
+            self._fonts[key] = load_font(font, fontsize)
+        return self._fonts[key]
+
+    def render(self, text, txt_color='white', stroke_color="black", stroke_width=1.5, fontsize=40,
+               font='ProximaNova-ExtraBold'):
+        """
+        Returns (rgb, mask): an HxWx3 uint8 image and an HxW float mask in [0, 1] of the centered caption.
+        """
+        key = (text, font, fontsize, txt_color, stroke_color, stroke_width)
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            return cached
+        pil_font = self._font(font, fontsize)
+        # ImageMagick strokes are centered on the glyph outline, Pillow draws them outside of it
+        pil_stroke_width = int(math.ceil(stroke_width / 2)) if stroke_width else 0
+        measure = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+        bbox = measure.multiline_textbbox((0, 0), text, font=pil_font, align="center", stroke_width=pil_stroke_width)
+        # Bitmap fonts report fractional boxes
+        left, top = math.floor(bbox[0]), math.floor(bbox[1])
+        right, bottom = math.ceil(bbox[2]), math.ceil(bbox[3])
+        image = Image.new("RGBA", (max(1, right - left), max(1, bottom - top)), (0, 0, 0, 0))
+        ImageDraw.Draw(image).multiline_text((-left, -top), text, font=pil_font, fill=txt_color, align="center",
+                                             stroke_width=pil_stroke_width, stroke_fill=stroke_color)
+        pixels = np.asarray(image)
+        rendered = (np.ascontiguousarray(pixels[:, :, :3]), pixels[:, :, 3] / 255.0)
+        self._cache[key] = rendered
+        self._bytes += rendered[0].nbytes + rendered[1].nbytes
+        while len(self._cache) > 1 and (len(self._cache) > self.max_entries
+                                        or self.max_bytes is not None and self._bytes > self.max_bytes):
+            (rgb, mask) = self._cache.popitem(last=False)[1]
+            self._bytes -= rgb.nbytes + mask.nbytes
+        return rendered
+
+    def prerender(self, texts, **style):
+        """
+        Renders a batch of captions, e.g. all captions of a moment, before compositing starts.
+        """
+        for text in texts:
+            self.render(text, **style)
+
+    def clear(self):
+        self._cache.clear()
+        self._bytes = 0
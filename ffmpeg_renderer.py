@@ -0,0 +1,326 @@
+import os
+
+from ffmpeg_utils import parse_rate, probe_keyframes, probe_reorder_delay, probe_video_stream, run_ffmpeg
+
+CROP_WIDTH = 850
+
+# Caption-free stretches shorter than this are re-encoded with their neighbours instead of stream copied
+MIN_COPY_DURATION = 2.0
+
+# libx264 profiles by the H.264 profile names ffprobe reports
+X264_PROFILES = {"Constrained Baseline": "baseline", "Baseline": "baseline", "Main": "main", "High": "high"}
+
+# libx264 B-frame settings giving the reorder delay, in frames, of a stream copied source
+X264_REORDER_PARAMS = {0: "bframes=0", 1: "bframes=3:b-pyramid=none", 2: "bframes=3:b-pyramid=normal"}
+
+ASS_HEADER = """[Script Info]
+ScriptType: v4.00+
+PlayResX: {width}
+PlayResY: {height}
+WrapStyle: 2
+ScaledBorderAndShadow: yes
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, \
+Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, \
+MarginV, Encoding
+Style: Default,{font},{fontsize},{txt_color},&H000000FF,{stroke_color},&H00000000,0,0,0,0,100,100,0,0,1,\
+{stroke_width},0,8,10,10,{margin_v},1
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+"""
+
+ASS_COLORS = {
+    "white": "&H00FFFFFF",
+    "black": "&H00000000",
+    "yellow": "&H0000FFFF",
+    "red": "&H000000FF",
+}
+
+
+def crop_box(video_size):
+    """
+    Returns (x, y, width, height) of the centered vertical crop used by both render backends.
+    """
+    (w, h) = video_size
+    width = min(CROP_WIDTH, w)
+    return (w - width) // 2, 0, width, h
+
+
+def format_ass_time(seconds):
+    centiseconds = int(round(max(seconds, 0) * 100))
+    hours, centiseconds = divmod(centiseconds, 360000)
+    minutes, centiseconds = divmod(centiseconds, 6000)
+    seconds, centiseconds = divmod(centiseconds, 100)
+    return f"{hours}:{minutes:02}:{seconds:02}.{centiseconds:02}"
+
+
+def escape_ass_text(text):
+    # Braces start override blocks in ASS and line breaks are written as \N
+    text = text.replace("{", "(").replace("}", ")")
+    return "\\N".join(line.strip() for line in text.split("\n"))
+
+
+def encode_args(encode_settings=None):
+    """
+    libx264 arguments for the preset, crf and threads of encode_settings.
+    """
+    encode_settings = encode_settings or {}
+    args = ["-c:v", "libx264", "-pix_fmt", "yuv420p", "-preset", encode_settings.get("preset", "medium"),
+            "-crf", encode_settings.get("crf", 23)]
+    if encode_settings.get("threads"):
+        args += ["-threads", encode_settings["threads"]]
+    return args
+
+
+def write_ass_subtitles(subs, ass_path, frame_size, txt_color='white', stroke_color="black", stroke_width=1.5,
+                        fontsize=40, font='ProximaNova-ExtraBold', moment_start=None):
+    """
+    Writes the captions of a moment as an ASS file with times relative to moment_start (default: the first sub).
+    Caption placement matches video_creator.blend_caption: centered, top edge at 75% of the frame height.
+    """
+    (width, height) = frame_size
+    if moment_start is None:
+        moment_start = subs[0][0][0]
+    lines = [ASS_HEADER.format(width=width, height=height, font=font, fontsize=fontsize,
+                               txt_color=ASS_COLORS.get(txt_color, txt_color),
+                               stroke_color=ASS_COLORS.get(stroke_color, stroke_color),
+                               stroke_width=stroke_width, margin_v=int(height * 0.75))]
+    prev_end = moment_start
+    for (from_t, to_t), txt in subs:
+        # Subs may overlap after timestamps are truncated to seconds, keep events monotonic
+        from_t = max(from_t, prev_end)
+        prev_end = max(to_t, prev_end)
+        if not txt or to_t <= from_t:
+            continue
+        lines.append("Dialogue: 0,{},{},Default,,0,0,0,,{}\n".format(format_ass_time(from_t - moment_start),
+                                                                    format_ass_time(to_t - moment_start),
+                                                                    escape_ass_text(txt)))
+    with open(ass_path, "w", encoding="utf-8") as f:
+        f.write("".join(lines))
+
+
+def render_moment(video_file, video_size, subs, out_path, subtitle_style=None, encode_settings=None, start=None,
+                  end=None):
+    """
+    Cuts, crops and burns in captions of one moment with a single ffmpeg invocation.
+    Writes out_path + ".mp4"; no frames pass through Python. start and end default to the span of subs.
+    """
+    if start is None:
+        start = subs[0][0][0]
+    if end is None:
+        end = max(to_t for (_, to_t), _ in subs)
+    (x, y, width, height) = crop_box(video_size)
+    ass_path = out_path + ".ass"
+    write_ass_subtitles(subs, ass_path, (width, height), moment_start=start, **(subtitle_style or {}))
+    # ffmpeg runs inside the results folder so the subtitles filter gets a path without characters
+    # that would need filtergraph escaping
+    video_filter = f"crop={width}:{height}:{x}:{y},subtitles={os.path.basename(ass_path)}"
+    try:
+        run_ffmpeg(["-ss", f"{start:.3f}", "-i", os.path.abspath(video_file), "-t", f"{end - start:.3f}",
+                    "-vf", video_filter] + encode_args(encode_settings) +
+                   ["-c:a", "aac", os.path.abspath(out_path + ".mp4")],
+                   cwd=os.path.dirname(os.path.abspath(ass_path)))
+    finally:
+        os.remove(ass_path)
+
+
+def plan_smart_cut(subs, keyframes, min_copy_duration=MIN_COPY_DURATION):
+    """
+    Splits a moment into ("copy", start, end) pieces that start and end on keyframes and carry no captions,
+    and ("encode", start, end) pieces for everything else. Returns the pieces in time order.
+    """
+    start = subs[0][0][0]
+    end = max(to_t for (_, to_t), _ in subs)
+    captioned = [(from_t, to_t) for (from_t, to_t), txt in subs if txt]
+    # Caption-free gaps between the captioned spans
+    gaps = []
+    gap_start = start
+    for from_t, to_t in sorted(captioned):
+        if from_t > gap_start:
+            gaps.append((gap_start, from_t))
+        gap_start = max(gap_start, to_t)
+    if end > gap_start:
+        gaps.append((gap_start, end))
+
+    pieces = []
+    position = start
+    for gap_start, gap_end in gaps:
+        inner = [keyframe for keyframe in keyframes if gap_start <= keyframe <= gap_end]
+        if len(inner) < 2 or inner[-1] - inner[0] < min_copy_duration:
+            continue
+        if inner[0] > position:
+            pieces.append(("encode", position, inner[0]))
+        pieces.append(("copy", inner[0], inner[-1]))
+        position = inner[-1]
+    if end > position:
+        pieces.append(("encode", position, end))
+    return pieces
+
+
+def clip_subs(subs, start, end):
+    clipped = []
+    for (from_t, to_t), txt in subs:
+        if to_t <= start or from_t >= end:
+            continue
+        clipped.append(((max(from_t, start), min(to_t, end)), txt))
+    return clipped
+
+
+def can_stream_copy(video_size, stream):
+    """
+    Whether pieces of the source can be stream copied into a moment: the crop has to leave the frame unchanged
+    and libx264 has to encode the other pieces with the profile, pixel format and reorder delay of the source.
+    """
+    (_, _, width, height) = crop_box(video_size)
+    return ((width, height) == tuple(video_size) and stream.get("codec_name") == "h264"
+            and stream.get("pix_fmt") == "yuv420p" and stream.get("profile") in X264_PROFILES
+            and stream.get("reorder_frames") in X264_REORDER_PARAMS)
+
+
+def matching_encode_args(stream, encode_settings=None):
+    """
+    libx264 arguments for pieces joined with stream copied ones. The pieces get the profile, level, time base
+    and reorder delay of the source, so decoding times keep increasing across the joins, and repeat their
+    parameter sets at every keyframe, so they decode after a piece of the source.
+    """
+    args = encode_args(encode_settings) + ["-profile:v", X264_PROFILES[stream["profile"]]]
+    if int(stream.get("level") or 0) > 0:
+        args += ["-level:v", f"{int(stream['level']) / 10:.1f}"]
+    return args + ["-x264-params", "repeat-headers=1:" + X264_REORDER_PARAMS[stream["reorder_frames"]],
+                   "-video_track_timescale", stream["time_base"].partition("/")[2]]
+
+
+def frame_count(start, end, fps):
+    # Counted on the frame grid, so consecutive pieces neither drop nor repeat a frame at their boundary
+    return int(round(end * fps)) - int(round(start * fps))
+
+
+def render_moment_smart(video_file, video_size, subs, out_path, subtitle_style=None, encode_settings=None):
+    """
+    Stream copies the caption-free stretches of a moment between keyframes and re-encodes only the pieces
+    that carry captions, then joins the pieces with the concat demuxer and adds the audio of the moment in
+    one cut. Falls back to render_moment when the crop changes the frame or libx264 cannot match the source.
+    Copied pieces need closed GOPs, as H.264 sources with IDR keyframes have.
+    """
+    stream = probe_video_stream(video_file)
+    fps = parse_rate(stream.get("r_frame_rate", "0/1"))
+    stream["reorder_frames"] = int(round(probe_reorder_delay(video_file) * fps))
+    if not fps or not can_stream_copy(video_size, stream):
+        render_moment(video_file, video_size, subs, out_path, subtitle_style, encode_settings)
+        return
+    start = subs[0][0][0]
+    end = max(to_t for (_, to_t), _ in subs)
+    pieces = plan_smart_cut(subs, probe_keyframes(video_file, start, end))
+    if all(kind == "encode" for kind, _, _ in pieces):
+        render_moment(video_file, video_size, subs, out_path, subtitle_style, encode_settings)
+        return
+    source = os.path.abspath(video_file)
+    piece_paths = []
+    ass_paths = []
+    list_path = out_path + ".concat.txt"
+    video_only = out_path + ".video.mp4"
+    try:
+        for number, (kind, piece_start, piece_end) in enumerate(pieces):
+            piece_path = os.path.abspath(f"{out_path}.piece{number}.mp4")
+            piece_paths.append(piece_path)
+            frames = frame_count(piece_start, piece_end, fps)
+            if kind == "copy":
+                # Seeking half a frame late still opens the source at the keyframe the piece starts on, which
+                # is shifted to time zero instead of being cut by an edit list. The parameter sets of the source
+                # go in front of its keyframes as well.
+                run_ffmpeg(["-ss", f"{piece_start + 0.5 / fps:.6f}", "-i", source, "-map", "0:v:0", "-c:v", "copy",
+                            "-frames:v", frames, "-avoid_negative_ts", "make_zero", "-bsf:v", "h264_mp4toannexb",
+                            piece_path])
+                continue
+            ass_path = f"{out_path}.piece{number}.ass"
+            ass_paths.append(ass_path)
+            write_ass_subtitles(clip_subs(subs, piece_start, piece_end), ass_path, tuple(video_size),
+                                moment_start=piece_start, **(subtitle_style or {}))
+            # Seeking half a frame early keeps the first frame of the piece
+            run_ffmpeg(["-ss", f"{piece_start - 0.5 / fps:.6f}", "-i", source, "-map", "0:v:0", "-frames:v", frames,
+                        "-vf", f"setpts=PTS-STARTPTS,subtitles={os.path.basename(ass_path)}"] +
+                       matching_encode_args(stream, encode_settings) + [piece_path],
+                       cwd=os.path.dirname(piece_path))
+        with open(list_path, "w", encoding="utf-8") as f:
+            f.write("".join(f"file '{path}'\n" for path in piece_paths))
+        run_ffmpeg(["-f", "concat", "-safe", 0, "-i", os.path.abspath(list_path), "-c", "copy",
+                    os.path.abspath(video_only)])
+        mux_audio(video_only, video_file, start, end - start, out_path + ".mp4")
+    finally:
+        for path in piece_paths + ass_paths + [list_path, video_only]:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def proxy_size(video_size, height):
+    """
+    Frame size of a proxy of the cropped frame scaled to height, both sides even as yuv420p requires.
+    """
+    (_, _, width, crop_height) = crop_box(video_size)
+    height = min(height, crop_height) // 2 * 2
+    return max(2, int(round(width * height / crop_height / 2)) * 2), height
+
+
+def make_proxy(video_file, video_size, out_file, height=360, fps=12, encode_settings=None):
+    """
+    Decodes the source once into a small, already cropped proxy for previews. A keyframe every second
+    keeps cutting moments from the proxy cheap. Returns the proxy frame size.
+    """
+    (x, y, width, crop_height) = crop_box(video_size)
+    size = proxy_size(video_size, height)
+    encode_settings = dict({"preset": "ultrafast", "crf": 30}, **(encode_settings or {}))
+    run_ffmpeg(["-i", os.path.abspath(video_file),
+                "-vf", f"crop={width}:{crop_height}:{x}:{y},scale={size[0]}:{size[1]},fps={fps}",
+                "-g", fps] + encode_args(encode_settings) +
+               ["-c:a", "aac", "-b:a", "64k", "-ac", 1, os.path.abspath(out_file)])
+    return size
+
+
+def render_contact_sheet(video_file, start, end, out_file, columns=4, rows=3, tile_width=None):
+    """
+    Writes one image of columns x rows frames sampled evenly over start..end, a storyboard of the moment.
+    """
+    interval = max((end - start) / (columns * rows), 0.001)
+    scale = f"scale={tile_width}:-2," if tile_width else ""
+    video_filter = (f"select='isnan(prev_selected_t)+gte(t-prev_selected_t\\,{interval:.3f})',"
+                    f"{scale}tile={columns}x{rows}:padding=4:margin=4")
+    run_ffmpeg(["-ss", f"{start:.3f}", "-i", os.path.abspath(video_file), "-t", f"{end - start:.3f}",
+                "-vf", video_filter, "-frames:v", 1, "-q:v", 3, os.path.abspath(out_file)])
+
+
+def mux_audio(video_only_file, source_file, start, duration, out_file):
+    """
+    Copies the video of video_only_file and adds the audio of source_file from start on, encoded to AAC.
+    """
+    run_ffmpeg(["-i", os.path.abspath(video_only_file), "-ss", f"{start:.3f}", "-t", f"{duration:.3f}",
+                "-i", os.path.abspath(source_file), "-map", "0:v:0", "-map", "1:a:0?", "-c:v", "copy",
+                "-c:a", "aac", "-shortest", os.path.abspath(out_file)])
+
+
+def mux_audio_spans(video_only_file, source_file, spans, out_file, has_audio=True):
+    """
+    Copies the video of video_only_file and adds the audio of source_file cut into the (start, end) spans in
+    seconds and joined in order, for videos assembled from the same spans. Spans may leave gaps, overlap or
+    repeat. Without source audio only the video is copied.
+    """
+    if not has_audio or not spans:
+        run_ffmpeg(["-i", os.path.abspath(video_only_file), "-map", "0:v:0", "-c:v", "copy", os.path.abspath(out_file)])
+        return
+    # Adjacent spans are one cut
+    cuts = [list(spans[0])]
+    for start, end in spans[1:]:
+        if abs(start - cuts[-1][1]) < 1e-6:
+            cuts[-1][1] = end
+        else:
+            cuts.append([start, end])
+    # The source is opened at the earliest cut, so long sources are not decoded from their beginning
+    offset = min(start for start, _ in cuts)
+    length = max(end for _, end in cuts) - offset
+    graph = "".join(f"[1:a]atrim=start={start - offset:.6f}:end={end - offset:.6f},asetpts=PTS-STARTPTS[a{k}];"
+                    for k, (start, end) in enumerate(cuts))
+    graph += "".join(f"[a{k}]" for k in range(len(cuts))) + f"concat=n={len(cuts)}:v=0:a=1[audio]"
+    run_ffmpeg(["-i", os.path.abspath(video_only_file), "-ss", f"{offset:.6f}", "-t", f"{length:.6f}",
+                "-i", os.path.abspath(source_file), "-filter_complex", graph, "-map", "0:v:0", "-map", "[audio]",
+                "-c:v", "copy", "-c:a", "aac", os.path.abspath(out_file)])
@@ -0,0 +1,95 @@
+import json
+import os
+import subprocess
+
+FFMPEG_BINARY = os.environ.get("FFMPEG_BINARY", "ffmpeg")
+FFPROBE_BINARY = os.environ.get("FFPROBE_BINARY", "ffprobe")
+
+
+def run_ffmpeg(args, cwd=None):
+    """
+    Runs ffmpeg with the given arguments and raises RuntimeError with its stderr on failure.
+    """
+    cmd = [FFMPEG_BINARY, "-hide_banner", "-loglevel", "error", "-y"] + [str(arg) for arg in args]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.decode(errors='replace')}")
+
+
+def run_ffprobe(args):
+    """
+    Runs ffprobe with the given arguments and returns its parsed JSON output.
+    """
+    cmd = [FFPROBE_BINARY, "-v", "error", "-of", "json"] + [str(arg) for arg in args]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe failed: {result.stderr.decode(errors='replace')}")
+    return json.loads(result.stdout)
+
+
+def probe_video(video_file):
+    """
+    Returns duration in seconds, (width, height) and frame rate of the first video stream.
+    """
+    info = run_ffprobe(["-select_streams", "v:0", "-show_entries",
+                        "stream=width,height,r_frame_rate:format=duration", video_file])
+    stream = info["streams"][0]
+    fps = parse_rate(stream.get("r_frame_rate", "0/1"))
+    return float(info["format"]["duration"]), (int(stream["width"]), int(stream["height"])), fps
+
+
+def parse_rate(rate):
+    """
+    Value of an ffprobe rational such as "30000/1001", 0.0 for an undefined one.
+    """
+    numerator, _, denominator = rate.partition("/")
+    return float(numerator) / float(denominator or 1) if float(denominator or 1) else 0.0
+
+
+def probe_video_stream(video_file):
+    """
+    Returns codec_name, profile, level, pix_fmt, time_base and r_frame_rate of the first video stream,
+    the parameters re-encoded pieces have to share with stream copied ones.
+    """
+    info = run_ffprobe(["-select_streams", "v:0", "-show_entries",
+                        "stream=codec_name,profile,level,pix_fmt,time_base,r_frame_rate", video_file])
+    return info["streams"][0]
+
+
+def probe_keyframes(video_file, start=None, end=None):
+    """
+    Returns the sorted presentation times of the keyframes of the first video stream, optionally
+    only those around [start, end].
+    """
+    args = ["-select_streams", "v:0", "-show_entries", "packet=pts_time,flags"]
+    if start is not None and end is not None:
+        args += ["-read_intervals", f"{max(start - 1, 0):.3f}%{end + 1:.3f}"]
+    info = run_ffprobe(args + [video_file])
+    return sorted(float(packet["pts_time"]) for packet in info.get("packets", [])
+                  if "K" in packet.get("flags", "") and packet.get("pts_time") not in (None, "N/A"))
+
+
+def probe_reorder_delay(video_file):
+    """
+    Returns how many seconds the decoding times of the first video stream run ahead of its presentation
+    times, 0.0 for streams without B-frames.
+    """
+    info = run_ffprobe(["-select_streams", "v:0", "-read_intervals", "%+#1", "-show_entries",
+                        "packet=pts_time,dts_time", video_file])
+    packet = (info.get("packets") or [{}])[0]
+    if packet.get("pts_time") in (None, "N/A") or packet.get("dts_time") in (None, "N/A"):
+        return 0.0
+    return float(packet["pts_time"]) - float(packet["dts_time"])
+
+
+def extract_audio(video_file, audio_file, sample_rate=None, mono=False):
+    """
+    Writes the first audio stream of video_file to audio_file without decoding the video stream.
+    The codec follows the audio_file extension; sample_rate and mono resample the audio on the way.
+    """
+    args = ["-i", video_file, "-map", "0:a:0", "-vn", "-sn", "-dn"]
+    if sample_rate:
+        args += ["-ar", sample_rate]
+    if mono:
+        args += ["-ac", 1]
+    run_ffmpeg(args + [audio_file])
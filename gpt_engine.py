@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+import openai
+
+
+class OpenAIChatClient:
+    """
+    Chat completion client backed by the openai package. api_base can point to a local stand-in server.
+    """
+
+    def __init__(self, api_base=None):
+        self.api_base = api_base
+
+    def complete(self, model, prompt):
+        kwargs = {"api_base": self.api_base} if self.api_base else {}
+        completion = openai.ChatCompletion.create(model=model, messages=[{"role": "user", "content": prompt}],
+                                                  **kwargs)
+        return completion.choices[0].message['content']
+
+
+class FakeChatClient:
+    """
+    Offline client for tests and benchmarks. responses is a string, a list of strings served in turn,
+    or a callable taking (model, prompt).
+    """
+
+    def __init__(self, responses="", delay=0.0):
+        self.responses = responses
+        self.delay = delay
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def complete(self, model, prompt):
+        with self._lock:
+            self.calls.append((model, prompt))
+            call_index = len(self.calls) - 1
+        if self.delay:
+            time.sleep(self.delay)
+        if callable(self.responses):
+            return self.responses(model, prompt)
+        if isinstance(self.responses, list):
+            return self.responses[call_index % len(self.responses)]
+        return self.responses
+
+
+class RateLimiter:
+    """
+    Sliding one-minute window shared by all threads, limiting requests and tokens sent per minute.
+    None disables a limit.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._events = deque()
+        self._tokens = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=0):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._events and now - self._events[0][0] >= 60:
+                    self._tokens -= self._events.popleft()[1]
+                requests_ok = self.requests_per_minute is None or len(self._events) < self.requests_per_minute
+                # A request larger than the whole budget is let through once the window is empty
+                tokens_ok = (self.tokens_per_minute is None or not self._events
+                             or self._tokens + tokens <= self.tokens_per_minute)
+                if requests_ok and tokens_ok:
+                    self._events.append((now, tokens))
+                    self._tokens += tokens
+                    return
+                wait = self._events[0][0] + 60 - now
+            time.sleep(max(wait, 0.05))
+
+
+class ResponseCache:
+    """
+    On-disk cache of completions, one JSON file per (model, prompt hash).
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+
+    def _path(self, model, prompt):
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        return self.cache_dir / model / f"{prompt_hash}.json"
+
+    def get(self, model, prompt):
+        path = self._path(model, prompt)
+        if not path.is_file():
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)["completion"]
+
+    def put(self, model, prompt, completion):
+        path = self._path(model, prompt)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"model": model, "completion": completion}, f)
+        os.replace(tmp_path, path)
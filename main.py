@@ -5,34 +5,177 @@ from youtube_scrapper import YouTubeDownloader
 from subtitle_creator import TranscriptionProcessor
 from moments_creating_gpt import GptProcessor
 from video_creator import VideoProcessor
+from pipeline import Stage, StreamingPipeline
+from metrics import MEASURED_STAGES, recorder
+from work_queue import STAGES, QueueWorker, WorkQueue
 import logging
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(name)s %(levelname)s:%(message)s')
 logger = logging.getLogger(__name__)
 
 
+def create_downloader(args, data_dir):
+    return YouTubeDownloader(data_dir, audio_format=args.audio_format, max_workers=args.download_workers)
+
+
+def create_transcription_processor(args):
+    return TranscriptionProcessor(model_name=args.whisper_model, device=args.cuda, threads=args.whisper_threads,
+                                  precision=args.whisper_precision, chunk_workers=args.whisper_chunk_workers)
+
+
+def create_gpt_processor(args):
+    return GptProcessor(model_name=args.gpt_model, max_concurrency=args.gpt_concurrency,
+                        folder_workers=args.gpt_folder_workers, requests_per_minute=args.gpt_requests_per_minute,
+                        tokens_per_minute=args.gpt_tokens_per_minute, cache_dir=args.gpt_cache_dir,
+                        overlap_lines=args.gpt_overlap_lines, ranking=args.gpt_ranking,
+                        ranking_top_k=args.gpt_ranking_top_k, ranking_window=args.gpt_ranking_window)
+
+
+def create_video_processor(args, data_dir):
+    return VideoProcessor(data_dir, render_workers=args.render_workers, backend=args.render_backend,
+                          encode_settings={"preset": args.preset, "crf": args.crf, "threads": args.encode_threads},
+                          preview_settings={"kind": args.preview_kind, "height": args.preview_height,
+                                            "fps": args.preview_fps},
+                          max_render_memory=args.max_render_memory)
+
+
+def run_streaming(args, data_dir):
+    """
+    Every video goes through download, transcription, GPT and rendering on its own,
+    so the first clips are rendered while the rest of the channel is still downloading.
+    """
+    downloader = create_downloader(args, data_dir)
+    gpt_processor = create_gpt_processor(args)
+
+    def transcription_handler():
+        processor = create_transcription_processor(args)
+
+        def handle(folder):
+            processor.transcribe_folder(folder)
+            return folder
+        return handle
+
+    def gpt_handler():
+        def handle(folder):
+            gpt_processor.process_folder(folder)
+            return folder
+        return handle
+
+    def render_handler():
+        processor = create_video_processor(args, data_dir)
+
+        def handle(folder):
+            processor.process_single_movie(folder)
+            return folder
+        return handle
+
+    streaming_pipeline = StreamingPipeline([
+        Stage("YouTubeDownloader", lambda: downloader.download_channel_video, workers=args.download_workers),
+        Stage("Whisper", transcription_handler, workers=args.transcribe_workers),
+        Stage("ChatGPT ideas creating", gpt_handler, workers=args.gpt_folder_workers),
+        Stage("VideoProcessor", render_handler, workers=args.render_stage_workers),
+    ])
+    links = downloader.get_channel_video_urls(args.channel_link, num_videos=args.num_video)
+    done = streaming_pipeline.run(links)
+    logger.info(f"Rendered {len(done)} of {len(links)} videos")
+    if downloader.failed:
+        logger.error(f"Failed to download: {downloader.failed}")
+
+
+def create_queue_handlers(args, data_dir):
+    """
+    Queue handlers of every stage, each calling the same processor entry point as the other modes.
+    Processors are created on first use, so a render node never loads a Whisper model.
+    """
+    processors = {}
+
+    def processor(name, factory):
+        if name not in processors:
+            processors[name] = factory()
+        return processors[name]
+
+    def download(job):
+        downloader = processor("download", lambda: create_downloader(args, data_dir))
+        if downloader.download_channel_video(job.payload) is None:
+            raise RuntimeError(f"Could not download {job.payload}")
+
+    def transcribe(job):
+        folder = data_dir / job.video_id
+        processor("transcribe", lambda: create_transcription_processor(args)).transcribe_folder(folder)
+
+    def gpt(job):
+        folder = data_dir / job.video_id
+        processor("gpt", lambda: create_gpt_processor(args)).process_folder(folder)
+
+    def render(job):
+        video_processor = processor("render", lambda: create_video_processor(args, data_dir))
+        video_processor.process_single_movie(data_dir / job.video_id)
+
+    return {"download": download, "transcribe": transcribe, "gpt": gpt, "render": render}
+
+
+def run_queue(args, data_dir):
+    """
+    --enqueue adds the channel videos to the queue, --worker processes queued jobs of --stages
+    until none are left. Both can be given to run a single node.
+    """
+    work_queue = WorkQueue(args.queue or data_dir / "queue.sqlite3", lease_seconds=args.lease_seconds,
+                           max_attempts=args.max_attempts)
+    if args.enqueue:
+        downloader = create_downloader(args, data_dir)
+        links = downloader.get_channel_video_urls(args.channel_link, num_videos=args.num_video)
+        added = sum(work_queue.enqueue(downloader.transport.video_id(link), "download", link) for link in links)
+        logger.info(f"Enqueued {added} of {len(links)} videos in {work_queue.path}")
+    if args.worker:
+        worker = QueueWorker(work_queue, create_queue_handlers(args, data_dir), stages=args.stages,
+                             owner=args.worker_id, poll_interval=args.poll_interval)
+        worker.run()
+    logger.info(f"Queue status: {work_queue.counts()}")
+    for video_id, stage, attempts, error in work_queue.failed():
+        logger.error(f"Failed {stage} of {video_id} after {attempts} attempts: {error}")
+
+
 def main(args):
     data_dir = Path(args.data_dir)
     if not data_dir.exists():
         data_dir.mkdir(parents=True, exist_ok=True)
-    if args.mode == "full":
+    recorder.configure(args.metrics_file or data_dir / "metrics.jsonl", profile_stage=args.profile_stage,
+                       profile_dir=args.profile_dir)
+    if args.enqueue or args.worker:
+        run_queue(args, data_dir)
+    elif args.mode == "full":
         logger.info("Start full pipeline")
         logger.info("Start YouTubeDownloader")
-        downloader = YouTubeDownloader(data_dir)
-        downloader.download_channel_videos(args.channel_link)
+        downloader = create_downloader(args, data_dir)
+        downloader.download_channel_videos(args.channel_link, num_videos=args.num_video)
         logger.info("End YouTubeDownloader")
         logger.info("Start Whisper")
-        transcription_processor = TranscriptionProcessor(model_name=args.whisper_model, device=args.cuda)
+        transcription_processor = create_transcription_processor(args)
         transcription_processor.transcribe_audio_files(data_dir)
         logger.info("End Whisper")
         logger.info("Start ChatGPT ideas creating")
-        gpt_processor = GptProcessor(model_name='gpt-3.5-turbo')
+        gpt_processor = create_gpt_processor(args)
         gpt_processor.process_data_folder(data_dir)
         logger.info("End ChatGPT ideas creating")
         logger.info("Start VideoProcessor")
-        video_processor = VideoProcessor(data_dir)
+        video_processor = create_video_processor(args, data_dir)
         video_processor.process_whole_folder()
         logger.info("End VideoProcessor")
+    elif args.mode == "stream":
+        logger.info("Start streaming pipeline")
+        run_streaming(args, data_dir)
+        logger.info("End streaming pipeline")
+    elif args.mode == "preview":
+        logger.info("Start previews")
+        create_video_processor(args, data_dir).preview_whole_folder()
+        logger.info("End previews")
+    elif args.mode == "approve":
+        if not args.video_id or not args.parts:
+            raise ValueError("-m approve needs --video_id and --parts")
+        video_processor = create_video_processor(args, data_dir)
+        rendered = video_processor.render_approved(data_dir / args.video_id, args.parts)
+        logger.info(f"Rendered {rendered} approved parts of {args.video_id}")
+    logger.info(f"Stage metrics ({recorder.path}):\n{recorder.format_summary()}")
 
 
 if __name__ == "__main__":
@@ -42,13 +185,99 @@ if __name__ == "__main__":
                         help='YouTube link of channel')
     parser.add_argument('-n', '--num_video', type=int, default=10,
                         help='Number videos')
-    parser.add_argument('-m', '--mode', type=str, default="full",
-                        help='Pipeline mode')
+    parser.add_argument('-m', '--mode', type=str, default="full", choices=['full', 'stream', 'preview', 'approve'],
+                        help='Pipeline mode: full runs every stage over the whole channel in turn, '
+                             'stream passes each video through all stages as soon as it is ready, '
+                             'preview renders review versions of the moments of every video in the data directory, '
+                             'approve renders --parts of --video_id in full quality')
+    parser.add_argument('--audio_format', type=str, default='mp3', choices=['mp3', 'mp3_16k', 'none'],
+                        help='Audio extracted for Whisper: source rate mp3, 16 kHz mono mp3, or none to read the mp4')
     parser.add_argument('--whisper_model', type=str, default='small',
                         choices=['tiny', 'base', 'small', 'medium', 'large'],
                         help='Whisper model to transcribe')
-    parser.add_argument('--cuda', type=str, default='cuda',
-                        help='Cuda')
+    parser.add_argument('--cuda', type=str, default='auto',
+                        help='Device for Whisper: cuda, cpu or auto (cuda when available)')
+    parser.add_argument('--whisper_threads', type=int, default=None,
+                        help='Number of CPU threads used by Whisper')
+    parser.add_argument('--whisper_precision', type=str, default=None, choices=['fp16', 'fp32', 'int8'],
+                        help='Whisper precision (default: fp16 on cuda, fp32 on cpu; int8 is cpu only)')
+    parser.add_argument('--whisper_chunk_workers', type=int, default=None,
+                        help='Split long audio at silences and transcribe the chunks in this many processes')
     parser.add_argument('--gpt_model', type=str, default='gpt-3.5-turbo',
                         help='GPT OpenAI model to generate titles, hashtags, description, timestamps')
+    parser.add_argument('--gpt_concurrency', type=int, default=4,
+                        help='Number of subtitle blocks of one video sent to the GPT model at once')
+    parser.add_argument('--gpt_folder_workers', type=int, default=2,
+                        help='Number of videos processed by the GPT model at once')
+    parser.add_argument('--gpt_requests_per_minute', type=int, default=None,
+                        help='Limit of GPT requests per minute')
+    parser.add_argument('--gpt_tokens_per_minute', type=int, default=None,
+                        help='Limit of GPT tokens per minute')
+    parser.add_argument('--gpt_cache_dir', type=str, default='.gpt_cache',
+                        help='Directory of cached GPT completions, empty string disables the cache')
+    parser.add_argument('--gpt_overlap_lines', type=int, default=3,
+                        help='Number of subtitle lines repeated at the start of the next GPT block')
+    parser.add_argument('--gpt_ranking', type=str, default='none', choices=['none', 'top_k', 'local'],
+                        help='Rank windows by speech density and audio energy: top_k sends only the best windows '
+                             'to GPT, local takes timestamps from the ranking and asks GPT only for titles')
+    parser.add_argument('--gpt_ranking_top_k', type=int, default=8,
+                        help='Number of ranked windows kept per video')
+    parser.add_argument('--gpt_ranking_window', type=float, default=60.0,
+                        help='Length of ranked windows in seconds')
+    parser.add_argument('--render_workers', type=int, default=None,
+                        help='Number of processes rendering moments in parallel (default: one per CPU core)')
+    parser.add_argument('--render_backend', type=str, default='moviepy',
+                        choices=['moviepy', 'ffmpeg', 'smartcut', 'singlepass'],
+                        help='Render moments with moviepy compositing, a single ffmpeg filtergraph per moment, '
+                             'smartcut which stream copies caption-free stretches and re-encodes the rest, '
+                             'or singlepass which decodes the source once for all moments of a video')
+    parser.add_argument('--preset', type=str, default='medium',
+                        help='libx264 preset of rendered moments')
+    parser.add_argument('--crf', type=int, default=23,
+                        help='libx264 constant rate factor of rendered moments')
+    parser.add_argument('--encode_threads', type=int, default=None,
+                        help='Threads per libx264 encoder (default: chosen by ffmpeg)')
+    parser.add_argument('--max_render_memory', '--max-render-memory', type=int, default=None,
+                        help='Megabytes of frame and caption buffers each moviepy render process may hold; '
+                             'moments are streamed in smaller frame batches to stay within it')
+    parser.add_argument('--preview_kind', type=str, default='video', choices=['video', 'contact_sheet', 'both'],
+                        help='Preview moments as low resolution clips, as one storyboard image each, or both')
+    parser.add_argument('--preview_height', type=int, default=360,
+                        help='Frame height of preview clips')
+    parser.add_argument('--preview_fps', type=int, default=12,
+                        help='Frame rate of preview clips')
+    parser.add_argument('--video_id', type=str, default=None,
+                        help='Video folder whose approved parts -m approve renders')
+    parser.add_argument('--parts', type=int, nargs='+', default=None,
+                        help='Approved part numbers, as in results/preview/part_<n>.mp4')
+    parser.add_argument('--download_workers', type=int, default=2,
+                        help='Number of videos downloaded at once')
+    parser.add_argument('--transcribe_workers', type=int, default=1,
+                        help='Number of videos transcribed at once in stream mode, each loads its own model')
+    parser.add_argument('--render_stage_workers', type=int, default=1,
+                        help='Number of videos rendered at once in stream mode')
+    parser.add_argument('--enqueue', action='store_true',
+                        help='Add the channel videos to the work queue instead of processing them here')
+    parser.add_argument('--worker', action='store_true',
+                        help='Process jobs from the work queue until none are left for --stages')
+    parser.add_argument('--stages', type=str, nargs='+', default=list(STAGES), choices=STAGES,
+                        help='Stages this worker takes jobs of, e.g. --stages render on encode nodes')
+    parser.add_argument('--queue', type=str, default=None,
+                        help='SQLite work queue shared by all workers (default: queue.sqlite3 in the data directory)')
+    parser.add_argument('--worker_id', type=str, default=None,
+                        help='Name of this worker in the queue (default: host name and process id)')
+    parser.add_argument('--lease_seconds', type=float, default=300,
+                        help='A job of a worker that sent no heartbeat for this long is given to another worker')
+    parser.add_argument('--max_attempts', type=int, default=3,
+                        help='Attempts per queued job before it is marked failed')
+    parser.add_argument('--poll_interval', type=float, default=10.0,
+                        help='Seconds an idle worker waits before asking the queue again')
+    parser.add_argument('--metrics_file', type=str, default=None,
+                        help='JSON lines file of per-stage metrics (default: metrics.jsonl in the data directory)')
+    parser.add_argument('--profile_stage', type=str, default=None,
+                        choices=MEASURED_STAGES,
+                        help='Run cProfile around every unit of this stage and save the stats to --profile_dir')
+    parser.add_argument('--profile_dir', type=str, default='profiles',
+                        help='Directory of cProfile stats written for --profile_stage')
     args = parser.parse_args()
+    main(args)
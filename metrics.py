@@ -0,0 +1,219 @@
+import cProfile
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# Per record rates, meaningless when summed; encode_fps is derived from frames and wall time instead
+RATE_FIELDS = ("encode_fps", "real_time_factor")
+# Memory levels, summarized by their maximum
+MEMORY_FIELDS = ("rss_mb", "rss_growth_mb", "process_peak_rss_mb")
+# Stage names passed to MetricsRecorder.measure, which also are the stages --profile_stage can profile
+MEASURED_STAGES = ("download", "transcribe", "gpt", "gpt_request", "render", "render_movie", "render_moment",
+                   "preview")
+
+
+def _io_counters():
+    """
+    Bytes read and written by this process (/proc/self/io) and by its finished children (block counts).
+    """
+    read_bytes = write_bytes = 0
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                name, value = line.split(":")
+                if name == "rchar":
+                    read_bytes = int(value)
+                elif name == "wchar":
+                    write_bytes = int(value)
+    except OSError:
+        pass
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return read_bytes + children.ru_inblock * 512, write_bytes + children.ru_oublock * 512
+
+
+def _children_cpu_time():
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return children.ru_utime + children.ru_stime
+
+
+def _process_peak_rss_mb():
+    """
+    High-water mark of this process or its largest finished child over their whole lifetime, it never goes down.
+    """
+    # ru_maxrss is in kilobytes on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024
+
+
+def _current_rss_mb():
+    """
+    Resident memory of this process right now (/proc/self/statm), or None where it is not available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+class MetricsRecorder:
+    """
+    Collects one record per measured unit of work (a video, a moment, a request) and appends it as a JSON line
+    to path. CPU time is the measuring thread plus the child processes (ffmpeg) that finished meanwhile, and
+    I/O counters are process wide, so both are approximate when stages run concurrently.
+    Memory is sampled at the stage boundaries: rss_mb is the resident size when the stage ends and rss_growth_mb
+    its change over the stage; process_peak_rss_mb is the lifetime high-water mark of the process, not of the stage.
+    """
+
+    def __init__(self, path=None, profile_stage=None, profile_dir="profiles"):
+        self.path = Path(path) if path else None
+        self.profile_stage = profile_stage
+        self.profile_dir = Path(profile_dir)
+        self.run_id = self._new_run_id()
+        self.records = []
+        self._lock = threading.Lock()
+        self._profiles = 0
+
+    @staticmethod
+    def _new_run_id():
+        return f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+
+    def configure(self, path=None, profile_stage=None, profile_dir="profiles", run_id=None):
+        """
+        Starts a new run, or joins run_id; records of earlier runs in the same file are kept but left out of
+        the summary.
+        """
+        self.path = Path(path) if path else None
+        self.profile_stage = profile_stage
+        self.profile_dir = Path(profile_dir)
+        self.run_id = run_id or self._new_run_id()
+        self.records = []
+
+    def worker_settings(self):
+        """
+        Arguments of configure for worker processes, so they record into the same file and run.
+        """
+        return {"path": self.path, "profile_stage": self.profile_stage, "profile_dir": self.profile_dir,
+                "run_id": self.run_id}
+
+    @contextmanager
+    def measure(self, stage, **tags):
+        """
+        Measures the enclosed block. Yields a dict for stage specific counters, e.g. tokens_sent,
+        which are stored with the record.
+        """
+        if stage not in MEASURED_STAGES:
+            raise ValueError(f"Unknown metrics stage: {stage}")
+        counters = {}
+        rss_start = _current_rss_mb()
+        read_start, write_start = _io_counters()
+        children_cpu_start = _children_cpu_time()
+        cpu_start = time.thread_time()
+        wall_start = time.perf_counter()
+        profile = None
+        if stage == self.profile_stage:
+            profile = cProfile.Profile()
+            profile.enable()
+        try:
+            yield counters
+        finally:
+            if profile is not None:
+                profile.disable()
+                self._dump_profile(stage, profile)
+            wall_time = time.perf_counter() - wall_start
+            cpu_time = time.thread_time() - cpu_start + _children_cpu_time() - children_cpu_start
+            read_end, write_end = _io_counters()
+            rss_end = _current_rss_mb()
+            record = {
+                "run": self.run_id,
+                "stage": stage,
+                **tags,
+                "wall_time": round(wall_time, 4),
+                "cpu_time": round(cpu_time, 4),
+                "bytes_read": read_end - read_start,
+                "bytes_written": write_end - write_start,
+                "process_peak_rss_mb": round(_process_peak_rss_mb(), 1),
+                **counters,
+            }
+            if rss_end is not None:
+                record["rss_mb"] = round(rss_end, 1)
+                record["rss_growth_mb"] = round(rss_end - rss_start, 1)
+            if counters.get("frames"):
+                record["encode_fps"] = round(counters["frames"] / max(wall_time, 1e-9), 2)
+            self.emit(record)
+
+    def emit(self, record):
+        with self._lock:
+            self.records.append(record)
+            if self.path is not None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, default=str) + "\n")
+
+    def _dump_profile(self, stage, profile):
+        with self._lock:
+            self._profiles += 1
+            number = self._profiles
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        # pstats format, readable with `python -m pstats`, snakeviz or converted for flame graphs
+        profile.dump_stats(self.profile_dir / f"{stage}-{os.getpid()}-{number}.prof")
+
+    def load(self):
+        """
+        Records of this run, including those worker processes appended to the same file.
+        """
+        if self.path is None or not self.path.is_file():
+            return list(self.records)
+        with open(self.path, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        return [record for record in records if record.get("run") == self.run_id]
+
+    def summary(self, records=None):
+        """
+        Per stage totals: count, wall and CPU time, the largest memory levels and the sums of numeric counters.
+        """
+        stages = {}
+        for record in records if records is not None else self.load():
+            totals = stages.setdefault(record["stage"], {"count": 0})
+            totals["count"] += 1
+            for name, value in record.items():
+                if name in MEMORY_FIELDS:
+                    totals[name] = max(totals.get(name, value), value)
+                elif name in RATE_FIELDS or name == "part":
+                    continue
+                elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                    totals[name] = totals.get(name, 0) + value
+        for totals in stages.values():
+            if totals.get("frames") and totals.get("wall_time"):
+                totals["encode_fps"] = totals["frames"] / totals["wall_time"]
+        return stages
+
+    def format_summary(self, records=None):
+        stages = self.summary(records)
+        columns = ["count", "wall_time", "cpu_time", "rss_mb", "rss_growth_mb", "bytes_read", "bytes_written",
+                   "process_peak_rss_mb"]
+        widths = [max(15, len(column) + 2) for column in columns]
+        lines = ["{:<20}".format("stage") + "".join(f"{column:>{width}}" for column, width in zip(columns, widths)) +
+                 "  other"]
+        for stage, totals in stages.items():
+            other = ", ".join(f"{name}={value:g}" for name, value in totals.items() if name not in columns)
+            lines.append(f"{stage:<20}" + "".join(f"{totals.get(column, 0):>{width}.6g}"
+                                                  for column, width in zip(columns, widths)) + f"  {other}")
+        return "\n".join(lines)
+
+
+# Recorder shared by all stages of a run, configured by main.py
+recorder = MetricsRecorder()
+
+
+def configure_worker(settings):
+    """
+    Process pool initializer: spawned workers start with a blank recorder and join the run of the parent.
+    """
+    recorder.configure(**settings)
@@ -0,0 +1,87 @@
+from pathlib import Path
+
+import numpy as np
+
+from audio_utils import load_audio, rms_envelope
+
+RANKING_SAMPLE_RATE = 16000
+
+
+def find_audio_file(folder_path):
+    """
+    Returns the mp3 of a video folder, or its mp4 when no audio was extracted, or None.
+    """
+    for extension in ("*.mp3", "*.mp4"):
+        audio_files = sorted(Path(folder_path).glob(extension))
+        if audio_files:
+            return audio_files[0]
+    return None
+
+
+def _standardize(values):
+    std = values.std()
+    if std == 0:
+        return np.zeros_like(values)
+    return (values - values.mean()) / std
+
+
+def speech_density(segments, duration, bin_duration=1.0):
+    """
+    Words per bin_duration bin, every segment counted at its midpoint.
+    """
+    num_bins = max(1, int(np.ceil(duration / bin_duration)))
+    starts = np.array([segment["start"] for segment in segments], dtype=np.float64)
+    ends = np.array([segment["end"] for segment in segments], dtype=np.float64)
+    words = np.array([len(segment["text"].split()) for segment in segments], dtype=np.float64)
+    density, _ = np.histogram((starts + ends) / 2, bins=num_bins, range=(0, num_bins * bin_duration), weights=words)
+    return density
+
+
+def audio_energy(audio, duration, bin_duration=1.0, sample_rate=RANKING_SAMPLE_RATE):
+    """
+    Mean RMS energy per bin_duration bin.
+    """
+    num_bins = max(1, int(np.ceil(duration / bin_duration)))
+    frame_duration = 0.05
+    envelope = rms_envelope(audio, sample_rate, frame_duration)
+    frames_per_bin = int(round(bin_duration / frame_duration))
+    padded = np.zeros(num_bins * frames_per_bin, dtype=np.float64)
+    padded[:min(len(envelope), len(padded))] = envelope[:len(padded)]
+    return padded.reshape(num_bins, frames_per_bin).mean(axis=1)
+
+
+def rank_windows(segments, audio=None, window=60.0, hop=10.0, top_k=5, bin_duration=1.0, energy_weight=0.5):
+    """
+    Scores every window of `window` seconds, starting each `hop` seconds, by speech density and
+    (when audio is given) RMS energy, and returns the top_k non-overlapping windows as (start, end) pairs
+    sorted by start time.
+    """
+    if not segments:
+        return []
+    duration = max(segment["end"] for segment in segments)
+    score = _standardize(speech_density(segments, duration, bin_duration))
+    if audio is not None and len(audio):
+        score = score + energy_weight * _standardize(audio_energy(audio, duration, bin_duration))
+    window_bins = max(1, int(round(window / bin_duration)))
+    hop_bins = max(1, int(round(hop / bin_duration)))
+    cumulative = np.concatenate(([0.0], np.cumsum(score)))
+    starts = np.arange(0, max(1, len(score) - window_bins + 1), hop_bins)
+    ends = np.minimum(starts + window_bins, len(score))
+    window_scores = cumulative[ends] - cumulative[starts]
+
+    chosen = []
+    for i in np.argsort(-window_scores, kind="stable"):
+        if len(chosen) == top_k:
+            break
+        if all(ends[i] <= starts[j] or starts[i] >= ends[j] for j in chosen):
+            chosen.append(i)
+    return sorted((float(starts[i] * bin_duration), float(ends[i] * bin_duration)) for i in chosen)
+
+
+def rank_folder(folder_path, segments, window=60.0, hop=10.0, top_k=5):
+    """
+    Ranks the windows of a video folder, using its audio when there is one.
+    """
+    audio_file = find_audio_file(folder_path)
+    audio = load_audio(audio_file, RANKING_SAMPLE_RATE) if audio_file is not None else None
+    return rank_windows(segments, audio, window=window, hop=hop, top_k=top_k)
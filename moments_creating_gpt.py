@@ -1,16 +1,38 @@
 import json
 import os
+import re
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import openai
 import tiktoken
 from dotenv import load_dotenv
 from tqdm import tqdm
 
+from build_cache import BuildManifest
+from gpt_engine import OpenAIChatClient, RateLimiter, ResponseCache
+from metrics import recorder
+from moment_ranking import find_audio_file, rank_folder
+from segment_index import SegmentIndex
+from transcript_store import load_segments
+
 load_dotenv()
 
 openai.api_key = os.environ.get("OPENAI-API-KEY")
 
+# Context window of the models, prompt and completion together
+MODEL_CONTEXT_TOKENS = {
+    "gpt-3.5-turbo": 4096,
+    "gpt-3.5-turbo-16k": 16384,
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+}
+DEFAULT_CONTEXT_TOKENS = 4096
+
+# "none" sends every subtitle to the model, "top_k" only the subtitles of the best ranked windows,
+# "local" takes the timestamps from the ranking and asks the model only for titles, hashtags and descriptions
+RANKING_MODES = ("none", "top_k", "local")
+
 
 def format_seconds_to_minutes_seconds(seconds):
     minutes = int(seconds // 60)
@@ -18,79 +40,237 @@ def format_seconds_to_minutes_seconds(seconds):
     return f"{minutes}:{seconds:02}"
 
 
+def chunk_subtitles(line_tokens, budget, overlap=0):
+    """
+    Greedily packs subtitle lines into chunks whose summed token counts fit into budget.
+    Every chunk after the first starts with the last `overlap` lines of the previous one, so moments
+    crossing a chunk edge are seen whole. A single line larger than budget becomes its own chunk.
+    Returns a list of (start, end) line index ranges.
+    """
+    chunks = []
+    start = 0
+    while start < len(line_tokens):
+        end = start
+        total = 0
+        while end < len(line_tokens) and (end == start or total + line_tokens[end] <= budget):
+            total += line_tokens[end]
+            end += 1
+        chunks.append((start, end))
+        if end >= len(line_tokens):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
 class GptProcessor:
-    def __init__(self, model_name, max_retries=3):
+    def __init__(self, model_name, max_retries=3, client=None, max_concurrency=4, folder_workers=2,
+                 requests_per_minute=None, tokens_per_minute=None, cache_dir=".gpt_cache",
+                 completion_tokens=1024, context_tokens=None, overlap_lines=3,
+                 prompt_path="prompts/sample_prompt.txt", ranking="none", ranking_top_k=8,
+                 ranking_window=60.0, title_prompt_path="prompts/title_prompt.txt", encoding=None):
+        if ranking not in RANKING_MODES:
+            raise ValueError(f"Unknown ranking mode: {ranking}")
         self.model_name = model_name
         self.max_retries = max_retries
+        self.client = client or OpenAIChatClient(api_base=os.environ.get("OPENAI_API_BASE"))
+        self.max_concurrency = max_concurrency
+        self.folder_workers = folder_workers
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.cache = ResponseCache(cache_dir) if cache_dir else None
+        # Completion size reserved in the context window and in the tokens per minute budget of every request
+        self.completion_tokens = completion_tokens
+        self.context_tokens = context_tokens or MODEL_CONTEXT_TOKENS.get(model_name, DEFAULT_CONTEXT_TOKENS)
+        self.overlap_lines = overlap_lines
+        self.prompt_path = prompt_path
+        self.ranking = ranking
+        self.ranking_top_k = ranking_top_k
+        self.ranking_window = ranking_window
+        self.title_prompt_path = title_prompt_path
+        self._encoding = encoding
+
+    @property
+    def encoding(self):
+        """
+        Tokenizer of the model, loaded on first use; any object with an encode(text) method can be passed instead.
+        """
+        if self._encoding is None:
+            self._encoding = tiktoken.encoding_for_model(self.model_name)
+        return self._encoding
 
-    def call_openai_api(self, prompt):
+    def call_openai_api(self, prompt, prompt_tokens=0):
+        with recorder.measure("gpt_request", model=self.model_name) as counters:
+            counters["tokens_sent"] = counters["tokens_received"] = 0
+            completion = self._call_openai_api(prompt, prompt_tokens, counters)
+            # Cached completions cost nothing, only tokens that went over the API are counted
+            if completion and not counters.get("cached"):
+                counters["tokens_received"] = len(self.encoding.encode(completion))
+        return completion
+
+    def _call_openai_api(self, prompt, prompt_tokens, counters):
+        if self.cache is not None:
+            cached = self.cache.get(self.model_name, prompt)
+            if cached is not None:
+                counters["cached"] = 1
+                return cached
         for retry in range(self.max_retries):
+            self.rate_limiter.acquire(prompt_tokens + self.completion_tokens)
+            counters["tokens_sent"] += prompt_tokens
             try:
-                completion = openai.ChatCompletion.create(model=self.model_name,
-                                                          messages=[{"role": "user", "content": prompt}])
-                return completion.choices[0].message['content']
+                completion = self.client.complete(self.model_name, prompt)
+                if self.cache is not None:
+                    self.cache.put(self.model_name, prompt, completion)
+                return completion
             except Exception as e:
+                counters["retries"] = retry + 1
                 print(f"API Error: {e}")
                 print(f"Retry attempt {retry + 1}/{self.max_retries}")
                 time.sleep(2 ** retry)  # Wait for an exponentially increasing time before retrying
         return None  # If all retries fail, return None
 
+    def build_params(self):
+        params = {"model": self.model_name, "context_tokens": self.context_tokens,
+                  "completion_tokens": self.completion_tokens, "overlap_lines": self.overlap_lines,
+                  "ranking": self.ranking}
+        if self.ranking != "none":
+            params.update(ranking_top_k=self.ranking_top_k, ranking_window=self.ranking_window)
+        return params
+
+    def build_inputs(self, folder_path):
+        inputs = [folder_path / "metadata.json", folder_path / "transcribe.json",
+                  self.title_prompt_path if self.ranking == "local" else self.prompt_path]
+        audio_file = find_audio_file(folder_path) if self.ranking != "none" else None
+        if audio_file is not None:
+            inputs.append(audio_file)
+        return inputs
+
     def process_folder(self, folder_path):
-        enc = tiktoken.encoding_for_model(self.model_name)
-        if os.path.isfile(folder_path / "output.txt"):
+        with recorder.measure("gpt", model=self.model_name, ranking=self.ranking,
+                              video=Path(folder_path).name) as counters:
+            counters["moments"] = self._process_folder(Path(folder_path))
+
+    def _process_folder(self, folder_path):
+        """
+        Writes output.txt of a video folder, returns the number of completions (0 when up to date).
+        """
+        metadata_file_path = folder_path / "metadata.json"
+        transcribe_file_path = folder_path / "transcribe.json"
+        manifest = BuildManifest(folder_path)
+        inputs = self.build_inputs(folder_path)
+        if manifest.is_fresh("gpt", inputs, self.build_params()):
             print(f"{folder_path} already processed")
-            return
+            return 0
         # Load metadata and transcribe data for the folder
-        metadata_file_path = folder_path / "metadata.json"
         metadata = json.load(metadata_file_path.open())
         title = self.get_title(metadata)
-        transcribe_file_path = folder_path / "transcribe.json"
-        transcribe = json.load(transcribe_file_path.open())
-        subtitles = self.format_subtitles(self.get_subtitles(transcribe))
-
-        completion_list = []
-        # Load the initial prompt template from a file
-        with open("prompts/sample_prompt.txt") as file:
-            prompt_template = file.read()
-
-        # Prepare the full prompt with blocks of subtitles
-        max_subtitles_per_block = 140
-        num_blocks = (len(subtitles) + max_subtitles_per_block - 1) // max_subtitles_per_block
+        index = SegmentIndex(load_segments(transcribe_file_path))
         print("Start processing folder:", folder_path)
-        for i in tqdm(range(num_blocks)):
-            full_prompt = ""
-            block_subtitles = subtitles[i * max_subtitles_per_block: (i + 1) * max_subtitles_per_block]
-            subtitle_block = "\n".join(block_subtitles)
-            prompt = prompt_template.format(title=title, subtitles=subtitle_block)
-
-            # Use tiktoken to check the length of the prompt
-            prompt_length = len(enc.encode(prompt))
 
-            # Check if the prompt length exceeds the model's maximum limit (4096 for gpt-3.5-turbo)
-            if prompt_length > 4096:
-                print("The prompt is too long for the model to handle.")
-                continue
-
-            full_prompt += prompt + "\n"
+        if self.ranking == "none":
+            completion_list, failed = self.find_moments(title, index.segments)
+        else:
+            windows = rank_folder(folder_path, index.segments, window=self.ranking_window, top_k=self.ranking_top_k)
+            if self.ranking == "local":
+                completion_list, failed = self.describe_moments(title, index, windows)
+            else:
+                selected = sorted({int(i) for start, end in windows for i in index.overlapping_indices(start, end)})
+                completion_list, failed = self.find_moments(title, [index.segments[i] for i in selected])
+        # Nothing is written or recorded, so the next run retries; the completions that did come back are cached
+        if failed:
+            raise RuntimeError(f"{failed} of {failed + len(completion_list)} GPT requests failed for {folder_path}")
 
-            completion_result = self.call_openai_api(full_prompt)
+        # Save the generated answer in a file inside the folder
+        output_file_path = folder_path / "output.txt"
+        with open(output_file_path, "w", encoding="utf-8") as output_file:
+            output_file.write("\n".join(completion_list))
+        manifest.record("gpt", inputs, self.build_params(), [output_file_path])
+        return len(completion_list)
 
-            # Call the API with retries
+    def send_prompts(self, prompts):
+        """
+        Sends (prompt, prompt_tokens) pairs concurrently and returns the completions in the order of the prompts,
+        leaving out failed requests, and the number of failed requests.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            completion_results = list(tqdm(executor.map(lambda item: self.call_openai_api(*item), prompts),
+                                           total=len(prompts)))
+        completion_list = []
+        failed = 0
+        for completion_result in completion_results:
             if completion_result is not None:
                 completion_list.append(completion_result)
             else:
+                failed += 1
                 print("API call failed even after retries. Skipping this block.")
+        return completion_list, failed
 
-            # Save the generated answer in a file inside the folder
-        output_file_path = folder_path / "output.txt"
-        with open(output_file_path, "w", encoding="utf-8") as output_file:
-            output_file.write("\n".join(completion_list))
+    def find_moments(self, title, segments):
+        """
+        Asks the model for moments with titles, hashtags, descriptions and timestamps in blocks of subtitles.
+        Returns the completions and the number of blocks whose requests failed.
+        """
+        enc = self.encoding
+        subtitles = self.format_subtitles(segments)
+
+        # Load the initial prompt template from a file
+        with open(self.prompt_path) as file:
+            prompt_template = file.read()
+
+        # Every line is encoded once; the template without subtitles is the fixed part of every prompt.
+        # The +1 accounts for the newline joining the lines of a block.
+        template_tokens = len(enc.encode(prompt_template.format(title=title, subtitles="")))
+        line_tokens = [len(enc.encode(subtitle)) + 1 for subtitle in subtitles]
+        budget = self.context_tokens - self.completion_tokens - template_tokens
+        prompts = []
+        for start, end in chunk_subtitles(line_tokens, budget, self.overlap_lines):
+            subtitle_block = "\n".join(subtitles[start:end])
+            prompt = prompt_template.format(title=title, subtitles=subtitle_block)
+            prompts.append((prompt + "\n", template_tokens + sum(line_tokens[start:end])))
+        return self.send_prompts(prompts)
+
+    def describe_moments(self, title, index, windows):
+        """
+        Asks the model only for title, hashtags and description of every ranked window and writes them
+        in the moment format output_parser.parse_file reads, with the window as timestamp.
+        Returns the moments and the number of windows whose requests failed.
+        """
+        enc = self.encoding
+        with open(self.title_prompt_path) as file:
+            prompt_template = file.read()
+        prompts = []
+        described_windows = []
+        for start, end in windows:
+            subtitle_block = "\n".join(self.format_subtitles(index.overlapping(start, end)))
+            if not subtitle_block:
+                continue
+            prompt = prompt_template.format(title=title, subtitles=subtitle_block)
+            prompts.append((prompt, len(enc.encode(prompt))))
+            described_windows.append((start, end))
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            completions = list(executor.map(lambda item: self.call_openai_api(*item), prompts))
+        moments = [self.format_moment(completion, title, start, end)
+                   for completion, (start, end) in zip(completions, described_windows) if completion is not None]
+        return moments, len(completions) - len(moments)
+
+    @staticmethod
+    def format_moment(completion, default_title, start, end):
+        fields = {"Title": "", "Hashtags": "", "Description": ""}
+        for line in completion.splitlines():
+            match = re.match(r"\s*(Title|Hashtags|Description)(?: of moment)?:\s*(.*)", line)
+            if match and not fields[match.group(1)]:
+                fields[match.group(1)] = match.group(2).strip()
+        return "Title of moment: {}\nHashtags: {}\nDescription: {}\nTimestamp: {}->{}".format(
+            fields["Title"] or default_title, fields["Hashtags"], fields["Description"],
+            format_seconds_to_minutes_seconds(start), format_seconds_to_minutes_seconds(end))
 
     def process_data_folder(self, data_folder):
-        for folder in tqdm(os.listdir(data_folder)):
-            folder_path = data_folder / folder
-            if os.path.isdir(folder_path):
-                self.process_folder(folder_path)
+        folders = [data_folder / folder for folder in os.listdir(data_folder) if os.path.isdir(data_folder / folder)]
+        with ThreadPoolExecutor(max_workers=self.folder_workers) as executor:
+            futures = {executor.submit(self.process_folder, folder_path): folder_path for folder_path in folders}
+            for future in tqdm(futures):
+                try:
+                    future.result()
+                except Exception as ex:
+                    print(f"ERROR Troubles with dir: {futures[future]}\n{ex}")
 
     @staticmethod
     def get_title(metadata: dict):
@@ -99,7 +279,7 @@ class GptProcessor:
 
     @staticmethod
     def get_subtitles(transcribe: dict):
-        subtitles = transcribe['segments']
+        subtitles = SegmentIndex(transcribe['segments']).segments
         return subtitles
 
     @staticmethod
@@ -1,48 +1,166 @@
 import re
-from datetime import datetime
 
+# Numbering or bullets GPT puts in front of list items, e.g. "1. ", "2) ", "- "
+LIST_MARKER = re.compile(r"^(?:\d+[.)]|[-*•])\s+")
+# "Title of moment: ...", "**Hashtags:** ...", "Timestamp - ..."
+FIELD = re.compile(r"^\**\s*(title(?: of (?:the )?moment)?|hashtags|description|timestamp)\s*\**\s*[:\-]\s*\**\s*(.*)$",
+                   re.IGNORECASE)
+TIMESTAMP = re.compile(r"(\d+(?::\d+){0,2})\s*(?:->|-|–|—|to)\s*(\d+(?::\d+){0,2})")
+# Completions sometimes put the timestamp at the end of the description line
+INLINE_TIMESTAMP = re.compile(r"\s+(?=Timestamp:)")
+
+
+# First characters of a line LIST_MARKER or FIELD can match, checked before running the regexes
+LIST_MARKER_START = frozenset("0123456789-*•")
+FIELD_START = frozenset("TtHhDd*")
+
+
+def clean_line(line):
+    if "\t" in line:
+        line = line.replace("\t", "")
+    line = line.strip()
+    if line and line[0] in LIST_MARKER_START:
+        line = LIST_MARKER.sub("", line)
+    return line
+
+
+class MomentParser:
+    """
+    Single pass, line oriented parser of GPT completions. Text can be fed in chunks as it is streamed;
+    every line updates the moment being read and a moment is complete once its timestamp line is read.
+    Candidates that cannot become a moment are counted in self.rejected by reason.
+    """
+
+    def __init__(self):
+        self.moments = []
+        self.rejected = {}
+        self._buffer = ""
+        self._current = {}
+        self._field = None
+        self._loose_title = ""
+
+    def feed(self, chunk):
+        """
+        Parses the complete lines of chunk, keeping a trailing partial line for the next call.
+        Returns the moments completed by this chunk.
+        """
+        count = len(self.moments)
+        lines = (self._buffer + chunk).split("\n")
+        self._buffer = lines.pop()
+        for line in lines:
+            self._feed_line(line)
+        return self.moments[count:]
+
+    def close(self):
+        """
+        Parses the remaining partial line and returns all moments.
+        """
+        if self._buffer:
+            self._feed_line(self._buffer)
+            self._buffer = ""
+        self._reject_current("missing_timestamp")
+        return self.moments
+
+    def _reject(self, reason):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+
+    def _reject_current(self, reason):
+        if self._current:
+            self._reject(reason)
+        self._current = {}
+        self._field = None
+
+    def _feed_line(self, line):
+        line = clean_line(line)
+        if not line:
+            return
+        for part in INLINE_TIMESTAMP.split(line) if "Timestamp:" in line[1:] else (line,):
+            match = FIELD.match(part) if part[0] in FIELD_START else None
+            if match is None:
+                self._feed_text(part)
+            else:
+                self._feed_field(match.group(1).lower(), match.group(2).strip())
+
+    def _feed_text(self, text):
+        if self._field == "description":
+            self._current["description"] += "\n" + text
+        elif self._field in ("title", "hashtags") and not self._current[self._field]:
+            # "Title of moment:" with the value on the next line
+            self._current[self._field] = text
+        elif self._field == "hashtags" and text.startswith("#"):
+            self._current["hashtags"] += " " + text
+        elif self._field is None:
+            # A title line without "Title:", the last one before the hashtags wins
+            self._loose_title = text
+
+    def _feed_field(self, name, value):
+        if name.startswith("title"):
+            name = "title"
+        if name == "timestamp":
+            self._finish(value)
+            return
+        if name in self._current:
+            # The field starts the next moment, the current one never got its timestamp
+            self._reject_current("missing_timestamp")
+        if not self._current and name != "title":
+            self._current["title"] = self._loose_title
+        self._loose_title = ""
+        self._current[name] = value
+        self._field = name
+
+    def _finish(self, value):
+        match = TIMESTAMP.search(value)
+        if match is None:
+            self._reject_current("invalid_timestamp")
+            return
+        start = convert_timestamp_to_seconds(match.group(1))
+        end = convert_timestamp_to_seconds(match.group(2))
+        if end <= start:
+            self._reject_current("end_before_start")
+            return
+        if not self._current:
+            if not self._loose_title:
+                self._reject("missing_fields")
+                return
+            self._current["title"] = self._loose_title
+        self._loose_title = ""
+        self.moments.append({
+            'title': self._current.get("title", ""),
+            'hashtags': self._current.get("hashtags", "").split(),
+            'description': self._current.get("description", ""),
+            'start_timestamp': convert_seconds_to_timestamp(start),
+            'end_timestamp': convert_seconds_to_timestamp(end),
+        })
+        self._current = {}
+        self._field = None
 
-def remove_tabulations_and_lists(text):
-    text_without_multiple_enter = re.sub(r'\n+', '\n', text)
-    text_without_lists = re.sub(r'\d+\.\s*', '', text_without_multiple_enter)
-    text_without_tabs = text_without_lists.replace("\t", "")
-    lines = text_without_tabs.split('\n')
-    clean_lines = [line.strip() for line in lines]
-    cleaned_text = '\n'.join(clean_lines)
-    cleaned_text = cleaned_text.replace(" Timestamp:", "\nTimestamp:")
-    cleaned_text = cleaned_text.replace(" -> ", "->")
-    return cleaned_text
 
+def parse_moments(file_content):
+    """
+    Returns the closed MomentParser of file_content, with its moments before any timestamp adjustment.
+    """
+    parser = MomentParser()
+    parser.feed(file_content)
+    parser.close()
+    return parser
 
-def parse_file(file_content):
-    file_content = remove_tabulations_and_lists(file_content)
-    pattern = r'(?:Title(?: of moment)?: )?(.*?)\nHashtags: (.*?)\nDescription: (.*?)\nTimestamp: ([0-9:]+)(->|-)([0-9:]+)'
-    matches = re.findall(pattern, file_content, re.DOTALL)
-    parsed_data = []
-
-    for match in matches:
-        title = match[0]
-        hashtags = [tag.strip() for tag in match[1].split()]
-        description = match[2]
-        start_timestamp = match[3]
-        end_timestamp = match[5]
-
-        parsed_data.append({
-            'title': title,
-            'hashtags': hashtags,
-            'description': description,
-            'start_timestamp': start_timestamp,
-            'end_timestamp': end_timestamp
-        })
 
-    return adjust_moments_timestamps(parsed_data)
+def parse_file(file_content):
+    parser = parse_moments(file_content)
+    if parser.rejected:
+        print(f"Rejected {sum(parser.rejected.values())} candidate moments: {parser.rejected}")
+    return adjust_moments_timestamps(parser.moments)
 
 
 def convert_timestamp_to_seconds(timestamp):
-    parts = timestamp.split(':')
-    minutes = float(parts[0])
-    seconds = float(parts[1])
-    return minutes * 60 + seconds
+    """
+    Seconds of "m:ss", "h:mm:ss" or plain seconds.
+    """
+    seconds = 0.0
+    for part in timestamp.split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
 
 def convert_seconds_to_timestamp(seconds):
     minutes = int(seconds // 60)
@@ -51,27 +169,26 @@ def convert_seconds_to_timestamp(seconds):
 
 
 def adjust_moments_timestamps(moments):
+    """
+    Fills gaps of more than 30 seconds between moments with moments of at most 2 minutes and drops moments
+    overlapping the previous one. Works on seconds, timestamps are parsed once and formatted once.
+    """
+    spans = [(convert_timestamp_to_seconds(moment['start_timestamp']),
+              convert_timestamp_to_seconds(moment['end_timestamp'])) for moment in moments]
+    # (moment or None for a gap filler, start, end); fillers are whole seconds like their formatted timestamps
     corrected_moments = []
     prev_end_timestamp = None
 
-    for i in range(len(moments)):
-        moment = moments[i]
-
-        start_timestamp = convert_timestamp_to_seconds(moment['start_timestamp'])
-        end_timestamp = convert_timestamp_to_seconds(moment['end_timestamp'])
-
+    for i, (moment, (start_timestamp, end_timestamp)) in enumerate(zip(moments, spans)):
         if prev_end_timestamp is not None and start_timestamp - prev_end_timestamp > 30:
             # If the gap between moments is too large, create a new moment using data from the previous one
-            corrected_moments.append({
-                'start_timestamp': convert_seconds_to_timestamp(prev_end_timestamp),
-                'end_timestamp': convert_seconds_to_timestamp(start_timestamp),
-            })
+            corrected_moments.append((None, int(prev_end_timestamp), int(start_timestamp)))
 
-        corrected_moments.append(moment)
+        corrected_moments.append((moment, start_timestamp, end_timestamp))
         prev_end_timestamp = end_timestamp
 
         if i < len(moments) - 1:
-            next_start_timestamp = convert_timestamp_to_seconds(moments[i + 1]['start_timestamp'])
+            next_start_timestamp = spans[i + 1][0]
 
             if next_start_timestamp - end_timestamp > 30:
                 # If there is a gap between moments, fill it with a new moment
@@ -79,10 +196,7 @@ def adjust_moments_timestamps(moments):
 
                 if gap_duration <= 120:
                     # Fill the gap with a single moment
-                    corrected_moments.append({
-                        'start_timestamp': convert_seconds_to_timestamp(end_timestamp),
-                        'end_timestamp': convert_seconds_to_timestamp(next_start_timestamp),
-                    })
+                    corrected_moments.append((None, int(end_timestamp), int(next_start_timestamp)))
                 else:
                     # Split the gap into multiple 2-minute moments
                     num_segments = int(gap_duration // 120)
@@ -91,23 +205,21 @@ def adjust_moments_timestamps(moments):
                     for j in range(num_segments):
                         segment_start = end_timestamp + j * segment_duration
                         segment_end = segment_start + segment_duration
-
-                        corrected_moments.append({
-                            'start_timestamp': convert_seconds_to_timestamp(segment_start),
-                            'end_timestamp': convert_seconds_to_timestamp(segment_end),
-                        })
+                        corrected_moments.append((None, int(segment_start), int(segment_end)))
 
     # Remove overlapping moments
     final_moments = []
     prev_end_timestamp = None
-    for moment in corrected_moments:
-        start_timestamp = convert_timestamp_to_seconds(moment['start_timestamp'])
-        end_timestamp = convert_timestamp_to_seconds(moment['end_timestamp'])
-
+    for moment, start_timestamp, end_timestamp in corrected_moments:
         if prev_end_timestamp is not None and start_timestamp < prev_end_timestamp:
             # Skip overlapping moments
             continue
 
+        if moment is None:
+            moment = {
+                'start_timestamp': convert_seconds_to_timestamp(start_timestamp),
+                'end_timestamp': convert_seconds_to_timestamp(end_timestamp),
+            }
         final_moments.append(moment)
         prev_end_timestamp = end_timestamp
 
@@ -117,8 +229,7 @@ def adjust_moments_timestamps(moments):
 if __name__ == "__main__":
     with open("data/AgbeGFYluEA/output.txt") as f:
         text = f.read()
-    parsed_data = adjust_moments_timestamps(parse_file(remove_tabulations_and_lists(text)))
-    # print(parsed_data)
-    for data in parsed_data:
+    parser = parse_moments(text)
+    print(f"{len(parser.moments)} moments, rejected: {parser.rejected}")
+    for data in adjust_moments_timestamps(parser.moments):
         print(data["start_timestamp"], data["end_timestamp"])
-
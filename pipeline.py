@@ -0,0 +1,94 @@
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class Stage:
+    """
+    One step of the streaming pipeline. handler_factory is called once per worker thread and returns
+    a callable taking an item and returning the item for the next stage, or None to drop it.
+    """
+
+    def __init__(self, name, handler_factory, workers=1, queue_size=None):
+        self.name = name
+        self.handler_factory = handler_factory
+        self.workers = workers
+        self.queue_size = queue_size or 2 * workers
+
+
+class StreamingPipeline:
+    """
+    Runs every item through the stages independently. Stages are connected by bounded queues, so a stage
+    starts on an item as soon as the previous stage has finished it, and fast stages cannot run far ahead.
+    """
+
+    def __init__(self, stages):
+        self.stages = stages
+
+    def run(self, items):
+        """
+        Feeds items to the first stage and blocks until every item has left the last stage.
+        Returns the items that made it through all stages.
+        """
+        queues = [queue.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        results = []
+        results_lock = threading.Lock()
+        threads = []
+        for index, stage in enumerate(self.stages):
+            next_queue = queues[index + 1] if index + 1 < len(self.stages) else None
+            next_workers = self.stages[index + 1].workers if next_queue is not None else 0
+            remaining = [stage.workers]
+            remaining_lock = threading.Lock()
+            for worker in range(stage.workers):
+                thread = threading.Thread(target=self._work, name=f"{stage.name}-{worker}",
+                                          args=(stage, queues[index], next_queue, next_workers, remaining,
+                                                remaining_lock, results, results_lock),
+                                          daemon=True)
+                thread.start()
+                threads.append(thread)
+        for item in items:
+            queues[0].put(item)
+        for _ in range(self.stages[0].workers):
+            queues[0].put(_STOP)
+        for thread in threads:
+            thread.join()
+        return results
+
+    @staticmethod
+    def _work(stage, in_queue, next_queue, next_workers, remaining, remaining_lock, results, results_lock):
+        handler = None
+        try:
+            handler = stage.handler_factory()
+        except Exception as ex:
+            logger.error(f"Stage {stage.name} could not start a worker: {ex}")
+        while True:
+            item = in_queue.get()
+            if item is _STOP:
+                break
+            if handler is None:
+                continue
+            try:
+                logger.info(f"Start {stage.name}: {item}")
+                result = handler(item)
+                logger.info(f"End {stage.name}: {item}")
+            except Exception as ex:
+                logger.error(f"Stage {stage.name} failed on {item}: {ex}")
+                continue
+            if result is None:
+                continue
+            if next_queue is not None:
+                next_queue.put(result)
+            else:
+                with results_lock:
+                    results.append(result)
+        with remaining_lock:
+            remaining[0] -= 1
+            last_worker = remaining[0] == 0
+        # The last worker of a stage to finish tells every worker of the next stage to stop
+        if last_worker and next_queue is not None:
+            for _ in range(next_workers):
+                next_queue.put(_STOP)
@@ -0,0 +1,43 @@
+import numpy as np
+
+
+class SegmentIndex:
+    """
+    Transcript segments (or words) sorted by start time, with start/end times in NumPy arrays.
+    Built once per transcript, answers time window overlap queries in O(log n + k).
+    """
+
+    def __init__(self, segments):
+        if hasattr(segments, "starts"):
+            # Columnar sequences (transcript_store.SegmentRecords) provide their times without building dicts
+            starts = np.asarray(segments.starts, dtype=np.float64)
+            ends = np.asarray(segments.ends, dtype=np.float64)
+        else:
+            starts = np.array([float(segment["start"]) for segment in segments], dtype=np.float64)
+            ends = np.array([float(segment["end"]) for segment in segments], dtype=np.float64)
+        order = np.argsort(starts, kind="stable")
+        if np.array_equal(order, np.arange(len(order))):
+            # Already in start order, the usual case for Whisper output; lazy sequences stay lazy
+            self.segments = segments
+        else:
+            self.segments = [segments[i] for i in order]
+        self.starts = starts[order]
+        self.ends = ends[order]
+        # Running maximum of the end times is sorted even when segments nest, so it can be bisected
+        self._max_ends = np.maximum.accumulate(self.ends) if len(self.ends) else self.ends
+
+    def __len__(self):
+        return len(self.segments)
+
+    def overlapping_indices(self, window_start, window_end):
+        """
+        Positions of the segments with start <= window_end and end >= window_start, in start order.
+        """
+        high = int(np.searchsorted(self.starts, window_end, side="right"))
+        low = int(np.searchsorted(self._max_ends, window_start, side="left"))
+        if low >= high:
+            return np.empty(0, dtype=np.intp)
+        return low + np.flatnonzero(self.ends[low:high] >= window_start)
+
+    def overlapping(self, window_start, window_end):
+        return [self.segments[i] for i in self.overlapping_indices(window_start, window_end)]
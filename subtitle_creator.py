@@ -1,43 +1,249 @@
 import json
+import multiprocessing
 import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from tqdm import tqdm
+import torch
 import whisper
 
+from audio_utils import find_silence_splits
+from build_cache import BuildManifest
+from metrics import configure_worker, recorder
+from transcript_store import write_transcript_store
+
+# Transcription processor of a chunk worker process, created once by the pool initializer
+_chunk_processor = None
+
+
+def _init_chunk_worker(model_name, device, threads, precision, metrics_settings):
+    global _chunk_processor
+    configure_worker(metrics_settings)
+    _chunk_processor = TranscriptionProcessor(model_name=model_name, device=device, threads=threads,
+                                              precision=precision)
+
+
+def _transcribe_chunk(audio_chunk):
+    return _chunk_processor.transcribe_audio(audio_chunk)
+
+
+def quantize_int8(model):
+    """
+    Dynamic int8 quantization of the Linear layers of a Whisper model. quantize_dynamic only swaps modules of
+    exactly torch.nn.Linear, Whisper's layers subclass it (to cast weights to the input dtype, a no-op on
+    fp32), so they are turned into plain Linear layers first. Raises RuntimeError when nothing was quantized.
+    """
+    for module in model.modules():
+        if isinstance(module, torch.nn.Linear) and type(module) is not torch.nn.Linear:
+            module.__class__ = torch.nn.Linear
+    model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if not any(isinstance(module, torch.ao.nn.quantized.dynamic.Linear) for module in model.modules()):
+        raise RuntimeError("int8 quantization did not replace any Linear layer of the model")
+    return model
+
+
+def walk_video_folders(data_path):
+    """
+    Yields (folder, files) of data_path and its subfolders, without the results/ folders of rendered moments.
+    """
+    for folder, dirs, files in os.walk(data_path):
+        dirs[:] = [name for name in dirs if name != "results"]
+        yield folder, files
+
+
+def stitch_transcriptions(chunk_results):
+    """
+    Joins (offset_seconds, result) pairs of consecutive chunks into one Whisper result with global timestamps.
+    """
+    segments = []
+    for offset, result in chunk_results:
+        for segment in result["segments"]:
+            segment = dict(segment, id=len(segments), start=segment["start"] + offset,
+                           end=segment["end"] + offset,
+                           seek=segment.get("seek", 0) + int(offset * whisper.audio.FRAMES_PER_SECOND))
+            if "words" in segment:
+                segment["words"] = [dict(word, start=word["start"] + offset, end=word["end"] + offset)
+                                    for word in segment["words"]]
+            segments.append(segment)
+    return {
+        "text": "".join(result["text"] for _, result in chunk_results),
+        "segments": segments,
+        "language": chunk_results[0][1].get("language", "en") if chunk_results else "en",
+    }
+
 
 class TranscriptionProcessor:
-    def __init__(self, model_name="small", device="cuda"):
+    def __init__(self, model_name="small", device="auto", threads=None, precision=None, chunk_workers=None,
+                 min_chunk_duration=120):
+        if device == "auto":
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        if precision is None:
+            precision = "fp32" if device == "cpu" else "fp16"
+        if precision == "int8" and device != "cpu":
+            raise ValueError("int8 precision is only supported on cpu")
         self.model_name = model_name
         self.device = device
+        self.threads = threads
+        self.precision = precision
+        self.chunk_workers = chunk_workers
+        self.min_chunk_duration = min_chunk_duration
+        self._model = None
+        self._chunk_pool = None
+
+    @property
+    def model(self):
+        """
+        Whisper model, loaded on first use and shared by every file this processor transcribes.
+        """
+        if self._model is None:
+            if self.threads:
+                torch.set_num_threads(self.threads)
+            model = whisper.load_model(self.model_name, device=self.device)
+            if self.precision == "int8":
+                model = quantize_int8(model)
+            self._model = model
+        return self._model
+
+    def transcribe_audio(self, audio):
+        return self.model.transcribe(audio, verbose=False, word_timestamps=True, language='en',
+                                     fp16=self.precision == "fp16")
+
+    def transcribe_chunked(self, audio):
+        """
+        Splits audio at silence boundaries and transcribes the chunks in parallel worker processes.
+        """
+        sample_rate = whisper.audio.SAMPLE_RATE
+        num_chunks = min(self.chunk_workers, max(1, int(len(audio) / sample_rate // self.min_chunk_duration)))
+        if num_chunks <= 1:
+            return self.transcribe_audio(audio)
+        if self._chunk_pool is None:
+            threads = self.threads or max(1, (os.cpu_count() or 1) // self.chunk_workers)
+            # Spawned rather than forked: the parent may already have run OpenMP or CUDA inference, which
+            # forked children cannot use, and other stage threads may hold locks at fork time
+            self._chunk_pool = ProcessPoolExecutor(max_workers=self.chunk_workers,
+                                                   mp_context=multiprocessing.get_context("spawn"),
+                                                   initializer=_init_chunk_worker,
+                                                   initargs=(self.model_name, self.device, threads, self.precision,
+                                                             recorder.worker_settings()))
+        splits = find_silence_splits(audio, sample_rate, num_chunks)
+        chunks = [audio[start:end] for start, end in zip(splits, splits[1:])]
+        results = self._chunk_pool.map(_transcribe_chunk, chunks)
+        return stitch_transcriptions([(start / sample_rate, result) for start, result in zip(splits, results)])
+
+    def close(self):
+        if self._chunk_pool is not None:
+            self._chunk_pool.shutdown()
+            self._chunk_pool = None
+
+    def build_params(self):
+        return {"model": self.model_name, "precision": self.precision, "chunk_workers": self.chunk_workers}
 
     def transcribe_audio_file(self, audio_file_path):
         """
         Transcribes a single audio file and saves the transcription result in a JSON file.
+        Returns the real-time factor (processing time / audio duration), or None when skipped or failed.
         """
+        manifest = BuildManifest(audio_file_path.parent)
+        if manifest.is_fresh("transcribe", [audio_file_path], self.build_params()):
+            print(f"{audio_file_path} already transcribed")
+            return None
         try:
-            model = whisper.load_model(self.model_name, device=self.device)
-            result = model.transcribe(audio_file_path, verbose=False, word_timestamps=True, language='en')
-            output_path = audio_file_path.parent / "transcribe.json"
-            with open(output_path, "w") as f:
-                json.dump(result, f)
+            with recorder.measure("transcribe", device=self.device, precision=self.precision,
+                                  video=audio_file_path.parent.name) as counters:
+                start = time.perf_counter()
+                audio = whisper.load_audio(str(audio_file_path))
+                if self.chunk_workers and self.chunk_workers > 1:
+                    result = self.transcribe_chunked(audio)
+                else:
+                    result = self.transcribe_audio(audio)
+                output_path = audio_file_path.parent / "transcribe.json"
+                with open(output_path, "w") as f:
+                    json.dump(result, f)
+                store_path = write_transcript_store(result, output_path)
+                manifest.record("transcribe", [audio_file_path], self.build_params(), [output_path, store_path])
+                elapsed = time.perf_counter() - start
+                duration = len(audio) / whisper.audio.SAMPLE_RATE
+                real_time_factor = elapsed / duration if duration else 0.0
+                counters["audio_seconds"] = round(duration, 2)
+                counters["segments"] = len(result["segments"])
+                counters["real_time_factor"] = round(real_time_factor, 4)
+            print(f"Transcribed {audio_file_path}: {duration:.1f}s of audio in {elapsed:.1f}s, "
+                  f"real-time factor {real_time_factor:.3f}")
+            return real_time_factor
         except Exception as e:
             print(f"Error transcribing file {audio_file_path}: {e}")
+            return None
+
+    def serve(self, audio_queue):
+        """
+        Persistent worker mode: transcribes audio paths taken from audio_queue until a None sentinel arrives.
+        """
+        while True:
+            audio_file_path = audio_queue.get()
+            try:
+                if audio_file_path is None:
+                    return
+                self.transcribe_audio_file(Path(audio_file_path))
+            finally:
+                audio_queue.task_done()
+
+    def start_worker(self, maxsize=0):
+        """
+        Starts serve() in a background thread and returns the queue it reads audio paths from.
+        Put None in the queue to stop the worker.
+        """
+        audio_queue = queue.Queue(maxsize=maxsize)
+        threading.Thread(target=self.serve, args=(audio_queue,), daemon=True).start()
+        return audio_queue
+
+    @staticmethod
+    def find_audio_files(folder, files):
+        """
+        Returns the mp3 files of a video folder, or its <video_id>.mp4 when the audio was not extracted.
+        Whisper reads the audio stream of an mp4 directly. Rendered parts and previews are never sources.
+        """
+        audio_files = [Path(folder) / file for file in files if file.endswith(".mp3")]
+        if audio_files:
+            return audio_files
+        video_file = Path(folder).name + ".mp4"
+        return [Path(folder) / video_file] if video_file in files else []
+
+    def transcribe_folder(self, folder):
+        """
+        Transcribes the audio of a single video folder. Raises RuntimeError when there is no audio or a file
+        could not be transcribed, so callers never carry on with a transcribe.json of an earlier source.
+        """
+        audio_files = self.find_audio_files(folder, os.listdir(folder))
+        if not audio_files:
+            raise RuntimeError(f"No audio to transcribe in {folder}")
+        for audio_file_path in audio_files:
+            self.transcribe_audio_file(audio_file_path)
+            if not BuildManifest(folder).is_fresh("transcribe", [audio_file_path], self.build_params()):
+                raise RuntimeError(f"Could not transcribe {audio_file_path}")
 
     def transcribe_audio_files(self, data_path):
         """
         Transcribes all audio files in the given directory and saves the transcription results in JSON files.
         """
-        dirs_count = sum(len(dirs) for _, dirs, _ in os.walk(data_path))
-        with tqdm(total=dirs_count) as pbar:
-            for subdir, dirs, files in os.walk(data_path):
-                for file in files:
-                    if file.endswith(".mp3"):
-                        audio_file_path = Path(subdir) / file
-                        self.transcribe_audio_file(audio_file_path)
+        folders = list(walk_video_folders(data_path))
+        real_time_factors = []
+        with tqdm(total=len(folders)) as pbar:
+            for subdir, files in folders:
+                for audio_file_path in self.find_audio_files(subdir, files):
+                    real_time_factor = self.transcribe_audio_file(audio_file_path)
+                    if real_time_factor is not None:
+                        real_time_factors.append(real_time_factor)
                 pbar.update(1)
+        self.close()
+        if real_time_factors:
+            print(f"Transcribed {len(real_time_factors)} files on {self.device} ({self.precision}), "
+                  f"mean real-time factor {sum(real_time_factors) / len(real_time_factors):.3f}")
 
 
 if __name__ == "__main__":
     data_path = Path("data")
-    processor = TranscriptionProcessor(model_name="small", device="cuda")
-    processor.transcribe_audio_files(data_path)
\ No newline at end of file
+    processor = TranscriptionProcessor(model_name="small", device="auto")
+    processor.transcribe_audio_files(data_path)
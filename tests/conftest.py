@@ -0,0 +1,9 @@
+import sys
+from pathlib import Path
+
+# The modules live at the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "slow: renders long moments, deselect with -m 'not slow'")
@@ -0,0 +1,63 @@
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "benchmarks"))
+
+import synthetic  # noqa: E402
+import ffmpeg_renderer  # noqa: E402
+from ffmpeg_utils import FFMPEG_BINARY, FFPROBE_BINARY, probe_keyframes, run_ffprobe  # noqa: E402
+
+pytestmark = pytest.mark.skipif(shutil.which(FFMPEG_BINARY) is None, reason="ffmpeg is not installed")
+
+
+def test_rendered_moment_decodes_cleanly(tmp_path):
+    video_file = synthetic.make_video(tmp_path / "source.mp4", 12, size=(1280, 720))
+    subs = [((1.0, 4.0), "first caption"), ((4.0, 6.5), None), ((6.5, 10.0), "second caption")]
+    out_path = str(tmp_path / "part_1")
+    ffmpeg_renderer.render_moment(video_file, (1280, 720), subs, out_path, encode_settings={"preset": "ultrafast"})
+    # Decodes every frame and fails on the first decoding error
+    result = subprocess.run([FFMPEG_BINARY, "-v", "error", "-xerror", "-i", out_path + ".mp4", "-f", "null", "-"],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert result.returncode == 0, result.stderr.decode(errors="replace")
+    assert result.stderr == b""
+
+
+def _frame_hashes(media_file, start, frames):
+    result = subprocess.run([FFMPEG_BINARY, "-v", "error", "-ss", str(start), "-i", str(media_file), "-map", "0:v:0",
+                             "-frames:v", str(frames), "-f", "framemd5", "-"], stdout=subprocess.PIPE, check=True)
+    return [line.split(",")[-1] for line in result.stdout.decode().splitlines() if not line.startswith("#")]
+
+
+@pytest.mark.skipif(shutil.which(FFPROBE_BINARY) is None, reason="ffprobe is not installed")
+@pytest.mark.parametrize("x264_preset", ["ultrafast", "veryfast"])
+def test_smart_cut_joins_copied_and_encoded_pieces(tmp_path, x264_preset):
+    # 640 pixels wide is left uncropped; veryfast adds B-frames with a two frame reorder delay
+    video_file = tmp_path / "source.mp4"
+    subprocess.run([FFMPEG_BINARY, "-v", "error", "-f", "lavfi", "-i", "testsrc2=size=640x360:rate=25:duration=20",
+                    "-f", "lavfi", "-i", "sine=frequency=440:duration=20", "-c:v", "libx264", "-preset", x264_preset,
+                    "-profile:v", "high", "-g", "50", "-pix_fmt", "yuv420p", "-c:a", "aac", str(video_file)],
+                   check=True)
+    subs = [((1.0, 3.0), "first caption"), ((3.0, 11.0), None), ((11.0, 13.0), "second caption"), ((13.0, 18.0), None)]
+    pieces = ffmpeg_renderer.plan_smart_cut(subs, probe_keyframes(video_file, 1.0, 18.0))
+    assert ("copy", 4.0, 10.0) in pieces and ("copy", 14.0, 18.0) in pieces
+
+    out_path = str(tmp_path / "part_1")
+    ffmpeg_renderer.render_moment_smart(video_file, (640, 360), subs, out_path, encode_settings={"preset": "ultrafast"})
+    result = subprocess.run([FFMPEG_BINARY, "-v", "warning", "-xerror", "-i", out_path + ".mp4", "-f", "null", "-"],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert result.returncode == 0, result.stderr.decode(errors="replace")
+    # No timestamp warnings at the joins either
+    assert result.stderr == b""
+    streams = run_ffprobe(["-count_frames", "-show_entries", "stream=codec_type,nb_read_frames,duration",
+                           out_path + ".mp4"])["streams"]
+    video = next(stream for stream in streams if stream["codec_type"] == "video")
+    audio = next(stream for stream in streams if stream["codec_type"] == "audio")
+    assert int(video["nb_read_frames"]) == 17 * 25
+    assert float(audio["duration"]) == pytest.approx(17.0, abs=0.05)
+    # The copied stretch of source seconds 4-10 decodes to the very same frames at 3-9 s of the part
+    assert _frame_hashes(out_path + ".mp4", 3, 150) == _frame_hashes(video_file, 4, 150)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["part_1.mp4", "source.mp4"]
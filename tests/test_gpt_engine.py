@@ -0,0 +1,118 @@
+import time
+
+import pytest
+
+import gpt_engine
+import moments_creating_gpt
+from gpt_engine import FakeChatClient, RateLimiter, ResponseCache
+from moments_creating_gpt import GptProcessor
+
+
+class WordEncoding:
+    def encode(self, text):
+        return text.split()
+
+
+class FakeClock:
+    """
+    Stands in for time.monotonic and time.sleep; sleeping only moves the clock forward.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(gpt_engine.time, "monotonic", fake.monotonic)
+    monkeypatch.setattr(gpt_engine.time, "sleep", fake.sleep)
+    return fake
+
+
+def make_processor(tmp_path, client, **kwargs):
+    kwargs.setdefault("cache_dir", tmp_path / "cache")
+    return GptProcessor("gpt-3.5-turbo", client=client, encoding=WordEncoding(), **kwargs)
+
+
+def test_cached_completions_are_not_paid_twice(tmp_path):
+    client = FakeChatClient("moment")
+    assert make_processor(tmp_path, client).call_openai_api("prompt", 1) == "moment"
+    # A new processor, as on the next run, finds the completion on disk
+    assert make_processor(tmp_path, client).call_openai_api("prompt", 1) == "moment"
+    assert len(client.calls) == 1
+    assert ResponseCache(tmp_path / "cache").get("gpt-3.5-turbo", "prompt") == "moment"
+    # Another prompt or model is a new request
+    make_processor(tmp_path, client).call_openai_api("other prompt", 2)
+    assert len(client.calls) == 2
+
+
+def test_failed_requests_are_not_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(moments_creating_gpt.time, "sleep", lambda seconds: None)
+
+    def respond(model, prompt):
+        raise RuntimeError("server error")
+    client = FakeChatClient(respond)
+    assert make_processor(tmp_path, client, max_retries=2).call_openai_api("prompt", 1) is None
+    assert len(client.calls) == 2
+    assert ResponseCache(tmp_path / "cache").get("gpt-3.5-turbo", "prompt") is None
+
+
+def test_rate_limiter_waits_for_the_request_budget(clock):
+    limiter = RateLimiter(requests_per_minute=2)
+    start = clock.now
+    limiter.acquire()
+    clock.now += 10
+    limiter.acquire()
+    assert clock.sleeps == []
+    # The third request waits until the first one leaves the one-minute window
+    limiter.acquire()
+    assert clock.now == start + 60
+    limiter.acquire()
+    assert clock.now == start + 70
+
+
+def test_rate_limiter_waits_for_the_token_budget(clock):
+    limiter = RateLimiter(tokens_per_minute=1000)
+    start = clock.now
+    limiter.acquire(600)
+    limiter.acquire(400)
+    assert clock.sleeps == []
+    limiter.acquire(1)
+    assert clock.now == start + 60
+    # A request over the whole budget goes through alone once the window is empty
+    limiter.acquire(5000)
+    assert clock.now == start + 120
+
+
+def test_no_limits_never_wait(clock):
+    limiter = RateLimiter()
+    for _ in range(100):
+        limiter.acquire(10 ** 6)
+    assert clock.sleeps == []
+
+
+def test_concurrent_completions_keep_the_prompt_order(tmp_path):
+    prompts = [(f"prompt {i}", 1) for i in range(8)]
+    finished = []
+
+    def respond(model, prompt):
+        # Earlier prompts take longer, so they finish last
+        time.sleep(0.02 * (8 - int(prompt.split()[-1])))
+        finished.append(prompt)
+        return prompt.replace("prompt", "completion")
+    client = FakeChatClient(respond)
+    processor = make_processor(tmp_path, client, max_concurrency=4, cache_dir=None)
+    completions, failed = processor.send_prompts(prompts)
+    assert completions == [f"completion {i}" for i in range(8)]
+    assert failed == 0
+    # The requests did overlap and came back out of order
+    assert finished != [prompt for (prompt, _) in prompts]
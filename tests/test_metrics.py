@@ -0,0 +1,23 @@
+import re
+from pathlib import Path
+
+import pytest
+
+from metrics import MEASURED_STAGES, MetricsRecorder
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_measured_stages_cover_every_measure_call():
+    used = set()
+    for source in ROOT.glob("*.py"):
+        used.update(re.findall(r"""\.measure\(\s*["']([^"']+)["']""", source.read_text()))
+    assert used == set(MEASURED_STAGES)
+
+
+def test_unknown_stages_are_rejected(tmp_path):
+    recorder = MetricsRecorder(tmp_path / "metrics.jsonl")
+    with pytest.raises(ValueError, match="Unknown metrics stage"):
+        with recorder.measure("render_moments"):
+            pass
+    assert recorder.records == []
@@ -0,0 +1,81 @@
+import json
+import re
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "benchmarks"))
+
+import synthetic  # noqa: E402
+import moments_creating_gpt  # noqa: E402
+from build_cache import BuildManifest  # noqa: E402
+from gpt_engine import FakeChatClient  # noqa: E402
+from moments_creating_gpt import GptProcessor  # noqa: E402
+
+PROMPTS_DIR = Path(__file__).resolve().parent.parent / "prompts"
+
+
+class WordEncoding:
+    def encode(self, text):
+        return text.split()
+
+
+def make_folder(root):
+    folder = root / "video"
+    folder.mkdir()
+    with open(folder / "transcribe.json", "w") as f:
+        json.dump(synthetic.make_transcript(600), f)
+    with open(folder / "metadata.json", "w") as f:
+        json.dump({"title": "Synthetic video"}, f)
+    return folder
+
+
+def make_processor(tmp_path, client):
+    return GptProcessor("gpt-3.5-turbo", max_retries=2, client=client, cache_dir=tmp_path / "cache",
+                        encoding=WordEncoding(), prompt_path=str(PROMPTS_DIR / "sample_prompt.txt"),
+                        context_tokens=2048)
+
+
+@pytest.fixture(autouse=True)
+def no_retry_sleep(monkeypatch):
+    monkeypatch.setattr(moments_creating_gpt.time, "sleep", lambda seconds: None)
+
+
+def test_failed_blocks_are_retried_on_the_next_run(tmp_path):
+    folder = make_folder(tmp_path)
+    outage = {"on": True}
+
+    def respond(model, prompt):
+        # Only the first block of subtitles fails, and only during the outage
+        if outage["on"] and re.search(r"^0:00->", prompt, re.MULTILINE):
+            raise RuntimeError("server error")
+        return synthetic.make_completion([(0, 60)])
+    client = FakeChatClient(respond)
+    processor = make_processor(tmp_path, client)
+
+    with pytest.raises(RuntimeError, match="1 of"):
+        processor.process_folder(folder)
+    blocks = len(client.calls) - 1
+    assert blocks > 1
+    assert not (folder / "output.txt").exists()
+    assert not BuildManifest(folder).is_fresh("gpt", processor.build_inputs(folder), processor.build_params())
+
+    # Only the failed block is sent again, the others come from the cache
+    outage["on"] = False
+    processor.process_folder(folder)
+    assert len(client.calls) == blocks + 2
+    assert (folder / "output.txt").read_text().count("Timestamp") == blocks
+    assert BuildManifest(folder).is_fresh("gpt", processor.build_inputs(folder), processor.build_params())
+
+
+def test_failed_descriptions_are_reported(tmp_path):
+    folder = make_folder(tmp_path)
+
+    def respond(model, prompt):
+        raise RuntimeError("server error")
+    processor = make_processor(tmp_path, FakeChatClient(respond))
+    processor.title_prompt_path = str(PROMPTS_DIR / "title_prompt.txt")
+    index = moments_creating_gpt.SegmentIndex(synthetic.make_transcript(600)["segments"])
+    moments, failed = processor.describe_moments("Synthetic video", index, [(0, 60), (120, 180)])
+    assert moments == [] and failed == 2
@@ -0,0 +1,116 @@
+import pytest
+
+from output_parser import MomentParser, adjust_moments_timestamps, parse_moments
+
+NUMBERED = """1. Title of moment: The cat jumps
+Hashtags: #cat #funny
+Description: A cat jumps over the fence.
+Timestamp: 0:10->1:20
+
+2. Title of moment: The dog follows
+Hashtags: #dog
+Description: The dog tries too.
+It fails.
+Timestamp: 2:00 -> 3:05
+"""
+
+NEXT_LINE_VALUES = """Title of moment:
+The big reveal
+Hashtags:
+#reveal #science
+Description: Everything is explained.
+Timestamp: 4:00-5:10
+"""
+
+INLINE_TIMESTAMP = """- The loose title
+Hashtags: #history
+Description: Someone tells a story. Timestamp: 1:02:03 - 1:03:00
+"""
+
+
+def moment(title, hashtags, description, start, end):
+    return {"title": title, "hashtags": hashtags, "description": description, "start_timestamp": start,
+            "end_timestamp": end}
+
+
+def test_parses_the_baseline_formats():
+    assert parse_moments(NUMBERED).moments == [
+        moment("The cat jumps", ["#cat", "#funny"], "A cat jumps over the fence.", "00:10", "01:20"),
+        moment("The dog follows", ["#dog"], "The dog tries too.\nIt fails.", "02:00", "03:05"),
+    ]
+    assert parse_moments(NEXT_LINE_VALUES).moments == [
+        moment("The big reveal", ["#reveal", "#science"], "Everything is explained.", "04:00", "05:10"),
+    ]
+    # A title without "Title of moment:" and the timestamp at the end of the description line
+    assert parse_moments(INLINE_TIMESTAMP).moments == [
+        moment("The loose title", ["#history"], "Someone tells a story.", "62:03", "63:00"),
+    ]
+
+
+@pytest.mark.parametrize("separator", ["->", " -> ", "-", " - "])
+def test_timestamp_separators(separator):
+    text = f"Title: A\nHashtags: #a\nDescription: B\nTimestamp: 1:00{separator}1:45\n"
+    (parsed,) = parse_moments(text).moments
+    assert (parsed["start_timestamp"], parsed["end_timestamp"]) == ("01:00", "01:45")
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64])
+def test_chunks_parse_like_the_whole_text(chunk_size):
+    text = NUMBERED + "\n" + NEXT_LINE_VALUES + INLINE_TIMESTAMP.rstrip("\n")
+    whole = parse_moments(text)
+    parser = MomentParser()
+    streamed = []
+    for i in range(0, len(text), chunk_size):
+        streamed += parser.feed(text[i:i + chunk_size])
+    parser.close()
+    assert streamed + parser.moments[len(streamed):] == parser.moments
+    assert parser.moments == whole.moments
+    assert len(parser.moments) == 4
+    assert parser.rejected == whole.rejected == {}
+
+
+def test_rejected_candidates_are_counted():
+    text = """Title: No timestamp
+Hashtags: #a
+Description: The next title starts before a timestamp.
+Title: Bad timestamp
+Hashtags: #b
+Description: B
+Timestamp: soon
+Title: Backwards
+Hashtags: #c
+Description: C
+Timestamp: 2:00->1:00
+Timestamp: 3:00->4:00
+Title: Good
+Hashtags: #d
+Description: D
+Timestamp: 5:00->6:00
+Title: Cut off
+Hashtags: #e
+"""
+    parser = parse_moments(text)
+    assert [parsed["title"] for parsed in parser.moments] == ["Good"]
+    assert parser.rejected == {"missing_timestamp": 2, "invalid_timestamp": 1, "end_before_start": 1,
+                               "missing_fields": 1}
+
+
+def spans(moments):
+    return [(parsed["start_timestamp"], parsed["end_timestamp"]) for parsed in moments]
+
+
+def test_adjust_fills_gaps_and_drops_overlaps():
+    moments = [moment("A", [], "", "00:00", "01:00"),
+               # A 40 second gap gets one filler
+               moment("B", [], "", "01:40", "02:40"),
+               # Overlaps B and is dropped
+               moment("C", [], "", "02:30", "03:00"),
+               # The gap of more than 2 minutes after C is split into two fillers
+               moment("D", [], "", "07:40", "08:00"),
+               # Gaps of 30 seconds or less are kept
+               moment("E", [], "", "08:30", "09:00")]
+    adjusted = adjust_moments_timestamps(moments)
+    assert spans(adjusted) == [("00:00", "01:00"), ("01:00", "01:40"), ("01:40", "02:40"), ("03:00", "05:20"),
+                               ("05:20", "07:40"), ("07:40", "08:00"), ("08:30", "09:00")]
+    # Fillers have no title, the moments are passed through unchanged
+    assert [parsed.get("title") for parsed in adjusted] == ["A", None, "B", None, None, "D", "E"]
@@ -0,0 +1,64 @@
+"""
+Peak RSS of the streaming moviepy render for moments of growing length. Every render runs in a fresh
+process, so each peak is measured on its own.
+"""
+import json
+import resource
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+# Also run as the render process, without the conftest
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "benchmarks"))
+
+import synthetic  # noqa: E402
+from video_creator import VideoProcessor, release_video_clips, render_moment  # noqa: E402
+
+# Allowed growth of the peak RSS between the shortest and the longest moment
+TOLERANCE_MB = 32.0
+
+
+def render_peak_rss(folder, name, size, length, max_memory_mb=None):
+    """
+    Renders the first length seconds of the video in folder and returns the peak RSS of this process in MB.
+    """
+    processor = VideoProcessor(folder, render_workers=1)
+    processor.load_transcribe_data(folder / "transcribe.json")
+    processor.movie_duration = length
+    # Moments are extended by 10 seconds up to the end of the movie
+    end = length - 10
+    subs = processor.create_subs_for_moment({"start_timestamp": "0:00", "end_timestamp": f"{end // 60}:{end % 60:02}"})
+    out_dir = folder / "renders"
+    out_dir.mkdir(exist_ok=True)
+    try:
+        render_moment(str(folder / (name + ".mp4")), size, subs, str(out_dir / f"part_{length}"),
+                      processor.subtitle_style, dict(processor.encode_settings, preset="ultrafast"), max_memory_mb)
+    finally:
+        release_video_clips()
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+@pytest.mark.slow
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is not installed")
+@pytest.mark.parametrize("max_memory_mb", [None, 48])
+def test_peak_rss_does_not_grow_with_moment_length(tmp_path, max_memory_mb):
+    size = (960, 540)
+    lengths = [40, 120]
+    name = "memory"
+    folder = synthetic.make_video_folder(tmp_path, name, max(lengths), size=size)
+    peaks = []
+    for length in lengths:
+        args = json.dumps([str(folder), name, size, length, max_memory_mb])
+        result = subprocess.run([sys.executable, __file__, args], stdout=subprocess.PIPE, check=True)
+        peaks.append(float(result.stdout.decode().split()[-1]))
+    assert peaks[-1] - peaks[0] <= TOLERANCE_MB, f"Peak RSS by moment length {dict(zip(lengths, peaks))}"
+
+
+if __name__ == "__main__":
+    (folder, name, size, length, max_memory_mb) = json.loads(sys.argv[1])
+    print(render_peak_rss(Path(folder), name, tuple(size), length, max_memory_mb))
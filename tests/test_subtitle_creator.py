@@ -0,0 +1,25 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+whisper = pytest.importorskip("whisper")
+
+from subtitle_creator import quantize_int8  # noqa: E402
+
+
+class TinyModel(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.encoder = torch.nn.Sequential(whisper.model.Linear(16, 32), torch.nn.GELU(), whisper.model.Linear(32, 8))
+
+
+def test_quantize_int8_swaps_whisper_linear_layers():
+    model = quantize_int8(TinyModel())
+    layers = [module for module in model.modules() if isinstance(module, torch.ao.nn.quantized.dynamic.Linear)]
+    assert len(layers) == 2
+    assert not any(isinstance(module, whisper.model.Linear) for module in model.modules())
+    assert model.encoder(torch.randn(4, 16)).shape == (4, 8)
+
+
+def test_quantize_int8_fails_without_linear_layers():
+    with pytest.raises(RuntimeError):
+        quantize_int8(torch.nn.Sequential(torch.nn.GELU()))
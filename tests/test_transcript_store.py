@@ -0,0 +1,51 @@
+import json
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "benchmarks"))
+
+import synthetic  # noqa: E402
+from segment_index import SegmentIndex  # noqa: E402
+from transcript_store import SegmentRecords, load_segments, open_transcript_store, write_transcript_store  # noqa: E402
+
+
+@pytest.fixture
+def transcribe_file(tmp_path):
+    path = tmp_path / "transcribe.json"
+    with open(path, "w") as f:
+        json.dump(synthetic.make_transcript(600), f)
+    write_transcript_store(json.loads(path.read_text()), path)
+    return path
+
+
+def test_load_segments_is_lazy_and_matches_json(transcribe_file):
+    expected = json.loads(transcribe_file.read_text())["segments"]
+    segments = load_segments(transcribe_file)
+    assert isinstance(segments, SegmentRecords)
+    assert len(segments) == len(expected)
+    for segment, reference in zip(segments, expected):
+        assert (segment["start"], segment["end"]) == pytest.approx((reference["start"], reference["end"]))
+        assert segment["text"] == reference["text"]
+    assert segments[-1]["text"] == expected[-1]["text"]
+
+
+def test_words_keep_probability(transcribe_file):
+    words = open_transcript_store(transcribe_file).words()
+    assert isinstance(words, types.GeneratorType)
+    first = next(words)
+    reference = json.loads(transcribe_file.read_text())["segments"][0]["words"][0]
+    assert first["word"] == reference["word"]
+    assert first["probability"] == pytest.approx(reference["probability"])
+    assert first["segment"] == 0
+
+
+def test_segment_index_over_lazy_segments(transcribe_file):
+    segments = load_segments(transcribe_file)
+    lazy_index = SegmentIndex(segments)
+    list_index = SegmentIndex(json.loads(transcribe_file.read_text())["segments"])
+    assert lazy_index.segments is segments
+    assert [segment["text"] for segment in lazy_index.overlapping(100, 160)] == \
+        [segment["text"] for segment in list_index.overlapping(100, 160)]
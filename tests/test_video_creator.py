@@ -0,0 +1,202 @@
+import json
+import multiprocessing
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "benchmarks"))
+
+import synthetic  # noqa: E402
+import ffmpeg_renderer  # noqa: E402
+from metrics import recorder  # noqa: E402
+from pipeline import Stage, StreamingPipeline  # noqa: E402
+from video_creator import (ENCODE_SETTINGS, VideoProcessor, get_caption_renderer, get_video_clip,  # noqa: E402
+                           release_video_clips, render_moment, render_moments_single_pass)
+
+pytestmark = pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is not installed")
+
+
+def test_render_threads_keep_their_own_clips_and_captions(tmp_path):
+    video_file = str(synthetic.make_video(tmp_path / "source.mp4", 5, size=(320, 240)))
+    opened = threading.Event()
+    released = threading.Event()
+    seen = {}
+
+    def other_thread():
+        seen["clip"] = get_video_clip(video_file)
+        seen["captions"] = get_caption_renderer()
+        opened.set()
+        released.wait()
+        # Still readable after the main thread released its clips
+        seen["frame"] = seen["clip"].reader.get_frame(1.0)
+        release_video_clips()
+
+    thread = threading.Thread(target=other_thread)
+    thread.start()
+    opened.wait()
+    clip = get_video_clip(video_file)
+    assert clip is not seen["clip"]
+    assert get_caption_renderer() is not seen["captions"]
+    release_video_clips()
+    released.set()
+    thread.join()
+    assert seen["frame"].shape == (240, 320, 3)
+
+
+def test_stream_render_stage_with_two_workers(tmp_path):
+    names = ["first", "second"]
+    for name in names:
+        synthetic.make_video_folder(tmp_path, name, 45, size=(640, 360), moments=[(0, 35)])
+
+    def render_handler():
+        processor = VideoProcessor(tmp_path, render_workers=1, encode_settings={"preset": "ultrafast"})
+
+        def handle(folder):
+            processor.process_single_movie(folder)
+            return folder
+        return handle
+
+    done = StreamingPipeline([Stage("VideoProcessor", render_handler, workers=2)]).run(
+        [tmp_path / name for name in names])
+    assert sorted(folder.name for folder in done) == names
+    for name in names:
+        assert (tmp_path / name / "results" / "part_1.mp4").stat().st_size > 0
+
+
+def test_approved_parts_are_not_rendered_again(tmp_path):
+    folder = synthetic.make_video_folder(tmp_path, "video", 90, size=(640, 360), moments=[(0, 35), (45, 80)])
+    processor = VideoProcessor(tmp_path, render_workers=1, encode_settings={"preset": "ultrafast"},
+                               preview_settings={"kind": "contact_sheet"})
+    processor.preview_single_movie(folder)
+    assert processor.render_approved(folder, [1]) == 1
+    assert processor.render_approved(folder, [1]) == 0
+    # The full render only adds the parts that were not approved
+    parts = processor._process_single_movie(folder)
+    assert parts == 1
+    assert (folder / "results" / "part_1.mp4").is_file() and (folder / "results" / "part_2.mp4").is_file()
+    assert processor._process_single_movie(folder) == 0
+
+
+@pytest.mark.parametrize("render_workers", [1, 2])
+def test_failed_part_does_not_stop_the_others(tmp_path, render_workers):
+    folder = synthetic.make_video_folder(tmp_path, "video", 90, size=(640, 360), moments=[(0, 35), (45, 80)])
+    processor = VideoProcessor(tmp_path, render_workers=render_workers, encode_settings={"preset": "ultrafast"})
+    processor.results_dir = folder / "results"
+    video_file = processor.find_video_file(folder)
+    jobs = processor.prepare_moments(folder, video_file)
+    # The first part has nothing to render and fails
+    (i, data, _) = jobs[0]
+    jobs[0] = (i, data, [])
+    with pytest.raises(RuntimeError, match=r"Parts \[1\]"):
+        processor.render_moments(video_file, jobs)
+    assert not (folder / "results" / "part_1.mp4").exists()
+    assert (folder / "results" / "part_2.mp4").is_file() and (folder / "results" / "part_2.txt").is_file()
+
+
+def _decode(media_file, *args):
+    return subprocess.run(["ffmpeg", "-v", "error", "-i", str(media_file), *args, "-"], stdout=subprocess.PIPE,
+                          check=True).stdout
+
+
+def test_moviepy_render_keeps_audio_in_sync_with_spans(tmp_path):
+    # A tone only between seconds 8 and 10 of the source
+    video_file = str(tmp_path / "source.mp4")
+    subprocess.run(["ffmpeg", "-v", "error", "-f", "lavfi", "-i", "testsrc2=size=320x240:rate=25:duration=20",
+                    "-f", "lavfi", "-i", "aevalsrc=if(between(t\\,8\\,10)\\,sin(2*PI*440*t)\\,0):s=8000:d=20",
+                    "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", "-c:a", "aac", video_file],
+                   check=True)
+    # A gap between the first two spans and a repeat of an earlier second at the end: 3 + 2 + 1 seconds
+    subs = [((2.0, 5.0), "first caption"), ((8.0, 10.0), None), ((3.0, 4.0), "repeated caption")]
+    out_path = str(tmp_path / "part_1")
+    try:
+        render_moment(video_file, (320, 240), subs, out_path, encode_settings=dict(ENCODE_SETTINGS, preset="ultrafast"),
+                      max_memory_mb=64)
+    finally:
+        release_video_clips()
+    (_, _, width, height) = ffmpeg_renderer.crop_box((320, 240))
+    frames = _decode(out_path + ".mp4", "-map", "0:v:0", "-f", "rawvideo", "-pix_fmt", "gray")
+    assert len(frames) // (width * height) == 6 * 25
+    audio = np.frombuffer(_decode(out_path + ".mp4", "-map", "0:a:0", "-f", "s16le", "-ac", "1", "-ar", "8000"),
+                          dtype=np.int16).astype(np.float64)
+    assert len(audio) / 8000 == pytest.approx(6.0, abs=0.05)
+    # The tone is heard exactly while the frames of source seconds 8-10 are shown, at 3-5 s of the part
+    loudness = [np.sqrt(np.mean(audio[int((t + 0.2) * 8000):int((t + 0.8) * 8000)] ** 2)) for t in range(6)]
+    assert [level > 1000 for level in loudness] == [False, False, False, True, True, False]
+    assert get_caption_renderer().max_bytes is None
+    assert not (tmp_path / "part_1.video.mp4").exists()
+
+
+def test_moviepy_render_rejects_moments_without_subtitles(tmp_path):
+    video_file = str(synthetic.make_video(tmp_path / "source.mp4", 5, size=(320, 240)))
+    try:
+        with pytest.raises(ValueError, match="no subtitles"):
+            render_moment(video_file, (320, 240), [], str(tmp_path / "part_1"))
+    finally:
+        release_video_clips()
+    assert not (tmp_path / "part_1.mp4").exists()
+
+
+def test_single_pass_decodes_overlapping_moments_once(tmp_path, monkeypatch):
+    video_file = str(synthetic.make_video(tmp_path / "source.mp4", 20, size=(320, 240)))
+    # Seconds 0-10 and 5-15 overlap by 5 seconds
+    parts = [([((0.0, 4.0), "first caption"), ((4.0, 10.0), None)], str(tmp_path / "part_1")),
+             ([((5.0, 12.0), "second caption"), ((12.0, 15.0), "third caption")], str(tmp_path / "part_2"))]
+    clip = get_video_clip(video_file)
+    decoded_times = []
+    get_frame = clip.reader.get_frame
+
+    def counting_get_frame(t):
+        decoded_times.append(t)
+        return get_frame(t)
+    monkeypatch.setattr(clip.reader, "get_frame", counting_get_frame)
+    try:
+        (decoded, encoded) = render_moments_single_pass(video_file, (320, 240), parts,
+                                                        encode_settings=dict(ENCODE_SETTINGS, preset="ultrafast"))
+    finally:
+        release_video_clips()
+    # The union of the windows, 0-15 s, is decoded once; both parts together encode their sum, 20 s
+    assert decoded == len(decoded_times) == 15 * 25
+    assert sorted(set(decoded_times)) == decoded_times
+    assert encoded == 20 * 25
+    (_, _, width, height) = ffmpeg_renderer.crop_box((320, 240))
+    for (_, out_path) in parts:
+        frames = _decode(out_path + ".mp4", "-map", "0:v:0", "-f", "rawvideo", "-pix_fmt", "gray")
+        assert len(frames) // (width * height) == 10 * 25
+        audio = _decode(out_path + ".mp4", "-map", "0:a:0", "-f", "s16le", "-ac", "1", "-ar", "8000")
+        assert len(audio) / 2 / 8000 == pytest.approx(10.0, abs=0.05)
+        assert not Path(out_path + ".video.mp4").exists()
+
+
+def test_render_pool_workers_join_the_metrics_run(tmp_path):
+    folder = synthetic.make_video_folder(tmp_path, "video", 90, size=(640, 360), moments=[(0, 35), (45, 80)])
+    metrics_file = tmp_path / "metrics.jsonl"
+    recorder.configure(metrics_file)
+    processor = VideoProcessor(tmp_path, render_workers=2, encode_settings={"preset": "ultrafast"})
+    rendering = threading.Thread(target=processor.process_single_movie, args=(folder,), daemon=True)
+
+    def rendered_parts():
+        if not metrics_file.is_file():
+            return []
+        return sorted(record["part"] for record in map(json.loads, metrics_file.read_text().splitlines())
+                      if record["stage"] == "render_moment" and record["run"] == recorder.run_id)
+    try:
+        # The workers start while another thread holds the recorder lock; forked workers would inherit it locked
+        with recorder._lock:
+            rendering.start()
+            deadline = time.monotonic() + 120
+            while len(rendered_parts()) < 2 and time.monotonic() < deadline:
+                time.sleep(0.1)
+        assert rendered_parts() == ["part_1", "part_2"]
+        rendering.join()
+    finally:
+        # Deadlocked workers would keep the pool, and pytest, from ever finishing
+        if rendering.is_alive():
+            for child in multiprocessing.active_children():
+                child.terminate()
+        recorder.configure()
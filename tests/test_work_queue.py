@@ -0,0 +1,44 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from work_queue import STAGES, QueueWorker, WorkQueue
+
+
+def _run_worker(path, log_dir):
+    def handle(job):
+        with open(os.path.join(log_dir, f"claims-{os.getpid()}.log"), "a") as f:
+            f.write(f"{job.video_id} {job.stage}\n")
+        time.sleep(0.01)
+        return job.payload
+    work_queue = WorkQueue(path, lease_seconds=30)
+    return QueueWorker(work_queue, {stage: handle for stage in STAGES}, poll_interval=0.05).run()
+
+
+def test_two_workers_claim_every_job_once(tmp_path):
+    path = tmp_path / "queue.sqlite3"
+    work_queue = WorkQueue(path)
+    for i in range(10):
+        work_queue.enqueue(f"video{i}", "download", f"link{i}")
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        processed = list(executor.map(_run_worker, [path] * 2, [str(tmp_path)] * 2))
+
+    claims = []
+    for log in tmp_path.glob("claims-*.log"):
+        claims += log.read_text().splitlines()
+    expected = [f"video{i} {stage}" for i in range(10) for stage in STAGES]
+    assert sorted(claims) == sorted(expected)
+    assert sum(processed) == len(expected)
+    assert work_queue.counts() == {(stage, "done"): 10 for stage in STAGES}
+
+
+def test_failing_handler_is_retried_then_failed(tmp_path):
+    work_queue = WorkQueue(tmp_path / "queue.sqlite3", max_attempts=2, retry_delay=0.01)
+    work_queue.enqueue("video0", "render")
+
+    def handle(job):
+        raise RuntimeError("part 1 could not be rendered")
+
+    processed = QueueWorker(work_queue, {"render": handle}, stages=("render",), poll_interval=0.01).run()
+    assert processed == 0
+    assert work_queue.failed() == [("video0", "render", 2, "part 1 could not be rendered")]
@@ -0,0 +1,128 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import youtube_scrapper
+from youtube_scrapper import HttpTransport, YouTubeDownloader
+
+VIDEO = bytes(range(256)) * 400
+
+
+class FileServer:
+    """
+    Local HTTP server standing in for the video host. files maps paths to bytes; head_sizes overrides the size
+    announced by HEAD requests and ranges turns support for range requests on and off.
+    """
+
+    def __init__(self, files, head_sizes=None, ranges=True):
+        self.files = files
+        self.head_sizes = head_sizes or {}
+        self.ranges = ranges
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_HEAD(self):
+                server.requests.append(("HEAD", self.path, None))
+                if self.path not in server.files:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Length", str(server.head_sizes.get(self.path, len(server.files[self.path]))))
+                self.end_headers()
+
+            def do_GET(self):
+                requested_range = self.headers.get("Range")
+                server.requests.append(("GET", self.path, requested_range))
+                if self.path not in server.files:
+                    self.send_error(404)
+                    return
+                data = server.files[self.path]
+                if requested_range and server.ranges:
+                    offset = int(requested_range.split("=")[1].rstrip("-"))
+                    if offset >= len(data):
+                        self.send_error(416)
+                        return
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {offset}-{len(data) - 1}/{len(data)}")
+                    data = data[offset:]
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.httpd.server_port}{path}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    waits = []
+    monkeypatch.setattr(youtube_scrapper.time, "sleep", waits.append)
+    return waits
+
+
+def make_downloader(tmp_path):
+    return YouTubeDownloader(tmp_path, audio_format="none", max_retries=3, transport=HttpTransport(chunk_size=4096))
+
+
+@pytest.mark.parametrize("ranges", [True, False])
+def test_part_file_is_resumed(tmp_path, sleeps, ranges):
+    with FileServer({"/video.mp4": VIDEO}, ranges=ranges) as server:
+        (tmp_path / "video").mkdir()
+        (tmp_path / "video" / "video.mp4.part").write_bytes(VIDEO[:30000])
+        downloader = make_downloader(tmp_path)
+        assert downloader.download_channel_video(server.url("/video.mp4")) == tmp_path / "video"
+    assert (tmp_path / "video" / "video.mp4").read_bytes() == VIDEO
+    assert not (tmp_path / "video" / "video.mp4.part").exists()
+    # Only the missing bytes are asked for; a server without ranges sends the whole file, which replaces the part
+    assert [request for request in server.requests if request[0] == "GET"] == [("GET", "/video.mp4", "bytes=30000-")]
+    assert downloader.failed == [] and sleeps == []
+
+
+def test_oversized_part_file_is_downloaded_again(tmp_path, sleeps):
+    with FileServer({"/video.mp4": VIDEO}) as server:
+        (tmp_path / "video").mkdir()
+        (tmp_path / "video" / "video.mp4.part").write_bytes(VIDEO + b"stale")
+        make_downloader(tmp_path).download_channel_video(server.url("/video.mp4"))
+    assert (tmp_path / "video" / "video.mp4").read_bytes() == VIDEO
+    assert [request for request in server.requests if request[0] == "GET"] == [("GET", "/video.mp4", None)]
+
+
+def test_size_mismatch_keeps_the_part_file(tmp_path, sleeps):
+    # The host announces more bytes than it sends
+    with FileServer({"/video.mp4": VIDEO}, head_sizes={"/video.mp4": len(VIDEO) + 100}) as server:
+        downloader = make_downloader(tmp_path)
+        with pytest.raises(IOError, match=f"{len(VIDEO)} of {len(VIDEO) + 100} bytes"):
+            downloader.download_video(server.url("/video.mp4"), tmp_path)
+    assert not (tmp_path / "video.mp4").exists()
+    assert (tmp_path / "video.mp4.part").read_bytes() == VIDEO
+
+
+def test_failing_links_end_up_in_failed(tmp_path, sleeps):
+    with FileServer({"/video.mp4": VIDEO}) as server:
+        downloader = make_downloader(tmp_path)
+        links = [server.url("/missing.mp4"), server.url("/video.mp4")]
+        assert [downloader.download_channel_video(link) for link in links] == [None, tmp_path / "video"]
+    assert downloader.failed == [server.url("/missing.mp4")]
+    assert server.requests.count(("HEAD", "/missing.mp4", None)) == 3
+    # Backoff between the attempts, none after the last one
+    assert sleeps == [1, 2]
+    assert not (tmp_path / "missing" / "missing.mp4").exists()
+    assert (tmp_path / "video" / "video.mp4").read_bytes() == VIDEO
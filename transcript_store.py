@@ -0,0 +1,156 @@
+import json
+import os
+import shutil
+from collections.abc import Sequence
+from pathlib import Path
+
+import numpy as np
+
+STORE_NAME = "transcript"
+
+
+def _pack_texts(texts):
+    """
+    Returns (offsets, blob): UTF-8 texts concatenated into one blob, text i is blob[offsets[i]:offsets[i + 1]].
+    """
+    encoded = [text.encode("utf-8") for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(text) for text in encoded], dtype=np.int64)
+    return offsets, b"".join(encoded)
+
+
+def write_transcript_store(result, transcribe_file):
+    """
+    Writes the columns of a Whisper result next to transcribe_file: segment and word times as .npy arrays
+    and their texts as an offsets array plus a UTF-8 blob.
+    """
+    store_path = Path(transcribe_file).parent / STORE_NAME
+    tmp_path = store_path.with_name(STORE_NAME + ".tmp")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tmp_path.mkdir()
+
+    segments = result["segments"]
+    words = [(i, word) for i, segment in enumerate(segments) for word in segment.get("words", [])]
+    columns = {
+        "segment_start": np.array([segment["start"] for segment in segments], dtype=np.float64),
+        "segment_end": np.array([segment["end"] for segment in segments], dtype=np.float64),
+        "word_start": np.array([word["start"] for _, word in words], dtype=np.float64),
+        "word_end": np.array([word["end"] for _, word in words], dtype=np.float64),
+        "word_probability": np.array([word.get("probability", 0.0) for _, word in words], dtype=np.float32),
+        "word_segment": np.array([i for i, _ in words], dtype=np.int32),
+    }
+    for name, texts in (("segment_text", [segment["text"] for segment in segments]),
+                        ("word_text", [word["word"] for _, word in words])):
+        columns[name + "_offsets"], blob = _pack_texts(texts)
+        with open(tmp_path / (name + ".bin"), "wb") as f:
+            f.write(blob)
+    for name, column in columns.items():
+        np.save(tmp_path / (name + ".npy"), column)
+
+    shutil.rmtree(store_path, ignore_errors=True)
+    os.replace(tmp_path, store_path)
+    return store_path
+
+
+class TranscriptStore:
+    """
+    Read-only view of a columnar transcript. Columns are memory-mapped on first access, so a stage only
+    pays for the columns it reads.
+    """
+
+    def __init__(self, store_path):
+        self.store_path = Path(store_path)
+        self._columns = {}
+
+    def column(self, name):
+        if name not in self._columns:
+            self._columns[name] = np.load(self.store_path / (name + ".npy"), mmap_mode="r")
+        return self._columns[name]
+
+    def _blob(self, name):
+        key = name + ".bin"
+        if key not in self._columns:
+            path = self.store_path / key
+            # np.memmap cannot map an empty file
+            self._columns[key] = np.memmap(path, dtype=np.uint8, mode="r") if path.stat().st_size else b""
+        return self._columns[key]
+
+    def text(self, name, i):
+        offsets = self.column(name + "_offsets")
+        return bytes(self._blob(name)[offsets[i]:offsets[i + 1]]).decode("utf-8")
+
+    def texts(self, name):
+        offsets = self.column(name + "_offsets")
+        blob = self._blob(name)
+        return [bytes(blob[offsets[i]:offsets[i + 1]]).decode("utf-8") for i in range(len(offsets) - 1)]
+
+    def segments(self):
+        """
+        Segments as dicts with start, end and text, the fields downstream stages use from transcribe.json.
+        Returns a lazy SegmentRecords sequence.
+        """
+        return SegmentRecords(self)
+
+    def words(self):
+        """
+        Yields the words as dicts with word, start, end, probability and the index of their segment.
+        """
+        starts = self.column("word_start")
+        ends = self.column("word_end")
+        probabilities = self.column("word_probability")
+        segment_ids = self.column("word_segment")
+        for i in range(len(starts)):
+            yield {"word": self.text("word_text", i), "start": float(starts[i]), "end": float(ends[i]),
+                   "probability": float(probabilities[i]), "segment": int(segment_ids[i])}
+
+
+class SegmentRecords(Sequence):
+    """
+    Read-only sequence of the segments of a TranscriptStore. A segment dict is built when it is read and not
+    kept, and the start and end times are exposed as the memory-mapped columns (starts, ends), so a transcript
+    never has to be held as a list of dicts.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.starts = store.column("segment_start")
+        self.ends = store.column("segment_end")
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("segment index out of range")
+        return {"id": i, "start": float(self.starts[i]), "end": float(self.ends[i]),
+                "text": self.store.text("segment_text", i)}
+
+
+def open_transcript_store(transcribe_file):
+    """
+    Returns the TranscriptStore next to transcribe_file, or None when it is missing or older than the JSON.
+    """
+    transcribe_file = Path(transcribe_file)
+    store_path = transcribe_file.parent / STORE_NAME
+    marker = store_path / "segment_start.npy"
+    if not marker.is_file():
+        return None
+    if transcribe_file.is_file() and transcribe_file.stat().st_mtime_ns > marker.stat().st_mtime_ns:
+        return None
+    return TranscriptStore(store_path)
+
+
+def load_segments(transcribe_file):
+    """
+    Loads transcript segments from the columnar store as a lazy SegmentRecords sequence, falling back to
+    parsing transcribe.json.
+    """
+    store = open_transcript_store(transcribe_file)
+    if store is not None:
+        return store.segments()
+    with open(transcribe_file) as f:
+        return json.load(f)["segments"]
@@ -1,23 +1,397 @@
 import glob
 import json
+import multiprocessing
 import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from moviepy.video.fx.all import crop
+import numpy as np
 from moviepy.video.io.VideoFileClip import VideoFileClip
+from moviepy.video.io.ffmpeg_writer import FFMPEG_VideoWriter
 
+import ffmpeg_renderer
+from build_cache import BuildManifest
+from caption_renderer import CaptionRenderer
+from ffmpeg_utils import probe_video
+from metrics import configure_worker, recorder
 from output_parser import parse_file
+from segment_index import SegmentIndex
+from transcript_store import load_segments
 from moviepy import editor
 
+# Caption look, passed to CaptionRenderer and to the ASS style of the ffmpeg backend
+SUBTITLE_STYLE = {
+    "txt_color": "white",
+    "stroke_color": "black",
+    "stroke_width": 1.5,
+    "fontsize": 40,
+    "font": "ProximaNova-ExtraBold",
+}
+
+# libx264 settings of every rendered moment
+ENCODE_SETTINGS = {
+    "preset": "medium",
+    "crf": 23,
+    "threads": None,
+}
+
+# Review renders: "video" cuts small clips from a low resolution proxy, "contact_sheet" writes one storyboard
+# image per moment, "both" does both
+PREVIEW_SETTINGS = {
+    "kind": "video",
+    "height": 360,
+    "fps": 12,
+    "preset": "ultrafast",
+    "crf": 30,
+}
+PREVIEW_KINDS = ("video", "contact_sheet", "both")
+
+# Moments of a movie with their subtitles, written next to the parts so approved moments can be rendered later
+MOMENTS_FILE = "moments.json"
+
+# Frames the streaming moviepy render buffers between decoder and encoder, fewer when a memory budget
+# requires it; and the share of the budget left to cached caption bitmaps
+RENDER_BATCH_FRAMES = 32
+CAPTION_MEMORY_SHARE = 0.1
+
+# Per thread render state: caption bitmaps reused across moments, and source clips keyed by video file path.
+# Each render worker keeps its own reader per source instead of opening one per moment; stream mode renders
+# videos in several threads, which must neither share readers nor the unlocked caption cache.
+_render_state = threading.local()
+
+
+def get_caption_renderer():
+    renderer = getattr(_render_state, "caption_renderer", None)
+    if renderer is None:
+        renderer = _render_state.caption_renderer = CaptionRenderer()
+    return renderer
+
+
+def _open_clips():
+    clips = getattr(_render_state, "clips", None)
+    if clips is None:
+        clips = _render_state.clips = {}
+    return clips
+
+
+def get_video_clip(video_file):
+    clips = _open_clips()
+    clip = clips.get(video_file)
+    if clip is None:
+        # Renders mux the source audio with ffmpeg, the clip only serves frames
+        clip = editor.VideoFileClip(video_file, audio=False)
+        clips[video_file] = clip
+    return clip
+
+
+def release_video_clips():
+    """
+    Closes the clips opened by the calling thread.
+    """
+    clips = _open_clips()
+    while clips:
+        _, clip = clips.popitem()
+        clip.close()
+
+
+def render_batch_size(video_size, max_memory_mb=None):
+    """
+    Frames per batch of the streaming render that fit into max_memory_mb megabytes next to the decoder's
+    frame buffers and the caption cache. Raises ValueError when not even one frame fits.
+    """
+    (_, _, width, height) = ffmpeg_renderer.crop_box(video_size)
+    frame_bytes = width * height * 3
+    if max_memory_mb is None:
+        return RENDER_BATCH_FRAMES
+    # The reader keeps the raw bytes and the array of the last decoded source frame
+    source_bytes = 2 * video_size[0] * video_size[1] * 3
+    available = max_memory_mb * 1024 * 1024 * (1 - CAPTION_MEMORY_SHARE) - source_bytes
+    if available < frame_bytes:
+        needed = (source_bytes + frame_bytes) / (1 - CAPTION_MEMORY_SHARE) / 1024 / 1024
+        raise ValueError(f"A render memory budget of {max_memory_mb} MB is too small for {video_size[0]}x"
+                         f"{video_size[1]} sources, at least {needed:.0f} MB are needed")
+    return int(min(RENDER_BATCH_FRAMES, available // frame_bytes))
+
+
+def frame_spans(subs, fps):
+    """
+    Source frame ranges [first, last) of the subs of a moment, the frames the moviepy backend writes for them.
+    """
+    return [(int(np.ceil(from_t * fps - 1e-6)), int(np.ceil(to_t * fps - 1e-6))) for (from_t, to_t), _ in subs]
+
+
+def write_frames(writer, frames):
+    """
+    Writes a C-contiguous (n, height, width, 3) uint8 array to an FFMPEG_VideoWriter in one pipe write,
+    without the copy write_frame makes of every frame.
+    """
+    try:
+        writer.proc.stdin.write(memoryview(frames).cast("B"))
+    except IOError as err:
+        _, ffmpeg_error = writer.proc.communicate()
+        raise IOError(f"{err}\nffmpeg failed writing {writer.filename}: {ffmpeg_error.decode(errors='replace')}")
+
+
+def render_moment(video_file, video_size, subs, out_path, subtitle_style=SUBTITLE_STYLE,
+                  encode_settings=ENCODE_SETTINGS, max_memory_mb=None):
+    """
+    Renders one moment into out_path + ".mp4". Runs inside a render worker process.
+    Cropped and captioned frames are collected in a fixed-size batch buffer that is written to the encoder in
+    one piece when full, so memory does not grow with the length of the moment; a caption raster is only
+    referenced while its segment is written. The audio is cut from the source along the same spans as the video.
+    """
+    video = get_video_clip(video_file)
+    captions = get_caption_renderer()
+    fps = video.fps
+    spans = frame_spans(subs, fps)
+    if not any(last > first for first, last in spans):
+        raise ValueError(f"No frames to render for {out_path}: the moment has no subtitles")
+    (x, y, width, height) = ffmpeg_renderer.crop_box(video_size)
+    batch = np.empty((render_batch_size(video_size, max_memory_mb), height, width, 3), dtype=np.uint8)
+    filled = 0
+    video_only = out_path + ".video.mp4"
+    max_bytes = captions.max_bytes
+    if max_memory_mb is not None:
+        captions.max_bytes = int(max_memory_mb * 1024 * 1024 * CAPTION_MEMORY_SHARE)
+    try:
+        writer = FFMPEG_VideoWriter(video_only, (width, height), fps, codec="libx264",
+                                    preset=encode_settings["preset"], threads=encode_settings["threads"],
+                                    ffmpeg_params=["-crf", str(encode_settings["crf"])])
+        try:
+            for (_, txt), (first, last) in zip(subs, spans):
+                caption = None
+                if txt:
+                    caption = captions.render(VideoProcessor.separate_text(txt, max_line_length=37),
+                                              **subtitle_style)
+                for number in range(first, last):
+                    frame = batch[filled]
+                    frame[...] = video.reader.get_frame(number / fps)[y:y + height, x:x + width]
+                    if caption is not None:
+                        blend_caption(frame, *caption)
+                    filled += 1
+                    if filled == len(batch):
+                        write_frames(writer, batch)
+                        filled = 0
+            if filled:
+                write_frames(writer, batch[:filled])
+        finally:
+            writer.close()
+        ffmpeg_renderer.mux_audio_spans(video_only, video_file,
+                                        [(first / fps, last / fps) for first, last in spans if last > first],
+                                        out_path + ".mp4", has_audio=video.reader.infos.get("audio_found", True))
+    finally:
+        captions.max_bytes = max_bytes
+        if os.path.exists(video_only):
+            os.remove(video_only)
+    return out_path
+
+
+def render_moment_ffmpeg(video_file, video_size, subs, out_path, subtitle_style=SUBTITLE_STYLE,
+                         encode_settings=ENCODE_SETTINGS):
+    """
+    Renders one moment with a single ffmpeg filtergraph, captions are burned in from an ASS file.
+    """
+    ffmpeg_renderer.render_moment(video_file, video_size, wrap_subs(subs), out_path, subtitle_style,
+                                  encode_settings)
+    return out_path
+
+
+def render_moment_smartcut(video_file, video_size, subs, out_path, subtitle_style=SUBTITLE_STYLE,
+                           encode_settings=ENCODE_SETTINGS):
+    """
+    Stream copies caption-free stretches between keyframes and re-encodes only the captioned pieces.
+    """
+    ffmpeg_renderer.render_moment_smart(video_file, video_size, wrap_subs(subs), out_path, subtitle_style,
+                                        encode_settings)
+    return out_path
+
+
+def wrap_subs(subs):
+    return [(span, VideoProcessor.separate_text(txt, max_line_length=37) if txt else txt) for span, txt in subs]
+
+
+RENDER_BACKENDS = {
+    "moviepy": render_moment,
+    "ffmpeg": render_moment_ffmpeg,
+    "smartcut": render_moment_smartcut,
+}
+
+
+def composite_caption(frame, rgb, mask):
+    """
+    Returns a copy of frame with the caption bitmap blended in, see blend_caption.
+    """
+    out = frame.copy()
+    blend_caption(out, rgb, mask)
+    return out
+
+
+def blend_caption(frame, rgb, mask):
+    """
+    Blends a caption bitmap into frame in place: centered, top edge at 75% of the frame height, the placement
+    the ASS style of the ffmpeg backend uses too.
+    """
+    (h, w) = frame.shape[:2]
+    (caption_h, caption_w) = mask.shape
+    top = int(h * 0.75)
+    left = (w - caption_w) // 2
+    # Parts of the caption outside the frame are cut off
+    y0, y1 = max(top, 0), min(top + caption_h, h)
+    x0, x1 = max(left, 0), min(left + caption_w, w)
+    if y0 >= y1 or x0 >= x1:
+        return
+    alpha = mask[y0 - top:y1 - top, x0 - left:x1 - left, None]
+    region = frame[y0:y1, x0:x1]
+    region[...] = region * (1 - alpha) + rgb[y0 - top:y1 - top, x0 - left:x1 - left] * alpha
+
+
+class _PartSink:
+    """
+    Encoder of one part during a single pass render: opened at the first frame of its window,
+    fed cropped and captioned frames, closed after its last frame.
+    """
+
+    def __init__(self, subs, out_path, fps):
+        self.out_path = out_path
+        self.start = subs[0][0][0]
+        self.end = max(to_t for (_, to_t), _ in subs)
+        # Frame numbers of the source covered by the part, end exclusive
+        self.first = int(np.ceil(self.start * fps - 1e-6))
+        self.last = int(np.ceil(self.end * fps - 1e-6))
+        self.captions = sorted((from_t, to_t, VideoProcessor.separate_text(txt, max_line_length=37))
+                               for (from_t, to_t), txt in subs if txt)
+        self.writer = None
+        self.frames = 0
+        self._caption = 0
+
+    def caption_at(self, t):
+        while self._caption < len(self.captions) and self.captions[self._caption][1] <= t:
+            self._caption += 1
+        if self._caption < len(self.captions) and self.captions[self._caption][0] <= t:
+            return self.captions[self._caption][2]
+        return None
+
+    def open(self, size, fps, encode_settings):
+        self.writer = FFMPEG_VideoWriter(self.out_path + ".video.mp4", size, fps, codec="libx264",
+                                         preset=encode_settings["preset"], threads=encode_settings["threads"],
+                                         ffmpeg_params=["-crf", str(encode_settings["crf"])])
+
+    def write(self, frame):
+        self.writer.write_frame(frame)
+        self.frames += 1
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+def render_moments_single_pass(video_file, video_size, parts, subtitle_style=SUBTITLE_STYLE,
+                               encode_settings=ENCODE_SETTINGS):
+    """
+    Renders all moments of a movie in one pass over the source. parts is a list of (subs, out_path).
+    Frames are decoded once in time order and fanned out to one libx264 encoder process per part, opened when
+    the window of the part starts and closed when it ends, so overlapping moments do not decode their shared
+    frames twice. Audio is cut from the source and muxed into every part afterwards.
+    Returns (decoded_frames, encoded_frames).
+    """
+    video = get_video_clip(video_file)
+    captions = get_caption_renderer()
+    fps = video.fps
+    (x, y, width, height) = ffmpeg_renderer.crop_box(video_size)
+    sinks = sorted((_PartSink(subs, out_path, fps) for subs, out_path in parts),
+                   key=lambda sink: sink.first)
+    for sink in sinks:
+        captions.prerender([text for _, _, text in sink.captions], **subtitle_style)
+    # Frame ranges covered by at least one part; frames between them are skipped, not decoded
+    spans = []
+    for sink in sinks:
+        if spans and sink.first <= spans[-1][1]:
+            spans[-1][1] = max(spans[-1][1], sink.last)
+        else:
+            spans.append([sink.first, sink.last])
+
+    pending = list(sinks)
+    active = []
+    decoded = 0
+    try:
+        for first, last in spans:
+            for number in range(first, last):
+                while pending and pending[0].first <= number:
+                    sink = pending.pop(0)
+                    sink.open((width, height), fps, encode_settings)
+                    active.append(sink)
+                t = number / fps
+                frame = video.reader.get_frame(t)[y:y + height, x:x + width]
+                decoded += 1
+                # Overlapping parts usually show the same caption, blend it once per frame
+                captioned = {}
+                for sink in active:
+                    text = sink.caption_at(t)
+                    if text not in captioned:
+                        captioned[text] = frame if text is None else \
+                            composite_caption(frame, *captions.render(text, **subtitle_style))
+                    sink.write(captioned[text])
+                for sink in [sink for sink in active if number + 1 >= sink.last]:
+                    sink.close()
+                    active.remove(sink)
+    finally:
+        for sink in sinks:
+            sink.close()
+    for sink in sinks:
+        video_only = sink.out_path + ".video.mp4"
+        ffmpeg_renderer.mux_audio(video_only, video_file, sink.first / fps, sink.frames / fps, sink.out_path + ".mp4")
+        os.remove(video_only)
+    return decoded, sum(sink.frames for sink in sinks)
+
+
+# Backends rendering all moments of a movie together instead of one moment per job
+MOVIE_RENDER_BACKENDS = {
+    "singlepass": render_moments_single_pass,
+}
+
+
+def render_job(backend, video_file, video_size, fps, subs, out_path, subtitle_style=SUBTITLE_STYLE,
+               encode_settings=ENCODE_SETTINGS, max_memory_mb=None):
+    """
+    Renders one moment with the given backend and records its render_moment metrics.
+    """
+    output_seconds = sum(to_t - from_t for (from_t, to_t), _ in subs)
+    # Only the moviepy backend holds frames in Python, the others stream them through ffmpeg
+    extra = {"max_memory_mb": max_memory_mb} if backend == "moviepy" else {}
+    with recorder.measure("render_moment", backend=backend, video=Path(video_file).parent.name,
+                          part=Path(out_path).name) as counters:
+        RENDER_BACKENDS[backend](video_file, video_size, subs, out_path, subtitle_style, encode_settings, **extra)
+        counters["output_seconds"] = output_seconds
+        if fps:
+            counters["frames"] = int(round(output_seconds * fps))
+    return out_path
+
 
 class VideoProcessor:
-    def __init__(self, data_folder):
+    def __init__(self, data_folder, render_workers=None, backend="moviepy", subtitle_style=None,
+                 encode_settings=None, preview_settings=None, max_render_memory=None):
+        if backend not in RENDER_BACKENDS and backend not in MOVIE_RENDER_BACKENDS:
+            raise ValueError(f"Unknown render backend: {backend}")
+        self.preview_settings = dict(PREVIEW_SETTINGS, **(preview_settings or {}))
+        if self.preview_settings["kind"] not in PREVIEW_KINDS:
+            raise ValueError(f"Unknown preview kind: {self.preview_settings['kind']}")
         self.data_folder = data_folder
+        self.render_workers = render_workers or os.cpu_count() or 1
+        self.backend = backend
+        self.subtitle_style = dict(SUBTITLE_STYLE, **(subtitle_style or {}))
+        self.encode_settings = dict(ENCODE_SETTINGS, **(encode_settings or {}))
+        # Megabytes of frame and caption buffers each moviepy render process may hold
+        self.max_render_memory = max_render_memory
         self.movie_folder = ""
         self.movie_name = ""
         self.transcribe_data = []
+        self.segment_index = SegmentIndex([])
         self.parsed_data = []
         self.results_dir = None
         self.movie_duration = None
+        self.video_size = None
+        self.video_fps = None
         self.metadata = None
 
     def load_parsed_data(self, output_file):
@@ -25,8 +399,8 @@ class VideoProcessor:
             self.parsed_data = parse_file(f.read())
 
     def load_transcribe_data(self, transcribe_file):
-        with open(transcribe_file) as f:
-            self.transcribe_data = json.load(f)["segments"]
+        self.transcribe_data = load_segments(transcribe_file)
+        self.segment_index = SegmentIndex(self.transcribe_data)
 
     def load_video_metadata(self, metadata_file):
         with open(metadata_file) as f:
@@ -62,7 +436,7 @@ class VideoProcessor:
         for item in json_data:
             start_time = item["start"]
             end_time = item["end"]
-            if window_start <= start_time <= window_end or window_start <= end_time <= window_end:
+            if start_time <= window_end and end_time >= window_start:
                 result.append(item)
         return result
 
@@ -73,8 +447,7 @@ class VideoProcessor:
         end_moment_timestamp = min(self.movie_duration, end_moment_timestamp)
         if (end_moment_timestamp - start_moment_timestamp) > 30:
 
-            filtered_segments = self.filter_json_by_time(self.transcribe_data, start_moment_timestamp,
-                                                         end_moment_timestamp)
+            filtered_segments = self.segment_index.overlapping(start_moment_timestamp, end_moment_timestamp)
             prev_end = start_moment_timestamp
             for segment in filtered_segments:
                 segment_start = int(segment["start"])
@@ -92,19 +465,8 @@ class VideoProcessor:
 
         return subs
 
-    def annotate(self, clip, txt, txt_color='white', stroke_color="black", stroke_width=1.5, fontsize=40,
-                 font='ProximaNova-ExtraBold'):
-        if txt is None or txt == '':
-            return clip
-        else:
-            txt = self.separate_text(txt, max_line_length=37)
-            txtclip = editor.TextClip(txt, fontsize=fontsize, stroke_color=stroke_color, stroke_width=stroke_width,
-                                      font=font, color=txt_color)
-            cvc = editor.CompositeVideoClip([clip, txtclip.set_pos(('center', 0.75), relative=True)])
-            return cvc.set_duration(clip.duration)
-
     def process_whole_folder(self):
-        data_folder = Path(self.movie_folder)
+        data_folder = Path(self.data_folder)
         for folder in data_folder.iterdir():
             if folder.is_dir():
                 try:
@@ -112,37 +474,276 @@ class VideoProcessor:
                 except Exception as ex:
                     print(f"ERROR Troubles with dir: {folder}\n{ex}")
 
+    def probe_video(self, video_file):
+        """
+        Reads duration, frame size and frame rate of the source once per movie.
+        The opened clip is kept and reused when moments are rendered in this process.
+        """
+        if self.backend not in ("moviepy", "singlepass"):
+            self.movie_duration, self.video_size, self.video_fps = probe_video(video_file)
+            return
+        video = get_video_clip(video_file)
+        self.movie_duration = video.duration
+        self.video_size = video.size
+        self.video_fps = video.fps
+
+    def render_params(self):
+        return {"backend": self.backend, "subtitle_style": self.subtitle_style,
+                "encode_settings": self.encode_settings}
+
     def process_single_movie(self, folder_path):
+        with recorder.measure("render", backend=self.backend, video=Path(folder_path).name) as counters:
+            counters["parts"] = self._process_single_movie(Path(folder_path))
+
+    def _process_single_movie(self, folder_path):
+        """
+        Renders all moments of a movie folder, returns the number of rendered parts (0 when up to date).
+        """
         self.results_dir = folder_path / "results"
-        self.results_dir.mkdir(parents=True, exist_ok=True)
+        video_file = self.find_video_file(folder_path)
+        manifest = BuildManifest(folder_path)
+        inputs = self.moment_inputs(folder_path, video_file)
+        if manifest.is_fresh("render", inputs, self.render_params()):
+            print(f"{folder_path} already rendered")
+            return 0
+        jobs = self.prepare_moments(folder_path, video_file)
+        part_inputs = inputs + [self.results_dir / MOMENTS_FILE]
+        done = {i for i, _, _ in jobs if manifest.is_fresh(self.part_stage(i), part_inputs, self.render_params())}
+        # Parts of a previous render may not exist in the new one; parts already rendered from the same moments,
+        # e.g. approved after a preview, are kept
+        keep = {Path(self.part_path(i) + extension).name for i in done for extension in (".mp4", ".txt")}
+        for old_part in self.results_dir.glob("part_*"):
+            if old_part.name not in keep:
+                old_part.unlink()
+
+        pending = [job for job in jobs if job[0] not in done]
+        self.render_moments(video_file, pending)
+        self.record_parts(manifest, part_inputs, pending)
+        outputs = [self.part_path(i) + extension for i, _, _ in jobs for extension in (".mp4", ".txt")]
+        manifest.record("render", inputs, self.render_params(), outputs + [self.results_dir / MOMENTS_FILE])
+        return len(pending)
 
+    @staticmethod
+    def part_stage(i):
+        return f"render_part_{i}"
+
+    def record_parts(self, manifest, inputs, jobs):
+        """
+        Records every rendered part as its own manifest stage, so parts rendered on their own (approved after a
+        preview) and parts of a full render are not rendered twice.
+        """
+        for i, _, _ in jobs:
+            manifest.record(self.part_stage(i), inputs, self.render_params(),
+                            [self.part_path(i) + ".mp4", self.part_path(i) + ".txt"])
+
+    @staticmethod
+    def moment_inputs(folder_path, video_file):
+        return [folder_path / "output.txt", folder_path / "transcribe.json", folder_path / "metadata.json",
+                video_file]
+
+    def prepare_moments(self, folder_path, video_file):
+        """
+        Loads the data of a movie, builds the (part, moment, subs) jobs of its moments and saves them as
+        the moment specs in results/moments.json.
+        """
         self.load_parsed_data(folder_path / "output.txt")
         self.load_transcribe_data(folder_path / "transcribe.json")
         self.load_video_metadata(folder_path / "metadata.json")
-        video_file = self.find_video_file(folder_path)
         self.movie_name = video_file
+        self.probe_video(video_file)
         print(self.parsed_data)
+        jobs = []
         i = 1
         for data in self.parsed_data:
-            out_movie_name = Path(f"part_{i}")
-            video = editor.VideoFileClip(video_file)
-            self.movie_duration = video.duration
             subs = self.create_subs_for_moment(data)
             if not subs:
                 continue
-            (w, h) = video.size
-            cropped_clip = crop(video, width=850, height=5000, x_center=w / 2, y_center=h / 2)
-            # print(subs)
-            annotated_clips = [self.annotate(cropped_clip.subclip(from_t, to_t), txt) for (from_t, to_t), txt in subs]
-            final_clip = editor.concatenate_videoclips(annotated_clips)
-            final_clip.write_videofile(str(self.results_dir / out_movie_name) + ".mp4", codec='libx264')
-            with open(str(self.results_dir / out_movie_name) + ".txt", "w", encoding="utf-8") as f:
-                text = "{} {}\n{}\n{}".format(self.metadata["title"],
-                                              f"Part {i}",
-                                              data["title"],
-                                              "\n".join(data["hashtags"]))
-                f.write(text)
+            jobs.append((i, data, subs))
             i += 1
+        self.save_moment_specs(jobs)
+        return jobs
+
+    def save_moment_specs(self, jobs):
+        self.results_dir.mkdir(parents=True, exist_ok=True)
+        specs = [{"part": i, "moment": data, "subs": [[from_t, to_t, txt] for (from_t, to_t), txt in subs]}
+                 for i, data, subs in jobs]
+        with open(self.results_dir / MOMENTS_FILE, "w", encoding="utf-8") as f:
+            json.dump(specs, f, ensure_ascii=False, indent=1)
+
+    def load_moment_specs(self):
+        with open(self.results_dir / MOMENTS_FILE, encoding="utf-8") as f:
+            specs = json.load(f)
+        return [(spec["part"], spec["moment"], [((from_t, to_t), txt) for from_t, to_t, txt in spec["subs"]])
+                for spec in specs]
+
+    def preview_params(self):
+        return {"preview_settings": self.preview_settings, "subtitle_style": self.subtitle_style}
+
+    def preview_path(self, i):
+        return str(self.results_dir / "preview" / f"part_{i}")
+
+    def preview_single_movie(self, folder_path):
+        with recorder.measure("preview", kind=self.preview_settings["kind"], video=Path(folder_path).name) as counters:
+            counters["parts"] = self._preview_single_movie(Path(folder_path))
+
+    def _preview_single_movie(self, folder_path):
+        """
+        Renders review versions of all moments of a movie from one decode of the source: the source is
+        cropped and scaled into a small proxy once, and every moment is cut from the proxy with a fast preset
+        and/or sampled into a contact sheet. Returns the number of previewed parts (0 when up to date).
+        """
+        self.results_dir = folder_path / "results"
+        video_file = self.find_video_file(folder_path)
+        manifest = BuildManifest(folder_path)
+        inputs = self.moment_inputs(folder_path, video_file)
+        if manifest.is_fresh("preview", inputs, self.preview_params()):
+            print(f"{folder_path} already previewed")
+            return 0
+        preview_dir = self.results_dir / "preview"
+        preview_dir.mkdir(parents=True, exist_ok=True)
+        for old_preview in preview_dir.glob("part_*"):
+            old_preview.unlink()
+
+        jobs = self.prepare_moments(folder_path, video_file)
+        release_video_clips()
+        settings = self.preview_settings
+        proxy_file = preview_dir / "proxy.mp4"
+        proxy_size = ffmpeg_renderer.make_proxy(video_file, self.video_size, proxy_file, settings["height"],
+                                                settings["fps"], {"preset": settings["preset"],
+                                                                  "crf": settings["crf"],
+                                                                  "threads": self.encode_settings["threads"]})
+        # Captions keep their size relative to the frame
+        scale = proxy_size[1] / ffmpeg_renderer.crop_box(self.video_size)[3]
+        style = dict(self.subtitle_style, fontsize=max(1, int(round(self.subtitle_style["fontsize"] * scale))),
+                     stroke_width=self.subtitle_style["stroke_width"] * scale)
+        outputs = [proxy_file]
+
+        def preview(job):
+            i, _, subs = job
+            start = subs[0][0][0]
+            end = max(to_t for (_, to_t), _ in subs)
+            if settings["kind"] in ("video", "both"):
+                ffmpeg_renderer.render_moment(proxy_file, proxy_size, wrap_subs(subs), self.preview_path(i), style,
+                                              {"preset": settings["preset"], "crf": settings["crf"]})
+            if settings["kind"] in ("contact_sheet", "both"):
+                ffmpeg_renderer.render_contact_sheet(proxy_file, start, end, self.preview_path(i) + ".jpg")
+
+        # The work happens in ffmpeg processes, threads are enough to run them in parallel
+        with ThreadPoolExecutor(max_workers=self.render_workers) as executor:
+            list(executor.map(preview, jobs))
+        for i, _, _ in jobs:
+            outputs += [path for path in (self.preview_path(i) + ".mp4", self.preview_path(i) + ".jpg")
+                        if os.path.exists(path)]
+        manifest.record("preview", inputs, self.preview_params(), outputs + [self.results_dir / MOMENTS_FILE])
+        return len(jobs)
+
+    def preview_whole_folder(self):
+        for folder in Path(self.data_folder).iterdir():
+            if folder.is_dir():
+                try:
+                    self.preview_single_movie(folder)
+                except Exception as ex:
+                    print(f"ERROR Troubles with dir: {folder}\n{ex}")
+
+    def render_approved(self, folder_path, parts):
+        """
+        Renders the approved parts of a previewed movie in full quality from its saved moment specs.
+        Parts already rendered from the same moments and settings are skipped. Returns the number of rendered parts.
+        """
+        folder_path = Path(folder_path)
+        self.results_dir = folder_path / "results"
+        video_file = self.find_video_file(folder_path)
+        self.load_video_metadata(folder_path / "metadata.json")
+        jobs = [job for job in self.load_moment_specs() if job[0] in set(parts)]
+        missing = set(parts) - {i for i, _, _ in jobs}
+        if missing:
+            print(f"Parts {sorted(missing)} are not in {self.results_dir / MOMENTS_FILE}")
+        manifest = BuildManifest(folder_path)
+        inputs = self.moment_inputs(folder_path, video_file) + [self.results_dir / MOMENTS_FILE]
+        pending = [job for job in jobs if not manifest.is_fresh(self.part_stage(job[0]), inputs, self.render_params())]
+        if len(pending) < len(jobs):
+            print(f"Parts {sorted(set(i for i, _, _ in jobs) - set(i for i, _, _ in pending))} already rendered")
+        if not pending:
+            return 0
+        self.probe_video(video_file)
+        with recorder.measure("render", backend=self.backend, video=folder_path.name) as counters:
+            self.render_moments(video_file, pending)
+            counters["parts"] = len(pending)
+        self.record_parts(manifest, inputs, pending)
+        return len(pending)
+
+    def render_moments(self, video_file, jobs):
+        """
+        Renders all moments of a movie, spreading them over render_workers processes.
+        Raises after the other parts are rendered when a part fails; movie backends render all parts in one call,
+        which fails as a whole.
+        """
+        try:
+            if self.backend in MOVIE_RENDER_BACKENDS:
+                self.render_movie(video_file, jobs)
+                return
+            failed = []
+            if self.render_workers == 1 or len(jobs) <= 1:
+                for i, data, subs in jobs:
+                    try:
+                        render_job(self.backend, video_file, self.video_size, self.video_fps, subs, self.part_path(i),
+                                   self.subtitle_style, self.encode_settings, self.max_render_memory)
+                    except Exception as ex:
+                        print(f"ERROR Troubles with part {i} of {video_file}\n{ex}")
+                        failed.append(i)
+                        continue
+                    self.write_moment_description(i, data)
+            else:
+                # Workers open their own readers, the probe clip is not needed meanwhile
+                release_video_clips()
+                workers = min(self.render_workers, len(jobs))
+                # Spawned rather than forked: other stage threads may hold locks, e.g. the recorder's, at fork time
+                with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                         initializer=configure_worker,
+                                         initargs=(recorder.worker_settings(),)) as executor:
+                    futures = [(i, data, executor.submit(render_job, self.backend, video_file, self.video_size,
+                                                         self.video_fps, subs, self.part_path(i), self.subtitle_style,
+                                                         self.encode_settings, self.max_render_memory))
+                               for i, data, subs in jobs]
+                    for i, data, future in futures:
+                        try:
+                            future.result()
+                        except Exception as ex:
+                            print(f"ERROR Troubles with part {i} of {video_file}\n{ex}")
+                            failed.append(i)
+                            continue
+                        self.write_moment_description(i, data)
+            # The other parts are kept, but the movie must not be recorded as rendered
+            if failed:
+                raise RuntimeError(f"Parts {failed} of {video_file} could not be rendered")
+        finally:
+            release_video_clips()
+
+    def render_movie(self, video_file, jobs):
+        """
+        Renders all moments with a backend that handles a whole movie in one call.
+        """
+        if not jobs:
+            return
+        render = MOVIE_RENDER_BACKENDS[self.backend]
+        with recorder.measure("render_movie", backend=self.backend, video=Path(video_file).parent.name) as counters:
+            decoded, encoded = render(video_file, self.video_size, [(subs, self.part_path(i)) for i, _, subs in jobs],
+                                      self.subtitle_style, self.encode_settings)
+            counters["decoded_frames"] = decoded
+            counters["frames"] = encoded
+        for i, data, _ in jobs:
+            self.write_moment_description(i, data)
+
+    def part_path(self, i):
+        return str(self.results_dir / Path(f"part_{i}"))
+
+    def write_moment_description(self, i, data):
+        with open(self.part_path(i) + ".txt", "w", encoding="utf-8") as f:
+            text = "{} {}\n{}\n{}".format(self.metadata["title"],
+                                          f"Part {i}",
+                                          data["title"],
+                                          "\n".join(data["hashtags"]))
+            f.write(text)
 
     @staticmethod
     def find_video_file(folder_path):
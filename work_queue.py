@@ -0,0 +1,276 @@
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Stages in pipeline order; finishing one enqueues the next for the same video
+STAGES = ("download", "transcribe", "gpt", "render")
+
+Job = namedtuple("Job", ["video_id", "stage", "payload", "attempts", "owner"])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    video_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    payload TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    owner TEXT,
+    lease_expires REAL,
+    available_at REAL NOT NULL,
+    last_error TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (video_id, stage)
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (stage, status, available_at);
+"""
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class WorkQueue:
+    """
+    Job queue in a SQLite file that workers on several machines open over a shared filesystem.
+    A job is one stage of one video. Claimed jobs are leased: a worker that stops sending heartbeats loses the
+    job once the lease expires and another worker takes it over. Failed jobs are retried with an exponential
+    delay until max_attempts is reached.
+    The rollback journal is used instead of WAL, which does not work over network filesystems.
+    """
+
+    def __init__(self, path, lease_seconds=300, max_attempts=3, retry_delay=30.0):
+        self.path = Path(path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        connection = self._open()
+        try:
+            connection.executescript(SCHEMA)
+        finally:
+            connection.close()
+
+    def _open(self):
+        connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        connection.execute("PRAGMA busy_timeout = 60000")
+        return connection
+
+    def _connect(self):
+        # A new connection per operation, so the queue can be shared by threads and forked processes
+        return _Transaction(self._open())
+
+    def enqueue(self, video_id, stage, payload=None):
+        """
+        Adds a job unless the video already has one for this stage. Returns True when it was added.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "INSERT OR IGNORE INTO jobs (video_id, stage, payload, max_attempts, available_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (video_id, stage, payload, self.max_attempts, now, now))
+            return cursor.rowcount == 1
+
+    def claim(self, owner, stages=STAGES):
+        """
+        Leases the next available job of the given stages to owner, or returns None. Later stages go first,
+        so videos already in flight are finished before new ones are started.
+        """
+        now = time.time()
+        placeholders = ",".join("?" * len(stages))
+        with self._connect() as connection:
+            # Jobs whose worker died on the last attempt cannot be retried
+            connection.execute(
+                "UPDATE jobs SET status = 'failed', owner = NULL, last_error = 'lease expired', updated_at = ? "
+                "WHERE status = 'leased' AND lease_expires < ? AND attempts >= max_attempts", (now, now))
+            order = " ".join(f"WHEN '{stage}' THEN {index}" for index, stage in enumerate(STAGES))
+            row = connection.execute(
+                f"SELECT video_id, stage, payload, attempts FROM jobs "
+                f"WHERE stage IN ({placeholders}) AND available_at <= ? "
+                f"AND (status = 'pending' OR (status = 'leased' AND lease_expires < ?)) "
+                f"ORDER BY CASE stage {order} END DESC, available_at LIMIT 1",
+                (*stages, now, now)).fetchone()
+            if row is None:
+                return None
+            video_id, stage, payload, attempts = row
+            connection.execute(
+                "UPDATE jobs SET status = 'leased', owner = ?, attempts = ?, lease_expires = ?, updated_at = ? "
+                "WHERE video_id = ? AND stage = ?",
+                (owner, attempts + 1, now + self.lease_seconds, now, video_id, stage))
+        return Job(video_id, stage, payload, attempts + 1, owner)
+
+    def heartbeat(self, job):
+        """
+        Extends the lease of job. Returns False when the lease was lost to another worker.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET lease_expires = ?, updated_at = ? "
+                "WHERE video_id = ? AND stage = ? AND owner = ? AND status = 'leased'",
+                (now + self.lease_seconds, now, job.video_id, job.stage, job.owner))
+            return cursor.rowcount == 1
+
+    def complete(self, job, next_payload=None):
+        """
+        Marks job done and enqueues the next stage of its video, in one transaction.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET status = 'done', owner = NULL, last_error = NULL, updated_at = ? "
+                "WHERE video_id = ? AND stage = ? AND owner = ? AND status = 'leased'",
+                (now, job.video_id, job.stage, job.owner))
+            if cursor.rowcount != 1:
+                logger.warning(f"Lease of {job.stage} {job.video_id} was lost, result not recorded")
+                return False
+            index = STAGES.index(job.stage)
+            if index + 1 < len(STAGES):
+                connection.execute(
+                    "INSERT OR IGNORE INTO jobs (video_id, stage, payload, max_attempts, available_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (job.video_id, STAGES[index + 1], next_payload, self.max_attempts, now, now))
+        return True
+
+    def fail(self, job, error):
+        """
+        Releases job for a retry after retry_delay * 2 ** (attempts - 1) seconds, or marks it failed
+        after max_attempts.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'pending' END, "
+                "owner = NULL, lease_expires = NULL, available_at = ?, last_error = ?, updated_at = ? "
+                "WHERE video_id = ? AND stage = ? AND owner = ? AND status = 'leased'",
+                (now + self.retry_delay * 2 ** (job.attempts - 1), str(error), now, job.video_id, job.stage,
+                 job.owner))
+
+    def counts(self):
+        """
+        Number of jobs per (stage, status).
+        """
+        with self._connect() as connection:
+            rows = connection.execute("SELECT stage, status, COUNT(*) FROM jobs GROUP BY stage, status").fetchall()
+        return {(stage, status): count for stage, status, count in rows}
+
+    def failed(self):
+        with self._connect() as connection:
+            return connection.execute("SELECT video_id, stage, attempts, last_error FROM jobs "
+                                      "WHERE status = 'failed' ORDER BY video_id, stage").fetchall()
+
+    def has_pending_work(self, stages):
+        """
+        True while jobs of stages, or of stages before them that will enqueue work for them, are not finished.
+        """
+        upstream = STAGES[:max(STAGES.index(stage) for stage in stages) + 1]
+        placeholders = ",".join("?" * len(upstream))
+        with self._connect() as connection:
+            row = connection.execute(f"SELECT COUNT(*) FROM jobs WHERE stage IN ({placeholders}) "
+                                     f"AND status IN ('pending', 'leased')", upstream).fetchone()
+        return row[0] > 0
+
+
+class _Transaction:
+    """
+    Runs the statements of a with block in one immediate transaction and closes the connection afterwards.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, exc, traceback):
+        try:
+            self.connection.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        finally:
+            self.connection.close()
+
+
+class QueueWorker:
+    """
+    Claims jobs of its stages and runs them with handlers, a dict of stage -> callable(job) returning the
+    payload of the next stage. A heartbeat thread keeps the lease of the running job alive.
+    Exits when no work is left for its stages, upstream stages included.
+    """
+
+    def __init__(self, work_queue, handlers, stages=STAGES, owner=None, poll_interval=10.0):
+        self.work_queue = work_queue
+        self.handlers = handlers
+        self.stages = tuple(stages)
+        self.owner = owner or default_worker_id()
+        self.poll_interval = poll_interval
+        self.processed = 0
+
+    def _heartbeat(self, job, done):
+        while not done.wait(self.work_queue.lease_seconds / 3):
+            if not self.work_queue.heartbeat(job):
+                logger.warning(f"{self.owner} lost the lease of {job.stage} {job.video_id}")
+                return
+
+    def run_job(self, job):
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job, done), daemon=True)
+        heartbeat.start()
+        try:
+            next_payload = self.handlers[job.stage](job)
+        except Exception as ex:
+            logger.error(f"{self.owner} failed {job.stage} {job.video_id} (attempt {job.attempts}): {ex}")
+            self.work_queue.fail(job, ex)
+            return False
+        finally:
+            done.set()
+            heartbeat.join()
+        return self.work_queue.complete(job, next_payload)
+
+    def run(self):
+        logger.info(f"Worker {self.owner} started for stages {', '.join(self.stages)}")
+        while True:
+            job = self.work_queue.claim(self.owner, self.stages)
+            if job is None:
+                if not self.work_queue.has_pending_work(self.stages):
+                    break
+                time.sleep(self.poll_interval)
+                continue
+            logger.info(f"{self.owner} runs {job.stage} {job.video_id} (attempt {job.attempts})")
+            if self.run_job(job):
+                self.processed += 1
+        logger.info(f"Worker {self.owner} finished, {self.processed} jobs done")
+        return self.processed
+
+
+def _demo_worker(path, stages):
+    def handle(job):
+        time.sleep(0.05)
+        if job.stage == "gpt" and job.video_id.endswith("3") and job.attempts == 1:
+            raise RuntimeError("simulated API error")
+        return job.payload
+    handlers = {stage: handle for stage in STAGES}
+    work_queue = WorkQueue(path, lease_seconds=5, retry_delay=0.1)
+    return QueueWorker(work_queue, handlers, stages, poll_interval=0.1).run()
+
+
+if __name__ == "__main__":
+    # Runs several local worker processes over a throwaway queue, split by stage like a cluster would be
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(processName)s %(levelname)s:%(message)s')
+    queue_path = Path(tempfile.mkdtemp()) / "queue.sqlite3"
+    demo_queue = WorkQueue(queue_path)
+    for i in range(20):
+        demo_queue.enqueue(f"video{i}", "download", f"https://www.youtube.com/watch?v=video{i}")
+    worker_stages = [("download",), ("transcribe",), ("transcribe",), ("gpt", "render"), STAGES]
+    with ProcessPoolExecutor(max_workers=len(worker_stages)) as executor:
+        processed = list(executor.map(_demo_worker, [queue_path] * len(worker_stages), worker_stages))
+    print(f"Jobs per worker: {processed}")
+    print(demo_queue.counts())
@@ -1,32 +1,73 @@
 import json
 import os
+import shutil
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from moviepy.video.io.VideoFileClip import VideoFileClip
+from urllib.parse import urlparse
 from pytube import YouTube
 from tqdm import tqdm
 from pytube import Channel
 
+from build_cache import BuildManifest
+from ffmpeg_utils import extract_audio
+from metrics import recorder
 
-class YouTubeDownloader:
-    def __init__(self, save_folder):
-        self.save_folder = save_folder
+# Audio written next to every downloaded video: "mp3" keeps the source sample rate, "mp3_16k" is 16 kHz mono
+# (the format Whisper resamples to), "none" skips the mp3 and lets transcription read the mp4 directly
+AUDIO_FORMATS = ("mp3", "mp3_16k", "none")
 
-    def download_video(self, link, save_path):
-        yt = YouTube(link)
-        video = yt.streams.filter(progressive=True, file_extension='mp4').order_by('resolution').desc().first()
-        video.download(save_path, filename=link.split("=")[-1] + ".mp4")
-        self.save_metadata(yt, save_path)
+
+class HttpTransport:
+    """
+    Transfers video files over HTTP, resuming partial files with range requests.
+    On its own it treats links as direct file URLs, which lets a local HTTP server stand in for YouTube.
+    """
+
+    def __init__(self, timeout=60, chunk_size=1 << 20):
+        self.timeout = timeout
+        self.chunk_size = chunk_size
 
     @staticmethod
-    def convert_to_mp3(mp4_file, mp3_file):
-        video = VideoFileClip(mp4_file)
-        audio = video.audio
-        audio.write_audiofile(mp3_file)
-        audio.close()
-        video.close()
+    def video_id(link):
+        return Path(urlparse(link).path).stem
+
+    def resolve(self, link):
+        """
+        Returns (stream url, size in bytes or None, metadata) of a link.
+        """
+        request = urllib.request.Request(link, method="HEAD")
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            size = response.headers.get("Content-Length")
+        return link, int(size) if size else None, {"title": self.video_id(link), "url": link}
+
+    def fetch(self, url, part_file, offset=0):
+        """
+        Appends the bytes of url starting at offset to part_file.
+        """
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        request = urllib.request.Request(url, headers=headers)
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            # A server that ignores the range sends the whole file again
+            mode = "ab" if offset and response.status == 206 else "wb"
+            with open(part_file, mode) as f:
+                shutil.copyfileobj(response, f, self.chunk_size)
+
+
+class PytubeTransport(HttpTransport):
+    """
+    Resolves YouTube links with pytube to the highest resolution progressive mp4 stream.
+    """
 
     @staticmethod
-    def save_metadata(yt, save_path):
+    def video_id(link):
+        return link.split("=")[-1]
+
+    def resolve(self, link):
+        yt = YouTube(link)
+        stream = yt.streams.filter(progressive=True, file_extension='mp4').order_by('resolution').desc().first()
         metadata = {
             "title": yt.title,
             "description": yt.description,
@@ -36,21 +77,117 @@ class YouTubeDownloader:
             "rating": yt.rating,
             "url": yt.watch_url
         }
+        return stream.url, stream.filesize, metadata
+
+
+class YouTubeDownloader:
+    def __init__(self, save_folder, audio_format="mp3", max_workers=4, max_retries=3, transport=None):
+        if audio_format not in AUDIO_FORMATS:
+            raise ValueError(f"Unknown audio format: {audio_format}")
+        self.save_folder = save_folder
+        self.audio_format = audio_format
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.transport = transport or PytubeTransport()
+        # Links that still failed after all retries
+        self.failed = []
+        self._failed_lock = threading.Lock()
+
+    def download_video(self, link, save_path):
+        """
+        Downloads into a .part file, resuming what a previous attempt left, and renames it once the size
+        matches the stream size.
+        """
+        url, filesize, metadata = self.transport.resolve(link)
+        mp4_file = Path(save_path, self.transport.video_id(link) + ".mp4")
+        part_file = mp4_file.with_name(mp4_file.name + ".part")
+        offset = part_file.stat().st_size if part_file.exists() else 0
+        if filesize is not None and offset > filesize:
+            offset = 0
+        if filesize is None or offset < filesize:
+            self.transport.fetch(url, part_file, offset)
+        size = part_file.stat().st_size
+        if filesize is not None and size != filesize:
+            raise IOError(f"Incomplete download of {link}: {size} of {filesize} bytes")
+        os.replace(part_file, mp4_file)
+        self.save_metadata(metadata, save_path)
+
+    @staticmethod
+    def convert_to_mp3(mp4_file, mp3_file, sample_rate=None, mono=False):
+        extract_audio(mp4_file, mp3_file, sample_rate=sample_rate, mono=mono)
+
+    def extract_audio(self, mp4_file, mp3_file):
+        if self.audio_format == "mp3":
+            self.convert_to_mp3(mp4_file, mp3_file)
+        elif self.audio_format == "mp3_16k":
+            self.convert_to_mp3(mp4_file, mp3_file, sample_rate=16000, mono=True)
+        elif os.path.exists(mp3_file):
+            # A stale mp3 would be picked up by transcription instead of the mp4
+            os.remove(mp3_file)
+
+    @staticmethod
+    def save_metadata(metadata, save_path):
         with open(os.path.join(save_path, "metadata.json"), 'w') as fp:
             json.dump(metadata, fp)
 
-    def download_channel_videos(self, channel_url, num_videos=100):
+    @staticmethod
+    def get_channel_video_urls(channel_url, num_videos=100):
         c = Channel(channel_url)
-        for link in tqdm(c.video_urls[:num_videos]):
+        return c.video_urls[:num_videos]
+
+    def download_channel_video(self, link):
+        """
+        Downloads one video with its metadata and audio. Returns the video folder, or None when all retries
+        failed, in which case the link is added to self.failed.
+        Steps whose outputs are recorded in the folder manifest are skipped.
+        """
+        video_id = self.transport.video_id(link)
+        with recorder.measure("download", video=video_id) as counters:
+            save_path = self._download_channel_video(link, video_id)
+            counters["failed"] = int(save_path is None)
+            mp4_file = Path(self.save_folder, video_id, video_id + ".mp4")
+            counters["video_bytes"] = mp4_file.stat().st_size if mp4_file.is_file() else 0
+        return save_path
+
+    def _download_channel_video(self, link, video_id):
+        save_path = Path(self.save_folder, video_id)
+        save_path.mkdir(parents=True, exist_ok=True)
+        manifest = BuildManifest(save_path)
+        mp4_file = Path(save_path, video_id + ".mp4")
+        mp3_file = Path(save_path, video_id + ".mp3")
+        for retry in range(self.max_retries):
             try:
-                save_path = Path(self.save_folder, link.split("=")[-1])
-                save_path.mkdir(parents=True, exist_ok=False)
-                mp4_file = Path(save_path, link.split("=")[-1] + ".mp4")
-                mp3_file = Path(save_path, link.split("=")[-1] + ".mp3")
-                self.download_video(link, save_path)
-                self.convert_to_mp3(str(mp4_file), str(mp3_file))
-            except:
-                continue
+                download_params = {"link": link}
+                if not manifest.is_fresh("download", params=download_params):
+                    self.download_video(link, save_path)
+                    manifest.record("download", params=download_params,
+                                    outputs=[mp4_file, save_path / "metadata.json"])
+                audio_params = {"audio_format": self.audio_format}
+                if not manifest.is_fresh("audio", [mp4_file], audio_params):
+                    self.extract_audio(str(mp4_file), str(mp3_file))
+                    manifest.record("audio", [mp4_file], audio_params,
+                                    [mp3_file] if self.audio_format != "none" else [])
+                return save_path
+            except Exception as e:
+                print(f"Download error {link}: {e}")
+                print(f"Retry attempt {retry + 1}/{self.max_retries}")
+                if retry + 1 < self.max_retries:
+                    time.sleep(2 ** retry)  # Wait for an exponentially increasing time before retrying
+        with self._failed_lock:
+            self.failed.append(link)
+        return None
+
+    def download_channel_videos(self, channel_url, num_videos=100):
+        """
+        Downloads the latest num_videos videos of a channel, max_workers at a time.
+        Returns the links that failed.
+        """
+        links = self.get_channel_video_urls(channel_url, num_videos)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            list(tqdm(executor.map(self.download_channel_video, links), total=len(links)))
+        if self.failed:
+            print(f"Failed to download {len(self.failed)} videos: {self.failed}")
+        return self.failed
 
 
 if __name__ == "__main__":